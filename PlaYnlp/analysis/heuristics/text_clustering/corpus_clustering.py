@@ -0,0 +1,278 @@
+
+import heapq
+import time
+
+import numpy as np
+
+from PlaYnlp.sparse import L1_norm_col_summarizer as L1_col_sum
+from PlaYnlp.analysis.heuristics.text_clustering.weighted_features_methods import NeighborhoodQueryCache
+from PlaYnlp.analysis.heuristics.text_clustering.weighted_features_methods import WieghtedFeaturesStats
+from PlaYnlp.analysis.heuristics.text_clustering.weighted_features_methods import batch_find_stable_topk_neighborhood
+from PlaYnlp.analysis.heuristics.text_clustering.weighted_features_methods import batch_find_stable_eps_neighborhood
+from PlaYnlp.analysis.heuristics.text_clustering.weighted_features_methods import groups_indicator
+from PlaYnlp.analysis.heuristics.text_clustering.parallel_search import NeighborhoodSearchPool
+
+
+CLUSTERING_METHODS = ("topk", "eps")
+
+# "given": ptrs order, "random": a random permutation, "L1" / "L0": the longest docs first
+SEED_ORDERS = ("given", "random", "L1", "L0")
+
+
+def seeds_priority(sdtm, seed_order="given", random_state=None):
+    """
+    priority in (0, 1] of each doc as a seed (0 for docs which are never seeds),
+    seed_order in SEED_ORDERS or the ptrs of the seeds in order
+    """
+
+    n_docs = sdtm.shape[0]
+
+    if isinstance(seed_order, str):
+        assert seed_order in SEED_ORDERS
+
+        if seed_order == "given":
+            seeds_ptrs = np.arange(n_docs)
+        elif seed_order == "random":
+            seeds_ptrs = np.random.RandomState(random_state).permutation(n_docs)
+        else:
+            docs_lengths = sdtm.summarize_stats((seed_order,), axis=1)._data[:, 0]
+            seeds_ptrs = np.argsort(-docs_lengths, kind="mergesort")
+    else:
+        seeds_ptrs = np.asarray(seed_order, dtype=np.int64)
+
+    priority = np.zeros(n_docs)
+    priority[seeds_ptrs] = 1.0 - np.arange(len(seeds_ptrs)) / float(max(len(seeds_ptrs), 1))
+
+    return priority
+
+
+class ClusteringProgress(object):
+    """
+    throughput counters of a corpus clustering run
+    """
+
+    def __init__(self, n_docs):
+        self.n_docs = n_docs
+        self.start_time = time.time()
+
+        self.n_seeds = 0
+        self.n_skipped_seeds = 0
+        self.n_clusters = 0
+        self.n_docs_covered = 0
+
+
+    @property
+    def stats(self):
+        elapsed = time.time() - self.start_time
+
+        return {"n_seeds":self.n_seeds,
+                "n_skipped_seeds":self.n_skipped_seeds,
+                "n_clusters":self.n_clusters,
+                "n_docs_covered":self.n_docs_covered,
+                "coverage":self.n_docs_covered / float(max(self.n_docs, 1)),
+                "elapsed":elapsed,
+                "seeds_per_sec":self.n_seeds / elapsed if elapsed > 0 else 0.0,
+                "docs_per_sec":self.n_docs_covered / elapsed if elapsed > 0 else 0.0}
+
+
+class CorpusClustering(object):
+    """
+    partition the docs of an sdtm into stable neighborhoods ("topk": WieghtedFeaturesNeighborhood's stable top k,
+    "eps": the stable eps neighborhood, as the batched engine) seeded by single docs in seed_order.
+
+    a doc belongs to the first cluster containing it, the priority of an assigned doc as a seed is multiplied by
+    assigned_weight (0 skips the assigned docs, 1 ignores the assignments, in between defers them: a deferred seed
+    is skipped when its neighborhood has no unassigned docs).
+    batch_size > 1 runs batch_size seeds at a time (the assignments are then updated per batch),
+    n_jobs > 1 runs n_jobs batches at a time on a NeighborhoodSearchPool (the assignments are updated per round).
+    the clusters are streamed by iter_clusters, on_progress(ClusteringProgress.stats) is called every report_every seeds
+    and at the end.
+    """
+
+    def __init__(self, sdtm, method="topk", k=20, eps=0.1, max_iters=50, min_eps=0.05, max_group_size=50,
+                 seed_order="given", assigned_weight=0.0, batch_size=1, random_state=None,
+                 inversed_summarizer=L1_col_sum, query_cache=None, report_every=1000, on_progress=None, n_jobs=1):
+
+        assert method in CLUSTERING_METHODS
+        assert 0 <= assigned_weight <= 1
+        assert batch_size >= 1
+        assert n_jobs >= 1
+
+        self.sdtm = sdtm
+        self.method = method
+        self.k = k
+        self.eps = eps
+        self.max_iters = max_iters
+        self.min_eps = min_eps
+        self.max_group_size = max_group_size
+        self.assigned_weight = assigned_weight
+        self.batch_size = batch_size
+        self.n_jobs = n_jobs
+        self.report_every = report_every
+        self.on_progress = on_progress
+
+        self.features_stats = WieghtedFeaturesStats.of(sdtm, inversed_summarizer)
+        self.query_cache = NeighborhoodQueryCache() if query_cache is None else query_cache
+
+        self.priority = seeds_priority(sdtm, seed_order=seed_order, random_state=random_state)
+        self.labels = np.full(sdtm.shape[0], -1, dtype=np.int64)
+        self.progress = ClusteringProgress(sdtm.shape[0])
+
+        self._docs_nnzs = np.diff(self.features_stats.csr.indptr)
+        self._search_pool = None
+
+
+    @property
+    def _search_kwargs(self):
+        if self.method == "topk":
+            return {"k":self.k, "max_iters":self.max_iters, "min_eps":self.min_eps, "batch_size":self.batch_size}
+        else:
+            return {"eps":self.eps, "max_iters":self.max_iters, "max_group_size":self.max_group_size, "batch_size":self.batch_size}
+
+
+    def _pop_seeds(self, seeds_heap, reweighted, n_seeds):
+        seeds_ptrs = []
+
+        while len(seeds_heap) > 0 and len(seeds_ptrs) < n_seeds:
+            priority, seed_ptr = heapq.heappop(seeds_heap)
+
+            if self.labels[seed_ptr] >= 0 and not reweighted[seed_ptr]:
+                reweighted[seed_ptr] = True
+
+                if self.assigned_weight > 0:
+                    heapq.heappush(seeds_heap, (priority * self.assigned_weight, seed_ptr))
+                else:
+                    self.progress.n_skipped_seeds = self.progress.n_skipped_seeds + 1
+                continue
+
+            seeds_ptrs.append(seed_ptr)
+
+        return seeds_ptrs
+
+
+    def _find_clusters(self, seeds_ptrs):
+        """
+        [(cluster_ptrs, iteration stats)] of the seeds
+        """
+
+        if len(seeds_ptrs) == 0:
+            return []
+
+        if self._search_pool is not None:
+            clusters_ptrs, stats = self._search_pool.find_stable_neighborhoods([[seed_ptr] for seed_ptr in seeds_ptrs],
+                                                                               chunk_size=self.batch_size)
+        else:
+            batch_search = batch_find_stable_topk_neighborhood if self.method == "topk" else batch_find_stable_eps_neighborhood
+
+            clusters_ptrs, stats = batch_search(self.sdtm, groups_indicator([[seed_ptr] for seed_ptr in seeds_ptrs], self.sdtm.shape[0]),
+                                                inversed_summarizer=self.features_stats.inversed_summarizer,
+                                                return_stats=True, query_cache=self.query_cache,
+                                                **self._search_kwargs)
+
+        return [(cluster_ptrs, {"n_iterations":n_iterations, "termination":termination})
+                for cluster_ptrs, n_iterations, termination in zip(clusters_ptrs, stats["n_iterations"], stats["terminations"])]
+
+
+    def _report_progress(self):
+        if self.on_progress is not None:
+            self.on_progress(self.progress.stats)
+
+
+    def iter_clusters(self):
+        """
+        yield a dict per cluster: cluster_id, seed_ptr, seed_idx, cluster_ptrs, cluster_idx,
+        new_ptrs (the docs first assigned to this cluster), n_iterations and termination
+        """
+
+        seeds_heap = [(-priority, seed_ptr) for seed_ptr, priority in enumerate(self.priority) if priority > 0]
+        heapq.heapify(seeds_heap)
+
+        reweighted = np.zeros(len(self.labels), dtype=bool)
+        row_idx = self.sdtm._row_idx
+
+        if self.n_jobs > 1:
+            self._search_pool = NeighborhoodSearchPool(self.sdtm, method=self.method, n_jobs=self.n_jobs,
+                                                       inversed_summarizer=self.features_stats.inversed_summarizer,
+                                                       **self._search_kwargs)
+
+        try:
+            for cluster in self._iter_rounds(seeds_heap, reweighted, row_idx):
+                yield cluster
+
+        finally:
+            if self._search_pool is not None:
+                self._search_pool.close()
+                self._search_pool = None
+
+        self._report_progress()
+
+
+    def _iter_rounds(self, seeds_heap, reweighted, row_idx):
+        while True:
+            seeds_ptrs = self._pop_seeds(seeds_heap, reweighted, self.batch_size * self.n_jobs)
+
+            if len(seeds_ptrs) == 0:
+                break
+
+            # the docs without terms are their own clusters
+            empty_seeds = self._docs_nnzs[seeds_ptrs] == 0
+            found_clusters = iter(self._find_clusters([seed_ptr for seed_ptr, is_empty in zip(seeds_ptrs, empty_seeds) if not is_empty]))
+
+            for seed_ptr, is_empty in zip(seeds_ptrs, empty_seeds):
+                if is_empty:
+                    cluster_ptrs, stats = np.array([seed_ptr]), {"n_iterations":0, "termination":"converged"}
+                else:
+                    cluster_ptrs, stats = next(found_clusters)
+
+                self.progress.n_seeds = self.progress.n_seeds + 1
+
+                if self.labels[seed_ptr] >= 0 and self.assigned_weight == 0:
+                    # assigned by a cluster of the same batch
+                    self.progress.n_skipped_seeds = self.progress.n_skipped_seeds + 1
+                    continue
+
+                cluster_ptrs = np.unique(np.asarray(cluster_ptrs, dtype=np.int64))
+                new_ptrs = cluster_ptrs[self.labels[cluster_ptrs] < 0]
+
+                if self.labels[seed_ptr] >= 0 and self.assigned_weight < 1 and len(new_ptrs) == 0:
+                    # a deferred seed whose cluster would only repeat assigned docs
+                    self.progress.n_skipped_seeds = self.progress.n_skipped_seeds + 1
+                    continue
+
+                cluster_id = self.progress.n_clusters
+                self.labels[new_ptrs] = cluster_id
+
+                self.progress.n_clusters = self.progress.n_clusters + 1
+                self.progress.n_docs_covered = self.progress.n_docs_covered + len(new_ptrs)
+
+                if self.report_every and self.progress.n_seeds % self.report_every == 0:
+                    self._report_progress()
+
+                yield {"cluster_id":cluster_id,
+                       "seed_ptr":seed_ptr,
+                       "seed_idx":row_idx[seed_ptr],
+                       "cluster_ptrs":cluster_ptrs,
+                       "cluster_idx":row_idx[cluster_ptrs],
+                       "new_ptrs":new_ptrs,
+                       "n_iterations":stats["n_iterations"],
+                       "termination":stats["termination"]}
+
+
+    def run(self):
+        """
+        run all seeds, return labels: the cluster id of each doc (-1 for the docs in no cluster)
+        """
+
+        for _ in self.iter_clusters():
+            pass
+
+        return self.labels
+
+
+
+def cluster_corpus(sdtm, **kwargs):
+    return CorpusClustering(sdtm, **kwargs).run()
+
+
+if __name__ == '__main__':
+    pass
@@ -8,6 +8,9 @@ import numpy as np
 import scipy as sp
 from PlaYnlp.sparse import L0_norm_col_summarizer as L0_col_sum
 from PlaYnlp.sparse import L1_norm_col_summarizer as L1_col_sum
+from PlaYnlp.sparse import as_ptrs
+from PlaYnlp.join import gather_rows_ptrs
+from PlaYnlp.stats import top_k_positions
 
 
 def top_m_weighted_features_sdtm(sdtm, init_group_ptr, top_m_features=50):
@@ -33,14 +36,98 @@ def top_m_weighted_features_sdtm(sdtm, init_group_ptr, top_m_features=50):
     return results_dict
 
 
+def group_centroids(sdtm, init_group_ptrs):
+    """
+    (n_groups x n_terms) csr matrix of the mean rows of each group of rows (row ptrs or a bool row mask, as select_rows)
+    """
+
+    n_docs = sdtm._smatrix.shape[0]
+    init_group_ptrs = [as_ptrs(group_ptr, n_docs) for group_ptr in init_group_ptrs]
+
+    group_sizes = np.array([len(group_ptr) for group_ptr in init_group_ptrs], dtype=np.float64)
+    group_rows = np.concatenate(init_group_ptrs).astype(np.int64)
+    group_ids = np.repeat(np.arange(len(init_group_ptrs)), group_sizes.astype(np.int64))
+
+    indicator = sp.sparse.csr_matrix((1.0 / group_sizes[group_ids], (group_ids, group_rows)),
+                                     shape=(len(init_group_ptrs), n_docs))
+
+    return sp.sparse.csr_matrix(indicator * sdtm.smatrix_as("csr"))
+
+
+def weighted_l1_distances(sdtm, seeds_smatrix, ws):
+    """
+    (n_seeds x n_docs) weighted L1 distances sum_j ws_j * |x_ij - s_kj| between the rows of sdtm and seeds_smatrix,
+    ws is (n_terms,) or (n_seeds, n_terms).
+
+    it never densifies the sdtm: with |x - s| = |x| + |s| + (|x - s| - |x| - |s|), the last term is zero
+    unless both x and s are nonzero, so only the shared nonzeros of each (doc, seed) pair are visited.
+    """
+
+    csr, csc = sdtm.smatrix_as("csr"), sdtm.smatrix_as("csc")
+    seeds = sp.sparse.csr_matrix(seeds_smatrix)
+
+    n_docs, n_seeds = csr.shape[0], seeds.shape[0]
+    ws = np.asarray(ws, dtype=np.float64)
+    ws_2d = np.broadcast_to(ws, (n_seeds, csr.shape[1])) if ws.ndim == 1 else ws
+
+    abs_csr = csr.copy()
+    abs_csr.data = np.abs(abs_csr.data)
+
+    # sum_j ws_kj * |x_ij| + sum_j ws_kj * |s_kj|
+    seed_entry_ids = np.repeat(np.arange(n_seeds), np.diff(seeds.indptr))
+    seed_ws = ws_2d[seed_entry_ids, seeds.indices]
+
+    distances = np.asarray(abs_csr * ws_2d.T).T
+    distances = distances + np.bincount(seed_entry_ids, weights=seed_ws * np.abs(seeds.data), minlength=n_seeds)[:, None]
+
+    # shared nonzeros: the docs of each seed's terms
+    doc_ptrs, doc_nnzs = gather_rows_ptrs(csc.indptr, seeds.indices)
+
+    xx = csc.data[doc_ptrs]
+    ss = np.repeat(seeds.data, doc_nnzs)
+    shared = np.repeat(seed_ws, doc_nnzs) * (np.abs(xx - ss) - np.abs(xx) - np.abs(ss))
+
+    distances = distances + np.bincount(np.repeat(seed_entry_ids, doc_nnzs) * n_docs + csc.indices[doc_ptrs],
+                                        weights=shared,
+                                        minlength=n_seeds * n_docs).reshape((n_seeds, n_docs))
+
+    return distances
+
+
+def batch_weighted_features_knn(sdtm, init_group_ptrs, ws, top_k=20, chunk_size=64):
+    """
+    weighted_features_knn of many seed groups at once, ws is (n_terms,) or (n_groups, n_terms),
+    the groups are processed in chunks of chunk_size to bound the (chunk_size x n_docs) distance block
+    """
+
+    ws = np.asarray(ws, dtype=np.float64)
+    results = []
+
+    for start in range(0, len(init_group_ptrs), chunk_size):
+        chunk_group_ptrs = init_group_ptrs[start:start + chunk_size]
+        chunk_ws = ws if ws.ndim == 1 else ws[start:start + chunk_size]
+
+        distances = weighted_l1_distances(sdtm, group_centroids(sdtm, chunk_group_ptrs), chunk_ws)
+
+        for ws_norm in distances:
+            max_ws_norm = np.max(ws_norm)
+            if max_ws_norm > 0:
+                ws_norm = ws_norm / max_ws_norm
+
+            top_k_ptrs = top_k_positions(ws_norm, k=top_k, reverse=True)
+
+            results_dict = {}
+            results_dict["top_k_ptrs"] = top_k_ptrs
+            results_dict["top_k_idx"] = sdtm._row_idx[top_k_ptrs]
+            results_dict["top_k_scores"] = ws_norm[top_k_ptrs]
+            results.append(results_dict)
+
+    return results
+
+
 def weighted_features_knn(sdtm, init_group_ptr, ws, top_k=20):
-    diff = sdtm._smatrix - sp.sparse.kron(np.ones(len(sdtm._row_idx)), sdtm.select_rows(init_group_ptr)._smatrix.T).T
-    ws_norm = np.apply_along_axis(lambda xx: (np.multiply(ws, np.abs(xx)).sum()), 1, diff.todense())
-    ws_norm = ws_norm / np.max(ws_norm)
-    results_dict = {}
-    results_dict["top_k_idx"] = sdtm._row_idx[ws_norm.argsort()[:top_k]]
-    results_dict["top_k_scores"] = ws_norm[ws_norm.argsort()[:top_k]]
-    return results_dict
+    # the seed of a group is the mean of its rows (the row itself for a single-row group)
+    return batch_weighted_features_knn(sdtm, [init_group_ptr], ws, top_k=top_k)[0]
 
 
 if __name__ == '__main__':
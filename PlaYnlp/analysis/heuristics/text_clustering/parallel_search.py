@@ -0,0 +1,142 @@
+
+import multiprocessing
+
+import numpy as np
+
+from PlaYnlp.sparse import L1_norm_col_summarizer as L1_col_sum
+from PlaYnlp.shared import share_sdf, attach_sdf
+from PlaYnlp.analysis.heuristics.text_clustering.weighted_features_methods import NeighborhoodQueryCache
+from PlaYnlp.analysis.heuristics.text_clustering.weighted_features_methods import WieghtedFeaturesStats
+from PlaYnlp.analysis.heuristics.text_clustering.weighted_features_methods import batch_find_stable_topk_neighborhood
+from PlaYnlp.analysis.heuristics.text_clustering.weighted_features_methods import batch_find_stable_eps_neighborhood
+from PlaYnlp.analysis.heuristics.text_clustering.weighted_features_methods import groups_indicator
+
+
+BATCH_SEARCHES = {"topk":batch_find_stable_topk_neighborhood,
+                  "eps":batch_find_stable_eps_neighborhood}
+
+
+# the state of a worker process, set once by _init_search_worker
+_worker_state = {}
+
+
+def _init_search_worker(sdtm, method, inversed_summarizer, search_kwargs, shared_handle=None):
+    # with the fork start method the sdtm is inherited, else it is pickled once per worker (never per task),
+    # or it is attached from the shared memory block of shared_handle
+    if shared_handle is not None:
+        sdtm = attach_sdf(shared_handle)
+
+    _worker_state["sdtm"] = sdtm
+    _worker_state["search"] = BATCH_SEARCHES[method]
+    _worker_state["inversed_summarizer"] = inversed_summarizer
+    _worker_state["search_kwargs"] = search_kwargs
+    _worker_state["query_cache"] = NeighborhoodQueryCache()
+
+    # the corpus stats and both csr / csc forms are built once per worker
+    WieghtedFeaturesStats.of(sdtm, inversed_summarizer).inverted_index
+
+
+def _search_seeds(seeds_groups):
+    sdtm = _worker_state["sdtm"]
+
+    groups, stats = _worker_state["search"](sdtm, groups_indicator(seeds_groups, sdtm.shape[0]),
+                                            inversed_summarizer=_worker_state["inversed_summarizer"],
+                                            return_stats=True,
+                                            query_cache=_worker_state["query_cache"],
+                                            **_worker_state["search_kwargs"])
+
+    return groups, stats["n_iterations"], stats["terminations"]
+
+
+class NeighborhoodSearchPool(object):
+    """
+    a process pool running the batched stable neighborhood search (method in BATCH_SEARCHES) of seed groups,
+    the workers attach to the sdtm once at start, the tasks only carry the seed groups' ptrs.
+    search_kwargs are the batch search's parameters (k, eps, max_iters, min_eps, max_group_size, batch_size, ...)
+
+    with shared=True the sdtm's buffers are published once into shared memory (PlaYnlp.shared) and
+    the workers attach to them instead of receiving a copy, the block is released by close()
+    """
+
+    def __init__(self, sdtm, method="topk", n_jobs=None, inversed_summarizer=L1_col_sum, start_method=None, shared=False,
+                 **search_kwargs):
+        assert method in BATCH_SEARCHES
+
+        self.sdtm = sdtm
+        self.method = method
+        self.n_jobs = multiprocessing.cpu_count() if n_jobs is None else n_jobs
+
+        # the parent's csr / csc forms are built before the fork and shared copy on write
+        WieghtedFeaturesStats.of(sdtm, inversed_summarizer).inverted_index
+
+        self._shared = share_sdf(sdtm) if shared else None
+
+        if self._shared is not None:
+            initargs = (None, method, inversed_summarizer, search_kwargs, self._shared.handle)
+        else:
+            initargs = (sdtm, method, inversed_summarizer, search_kwargs)
+
+        context = multiprocessing.get_context(start_method)
+        self._pool = context.Pool(processes=self.n_jobs,
+                                  initializer=_init_search_worker,
+                                  initargs=initargs)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+        if self._shared is not None:
+            self._shared.close()
+            self._shared = None
+
+
+    def find_stable_neighborhoods(self, seeds_groups, chunk_size=64):
+        """
+        return (groups, stats) in seeds_groups' order: the stable neighborhoods' ptrs and
+        {"n_iterations": int array, "terminations": str array} of each seed group
+        """
+
+        assert self._pool is not None
+
+        seeds_groups = list(seeds_groups)
+        chunks = [seeds_groups[start:start + chunk_size] for start in range(0, len(seeds_groups), chunk_size)]
+
+        groups, n_iterations, terminations = [], [], []
+
+        # imap keeps the chunks' order
+        for chunk_groups, chunk_n_iterations, chunk_terminations in self._pool.imap(_search_seeds, chunks):
+            groups.extend(chunk_groups)
+            n_iterations.append(chunk_n_iterations)
+            terminations.append(chunk_terminations)
+
+        stats = {"n_iterations":np.concatenate(n_iterations) if len(n_iterations) > 0 else np.empty(0, dtype=np.int64),
+                 "terminations":np.concatenate(terminations) if len(terminations) > 0 else np.empty(0, dtype=object)}
+
+        return groups, stats
+
+
+def parallel_find_stable_neighborhoods(sdtm, seeds_groups, method="topk", n_jobs=None, chunk_size=64,
+                                       inversed_summarizer=L1_col_sum, **search_kwargs):
+    """
+    the stable neighborhoods of seeds_groups (lists of doc ptrs) over n_jobs processes,
+    return (groups, stats) in seeds_groups' order (NeighborhoodSearchPool.find_stable_neighborhoods)
+    """
+
+    with NeighborhoodSearchPool(sdtm, method=method, n_jobs=n_jobs, inversed_summarizer=inversed_summarizer,
+                                **search_kwargs) as search_pool:
+        return search_pool.find_stable_neighborhoods(seeds_groups, chunk_size=chunk_size)
+
+
+if __name__ == '__main__':
+    pass
@@ -1,26 +1,377 @@
 
+from collections import deque, OrderedDict
+import threading
+
 import numpy as np
+from scipy import sparse
 
+from PlaYnlp.inverted_index import InvertedIndex
+from PlaYnlp.sparse import BUFFER_SUMMARIZERS
+from PlaYnlp.sparse import reduce_by_state
 from PlaYnlp.sparse import L0_norm_col_summarizer as L0_col_sum
 from PlaYnlp.sparse import L1_norm_col_summarizer as L1_col_sum
+from PlaYnlp.stats import top_k_positions
+
+
+def neighborhood_fingerprint(ptrs):
+    # a compact id of the set of ptrs
+    return hash(np.unique(np.asarray(ptrs, dtype=np.int64)).tobytes())
+
+
+def neighborhood_distance(ptrs, other_ptrs):
+    """
+    jaccard distance of the sets of ptrs: len(symmetric difference) / len(union)
+    """
+
+    ptrs, other_ptrs = np.asarray(ptrs, dtype=np.int64), np.asarray(other_ptrs, dtype=np.int64)
+    n_union = len(np.union1d(ptrs, other_ptrs))
+
+    return len(np.setxor1d(ptrs, other_ptrs)) / float(n_union) if n_union > 0 else 0.0
+
+
+class NeighborhoodIterationTracker(object):
+    """
+    the stopping rule of the find_stable_* loops, a loop stops when
+      "converged": two consecutive neighborhoods are within min_eps (neighborhood_distance, 0 means equal sets),
+      "max_group_size": the new neighborhood is larger than max_group_size,
+      "cycle": the new neighborhood is one of the last history_size neighborhoods (kept as fingerprints),
+      "max_iters": after max_iters + 1 iterations
+    """
+
+    def __init__(self, init_ptrs, max_iters=50, min_eps=0.0, max_group_size=None, history_size=8):
+        self.max_iters = max_iters
+        self.min_eps = min_eps
+        self.max_group_size = max_group_size
+
+        self.n_iterations = 0
+        self.termination = None
+        self.history = deque([neighborhood_fingerprint(init_ptrs)], maxlen=history_size)
+
+
+    def step(self, old_ptrs, new_ptrs, converged=None):
+        """
+        record one iteration old_ptrs -> new_ptrs and return whether to iterate again,
+        converged overrides the min_eps rule
+        """
+
+        self.n_iterations = self.n_iterations + 1
+        new_fingerprint = neighborhood_fingerprint(new_ptrs)
+
+        if converged is None:
+            converged = neighborhood_distance(old_ptrs, new_ptrs) <= self.min_eps
+
+        if self.max_group_size is not None and len(new_ptrs) > self.max_group_size:
+            self.termination = "max_group_size"
+        elif converged:
+            self.termination = "converged"
+        elif new_fingerprint in self.history:
+            self.termination = "cycle"
+        elif self.n_iterations > self.max_iters + 1:
+            self.termination = "max_iters"
+
+        self.history.append(new_fingerprint)
+
+        return self.termination is None
+
+
+    @property
+    def stats(self):
+        return {"n_iterations":self.n_iterations,
+                "termination":self.termination}
+
+
+class NeighborhoodQueryCache(object):
+    """
+    thread safe LRU cache of neighborhood queries, shared by the iterations of all seeds (and threads):
+    (features stats of an sdtm, query, sorted init ptrs) -> neighbors ptrs (read only),
+    query is e.g. ("topk_neighbors", k, reverse) or ("mins_neighbors", mins)
+    """
+
+    def __init__(self, max_size=65536):
+        self.max_size = max_size
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    @staticmethod
+    def query_key(features_stats, query, init_ptrs):
+        # the features stats (one per sdtm and inversed summarizer) stand for the sdtm's identity
+        return (features_stats, query, np.sort(np.asarray(init_ptrs, dtype=np.int64)).tobytes())
+
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits = self.hits + 1
+                return self._entries[key]
+
+            self.misses = self.misses + 1
+            return None
+
+
+    def put(self, key, neighbors_ptrs):
+        neighbors_ptrs = np.array(neighbors_ptrs, dtype=np.int64)
+        neighbors_ptrs.setflags(write=False)
+
+        with self._lock:
+            self._entries[key] = neighbors_ptrs
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+        return neighbors_ptrs
+
+
+    def get_or_compute(self, key, compute):
+        # compute() runs outside of the lock, concurrent misses of a key may compute it more than once
+        neighbors_ptrs = self.get(key)
+
+        if neighbors_ptrs is None:
+            neighbors_ptrs = self.put(key, compute())
+
+        return neighbors_ptrs
+
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+    @property
+    def stats(self):
+        with self._lock:
+            n_queries = self.hits + self.misses
+
+            return {"size":len(self._entries),
+                    "max_size":self.max_size,
+                    "hits":self.hits,
+                    "misses":self.misses,
+                    "hit_rate":self.hits / float(n_queries) if n_queries > 0 else 0.0}
+
+
+def cached_neighbors_ptrs(query_cache, features_stats, query, init_ptrs, compute):
+    if query_cache is None:
+        return compute()
+
+    return query_cache.get_or_compute(query_cache.query_key(features_stats, query, init_ptrs), compute)
+
+
+class WieghtedFeaturesStats(object):
+    """
+    the corpus level column stats of an sdtm (the inversed column weights), computed once per sdtm
+    and shared by the neighborhoods of all iterations and seeds,
+    only the seed dependent weights and row scores are computed for each group of init_ptrs
+    """
+
+    def __init__(self, sdtm, inversed_summarizer=L1_col_sum):
+        self.sdtm = sdtm
+        self.inversed_summarizer = inversed_summarizer
+        self.csr = sdtm.smatrix_as("csr")
+
+        with np.errstate(divide="ignore"):
+            self.all_inversed_wieghts = 1.0 / sdtm.summarize_sdf(inversed_summarizer)._data
+
+
+    @classmethod
+    def of(cls, sdtm, inversed_summarizer=L1_col_sum):
+        # kept in the sdtm, one per inversed_summarizer
+        if not "wieghted_features_stats" in sdtm.keys():
+            sdtm["wieghted_features_stats"] = {}
+
+        features_stats = sdtm["wieghted_features_stats"].get(inversed_summarizer)
+
+        if features_stats is None or not features_stats.is_stats_of(sdtm):
+            features_stats = cls(sdtm, inversed_summarizer)
+            sdtm["wieghted_features_stats"][inversed_summarizer] = features_stats
+
+        return features_stats
+
+
+    def is_stats_of(self, sdtm):
+        return self.sdtm is sdtm and self.csr is sdtm.smatrix_as("csr")
+
+
+    def within_wieghts(self, init_ptrs):
+        # not cached: every group of init_ptrs is seen once or twice
+        return self.sdtm.select_rows(init_ptrs).summarize_sdf(self.sdtm["summarizer"], use_cache=False)._data
+
+
+    def seed_wieghts(self, init_ptrs):
+        """
+        return (active_features_ptrs, within_wieghts, words_weights) of the group of init_ptrs
+        """
+
+        all_within_wieghts = self.within_wieghts(init_ptrs)
+
+        active_features_ptrs = np.nonzero(all_within_wieghts > 0)[0]
+        within_wieghts = all_within_wieghts[active_features_ptrs]
+
+        words_weights = self.all_inversed_wieghts[active_features_ptrs] * within_wieghts
+        words_weights = words_weights / words_weights.sum()
+
+        return active_features_ptrs, within_wieghts, words_weights
+
+
+    def weighted_scores(self, active_features_ptrs, words_weights):
+        """
+        the words_weights weighted sum of the active features of each row
+        """
+
+        all_words_weights = np.zeros(self.csr.shape[1])
+        all_words_weights[active_features_ptrs] = words_weights
+
+        return self.csr.dot(all_words_weights)
+
+
+    @property
+    def inverted_index(self):
+        return InvertedIndex.of(self.sdtm)
+
+
+    def candidate_scores(self, active_features_ptrs, words_weights):
+        """
+        return (doc_ptrs, scores) of only the docs sharing an active feature with the seed group
+        (the union of the active features' posting lists), the other docs score 0
+        """
+
+        return self.inverted_index.score(active_features_ptrs, words_weights)
+
+
+    def topk_neighbors_ptrs(self, init_ptrs, k=20, reverse=False, query_cache=None):
+        def compute():
+            active_features_ptrs, _, words_weights = self.seed_wieghts(init_ptrs)
+            doc_ptrs, scores = self.candidate_scores(active_features_ptrs, words_weights)
+
+            return sparse_scores_top_k(scores, doc_ptrs, self.csr.shape[0], k=k, reverse=reverse)
+
+        return cached_neighbors_ptrs(query_cache, self, ("topk_neighborhood", k, reverse), init_ptrs, compute)
+
+
+    def eps_neighbors_ptrs(self, init_ptrs, eps=0.1, query_cache=None):
+        def compute():
+            active_features_ptrs, _, words_weights = self.seed_wieghts(init_ptrs)
+            doc_ptrs, scores = self.candidate_scores(active_features_ptrs, words_weights)
+
+            return sparse_scores_above(scores, doc_ptrs, self.csr.shape[0], eps)
+
+        return cached_neighbors_ptrs(query_cache, self, ("eps_neighborhood", eps), init_ptrs, compute)
+
+
+    @property
+    def within_csr(self):
+        """
+        the csr whose column sums over a group of rows are the sdtm's default summary (L1 / L0 summarizers)
+        """
+
+        if not hasattr(self, "_within_csr"):
+            assert self.sdtm["summarizer"] in BUFFER_SUMMARIZERS
+            stat, _ = BUFFER_SUMMARIZERS[self.sdtm["summarizer"]]
+
+            self._within_csr = self.csr.copy()
+            self._within_csr.data = np.abs(self.csr.data) if stat == "L1" else np.sign(self.csr.data)
+
+        return self._within_csr
+
+
+    def batch_words_weights(self, seeds_indicator):
+        """
+        (n_seeds x n_terms) csr of the words_weights of each seed (row of the seeds x docs seeds_indicator),
+        the within weights of all seeds are one sparse matmul
+        """
+
+        within_wieghts = sparse.csr_matrix(sparse.csr_matrix(seeds_indicator) * self.within_csr)
+
+        within_wieghts.data[within_wieghts.data < 0] = 0
+        within_wieghts.eliminate_zeros()
+
+        # terms in order, as seed_wieghts
+        within_wieghts.sort_indices()
+
+        words_weights = within_wieghts
+        words_weights.data = words_weights.data * self.all_inversed_wieghts[words_weights.indices]
+
+        # the sums of all rows at once, reduceat would give an empty row its next row's first entry
+        indptr, row_nnzs = words_weights.indptr, np.diff(words_weights.indptr)
+        weights_sums = np.zeros(words_weights.shape[0], dtype=words_weights.data.dtype)
+        weights_sums[row_nnzs > 0] = np.add.reduceat(words_weights.data, indptr[:-1][row_nnzs > 0])
+
+        words_weights.data = words_weights.data / np.repeat(weights_sums, row_nnzs)
+
+        return words_weights
+
+
+    def batch_weighted_scores(self, seeds_indicator):
+        """
+        return (scores, has_active_features): the (n_seeds x n_docs) csr weighted scores of all docs for each seed
+        (a second sparse matmul, docs sharing no active feature are implicit zeros)
+        and whether each seed has active features
+        """
+
+        words_weights = self.batch_words_weights(seeds_indicator)
+
+        # the transpose of the csc is the (n_terms x n_docs) csr
+        scores = sparse.csr_matrix(words_weights * self.sdtm.smatrix_as("csc").T)
+
+        return scores, np.diff(words_weights.indptr) > 0
+
+
+    def weighted_summary(self, init_ptrs):
+        active_features_ptrs, _, words_weights = self.seed_wieghts(init_ptrs)
+
+        return self.sdtm._summerizer_class(summary_data=self.weighted_scores(active_features_ptrs, words_weights),
+                                           summary_idx=self.sdtm._row_idx,
+                                           sdf=self.sdtm.select_columns(active_features_ptrs))
+
 
 
 class WieghtedFeaturesNeighborhood(dict):
     _key_mapper = {"proj_sdtm":"projected_sdtm",
                    "inv_summarizer":"inversed_summarizer", }
 
-    def __init__(self, sdtm, init_ptrs, inversed_summarizer=L1_col_sum):
+    # seed dependent keys, computed on first access (a neighborhood whose neighbors are cached never needs them)
+    _seed_lazy_keys = ("active_features_ptrs", "within_wieghts", "words_weights", "projected_sdtm")
+
+    def __init__(self, sdtm, init_ptrs, inversed_summarizer=L1_col_sum, features_stats=None, query_cache=None):
         self["sdtm"] = sdtm
         self["init_ptrs"] = init_ptrs
 
+        if features_stats is None:
+            features_stats = WieghtedFeaturesStats.of(sdtm, inversed_summarizer)
+
+        self["features_stats"] = features_stats
+        self["inversed_summarizer"] = features_stats.inversed_summarizer
+        self["query_cache"] = query_cache
+
+
+    def __missing__(self, key):
+        if not key in self._seed_lazy_keys or "active_features_ptrs" in self.keys():
+            raise KeyError(key)
+
+        (self["active_features_ptrs"],
+         self["within_wieghts"],
+         self["words_weights"]) = self["features_stats"].seed_wieghts(self["init_ptrs"])
+
         if self._has_active_features:
-            self["projected_sdtm"] = self["sdtm"].select_columns(self["sdtm"].select_rows(self["init_ptrs"]).summary > 0)
-            self["inversed_summarizer"] = inversed_summarizer
+            self["projected_sdtm"] = self["sdtm"].select_columns(self["active_features_ptrs"])
+
+        return self[key]
 
 
     @property
     def _active_features_ptrs(self):
-        return (self["sdtm"].select_rows(self["init_ptrs"]).summary > 0)._filtered_ptrs
+        return self["active_features_ptrs"]
 
 
     @property
@@ -29,12 +380,19 @@ class WieghtedFeaturesNeighborhood(dict):
 
 
 
+    def __reduce_ex__(self, protocol):
+        return reduce_by_state(self)
+
+
     def __getstate__(self):
-        pass
+        # the corpus stats are rebuilt from the sdtm, the seed keys on demand, the query cache is not kept
+        return {"sdtm":self["sdtm"],
+                "init_ptrs":self["init_ptrs"],
+                "inversed_summarizer":self["inversed_summarizer"]}
 
 
     def __setstate__(self, state):
-        pass
+        self.__init__(state["sdtm"], state["init_ptrs"], inversed_summarizer=state["inversed_summarizer"])
 
 
     def __getattr__(self, key):
@@ -49,29 +407,45 @@ class WieghtedFeaturesNeighborhood(dict):
                 return None
 
 
+    @property
+    def _projected_sdtm(self):
+        if self._has_active_features:
+            return self["projected_sdtm"]
+
+
+    @property
+    def _proj_sdtm(self):
+        return self._projected_sdtm
+
+
     @property
     def _within_wieghts(self):
         if self._has_active_features:
-            return self["projected_sdtm"].select_rows(self["init_ptrs"]).summary._data
+            return self["within_wieghts"]
 
 
     @property
     def _all_inversed_wieghts(self):
         if self._has_active_features:
-            return 1.0 / self["projected_sdtm"].summarize_sdf(self["inversed_summarizer"])._data
+            return self["features_stats"].all_inversed_wieghts[self["active_features_ptrs"]]
 
 
     @property
     def _words_weights(self):
         if self._has_active_features:
-            temp_words_weights = self._all_inversed_wieghts * self._within_wieghts
-            return temp_words_weights / temp_words_weights.sum()
+            return self["words_weights"]
 
 
     @property
     def _weighted_summary(self):
         if self._has_active_features:
-            return self["projected_sdtm"].summarize_sdf(lambda xx:self._words_weights * xx.T)
+            if not "weighted_summary" in self.keys():
+                weighted_scores = self["features_stats"].weighted_scores(self["active_features_ptrs"], self["words_weights"])
+                self["weighted_summary"] = self["sdtm"]._summerizer_class(summary_data=weighted_scores,
+                                                                          summary_idx=self["sdtm"]._row_idx,
+                                                                          sdf=self["projected_sdtm"])
+
+            return self["weighted_summary"]
 
 
     def get_topk_words_of_within_weights(self, k=5):
@@ -84,8 +458,14 @@ class WieghtedFeaturesNeighborhood(dict):
 
 
     def get_topk_neighbors_ptrs(self, k=20, reverse=False):
+        return cached_neighbors_ptrs(self["query_cache"], self["features_stats"], ("topk_neighbors", k, reverse), self["init_ptrs"],
+                                     lambda:self._compute_topk_neighbors_ptrs(k=k, reverse=reverse))
+
+
+    def _compute_topk_neighbors_ptrs(self, k=20, reverse=False):
         if self._has_active_features:
-            return self._weighted_summary.top_k_ptrs(k, reverse)
+            doc_ptrs, scores = self["features_stats"].candidate_scores(self["active_features_ptrs"], self["words_weights"])
+            return sparse_scores_top_k(scores, doc_ptrs, self["sdtm"].shape[0], k=k, reverse=reverse)
         else:
             return self["init_ptrs"]
 
@@ -98,62 +478,54 @@ class WieghtedFeaturesNeighborhood(dict):
     def get_topk_neighbors(self, k=20, reverse=False):
         return type(self)(sdtm=self._sdtm,
                           init_ptrs=self.get_topk_neighbors_ptrs(k=k, reverse=reverse),
-                          inversed_summarizer=self._inversed_summarizer)
+                          inversed_summarizer=self._inversed_summarizer,
+                          features_stats=self._features_stats,
+                          query_cache=self._query_cache)
 
 
-    def find_stable_topk_neighborhood(self, k=20, max_iters=50, min_eps=0.1, reverse=False, return_type="ptr"):
+    def find_stable_topk_neighborhood(self, k=20, max_iters=50, min_eps=0.1, reverse=False, return_type="ptr",
+                                      return_stats=False, history_size=8):
         """
-        return_type in ("ptr","idx","nbhd")
+        return_type in ("ptr","idx","nbhd"),
+        with return_stats returns (neighborhood, NeighborhoodIterationTracker.stats)
         """
 
         assert return_type in ("ptr", "idx", "nbhd")
 
-        n_iteration = 0
+        tracker = NeighborhoodIterationTracker(self._init_ptrs, max_iters=max_iters, min_eps=min_eps, history_size=history_size)
 
         old_neighborhood = self
-        old_neighborhood_ptrs_set = set(old_neighborhood._init_ptrs)
-
-
         new_neighborhood = old_neighborhood.get_topk_neighbors(k=k, reverse=reverse)
-        new_neighborhood_ptrs_set = set(new_neighborhood._init_ptrs)
-
-        sym_diff = new_neighborhood_ptrs_set.symmetric_difference(old_neighborhood_ptrs_set)
-
-        #TODO: with min_eps constraint
-        do_iteration = (len(sym_diff) > 0) and (n_iteration <= max_iters)
-
-        while do_iteration:
-
-            n_iteration = n_iteration + 1
-            #print "n_iteration = ",n_iteration
 
+        while tracker.step(old_neighborhood._init_ptrs, new_neighborhood._init_ptrs):
             old_neighborhood = new_neighborhood
-            old_neighborhood_ptrs_set = set(old_neighborhood._init_ptrs)
-
-
             new_neighborhood = old_neighborhood.get_topk_neighbors(k=k, reverse=reverse)
-            new_neighborhood_ptrs_set = set(new_neighborhood._init_ptrs)
-
-            sym_diff = new_neighborhood_ptrs_set.symmetric_difference(old_neighborhood_ptrs_set)
-
-            #TODO: with min_eps constraint
-            do_iteration = (len(sym_diff) > 0) and (n_iteration <= max_iters)
-
 
         return_neighborhood = new_neighborhood
 
+        return self._stable_neighborhood_result(return_neighborhood, return_type, tracker if return_stats else None)
+
 
+    def _stable_neighborhood_result(self, return_neighborhood, return_type, tracker=None):
         if return_type == "ptr":
-            return return_neighborhood._init_ptrs
+            result = return_neighborhood._init_ptrs
         elif return_type == "nbhd":
-            return return_neighborhood
+            result = return_neighborhood
         elif return_type == "idx":
-            return self._sdtm._row_idx[return_neighborhood._init_ptrs]
+            result = self._sdtm._row_idx[return_neighborhood._init_ptrs]
+
+        return result if tracker is None else (result, tracker.stats)
 
 
     def get_mins_neighbors_ptrs(self, mins=0.1):
+        return cached_neighbors_ptrs(self["query_cache"], self["features_stats"], ("mins_neighbors", mins), self["init_ptrs"],
+                                     lambda:self._compute_mins_neighbors_ptrs(mins=mins))
+
+
+    def _compute_mins_neighbors_ptrs(self, mins=0.1):
         if self._has_active_features:
-            return (self._weighted_summary >= mins)._filtered_ptrs
+            doc_ptrs, scores = self["features_stats"].candidate_scores(self["active_features_ptrs"], self["words_weights"])
+            return sparse_scores_above(scores, doc_ptrs, self["sdtm"].shape[0], mins)
         else:
             return self["init_ptrs"]
 
@@ -166,178 +538,294 @@ class WieghtedFeaturesNeighborhood(dict):
     def get_mins_neighbors(self, mins=0.1):
         return type(self)(sdtm=self._sdtm,
                           init_ptrs=self.get_mins_neighbors_ptrs(mins=mins),
-                          inversed_summarizer=self._inversed_summarizer)
+                          inversed_summarizer=self._inversed_summarizer,
+                          features_stats=self._features_stats,
+                          query_cache=self._query_cache)
 
 
-    def find_stable_mins_neighborhood(self, mins=0.1, max_iters=50, max_group_size=50, return_type="ptr"):
+    def find_stable_mins_neighborhood(self, mins=0.1, max_iters=50, max_group_size=50, return_type="ptr",
+                                      return_stats=False, history_size=8):
         """
-        return_type in ("ptr","idx","nbhd")
+        return_type in ("ptr","idx","nbhd"),
+        with return_stats returns (neighborhood, NeighborhoodIterationTracker.stats)
         """
 
         assert return_type in ("ptr", "idx", "nbhd")
 
-        n_iteration = 0
+        tracker = NeighborhoodIterationTracker(self._init_ptrs, max_iters=max_iters, max_group_size=max_group_size, history_size=history_size)
 
         old_neighborhood = self
-        old_neighborhood_ptrs_set = set(old_neighborhood._init_ptrs)
+        new_neighborhood = old_neighborhood.get_mins_neighbors(mins=mins)
 
+        while tracker.step(old_neighborhood._init_ptrs, new_neighborhood._init_ptrs):
+            old_neighborhood = new_neighborhood
+            new_neighborhood = old_neighborhood.get_mins_neighbors(mins=mins)
 
-        new_neighborhood = old_neighborhood.get_mins_neighbors(mins=mins)
-        new_neighborhood_ptrs_set = set(new_neighborhood._init_ptrs)
+        return_neighborhood = new_neighborhood if tracker.termination == "max_group_size" else old_neighborhood
 
-        sym_diff = new_neighborhood_ptrs_set.symmetric_difference(old_neighborhood_ptrs_set)
+        return self._stable_neighborhood_result(return_neighborhood, return_type, tracker if return_stats else None)
 
-        do_iteration = (len(sym_diff) > 0) and (n_iteration <= max_iters) and (len(new_neighborhood_ptrs_set) <= max_group_size)
 
-        while do_iteration:
 
-            n_iteration = n_iteration + 1
-            #print "n_iteration = ",n_iteration
 
-            old_neighborhood = new_neighborhood
-            old_neighborhood_ptrs_set = set(old_neighborhood._init_ptrs)
 
 
-            new_neighborhood = old_neighborhood.get_mins_neighbors(mins=mins)
-            new_neighborhood_ptrs_set = set(new_neighborhood._init_ptrs)
 
-            sym_diff = new_neighborhood_ptrs_set.symmetric_difference(old_neighborhood_ptrs_set)
+def weighted_features_summarizer(sdtm, init_group_ptr):
+    return WieghtedFeaturesStats.of(sdtm, L1_col_sum).weighted_summary(init_group_ptr)
 
-            do_iteration = (len(sym_diff) > 0) and (n_iteration <= max_iters) and (len(new_neighborhood_ptrs_set) <= max_group_size)
 
+def get_eps_neighborhood_ptrs(sdtm, init_group_ptr=[], eps=0.1, query_cache=None):
+    return WieghtedFeaturesStats.of(sdtm, L1_col_sum).eps_neighbors_ptrs(init_group_ptr, eps=eps, query_cache=query_cache)
 
-        return_neighborhood = new_neighborhood if  len(new_neighborhood_ptrs_set) > max_group_size else old_neighborhood
+def get_eps_neighborhood_idx(sdtm, init_group_ptr=[], eps=0.1):
+    return sdtm._row_idx[get_eps_neighborhood_ptrs(sdtm=sdtm, init_group_ptr=init_group_ptr, eps=eps)]
 
-        if return_type == "ptr":
-            return return_neighborhood._init_ptrs
-        elif return_type == "nbhd":
-            return return_neighborhood
-        elif return_type == "idx":
-            return self._sdtm._row_idx[return_neighborhood._init_ptrs]
 
+def get_topk_neighborhood_ptrs(sdtm, init_group_ptr=[], k=20, reverse=False, query_cache=None):
+    return WieghtedFeaturesStats.of(sdtm, L1_col_sum).topk_neighbors_ptrs(init_group_ptr, k=k, reverse=reverse, query_cache=query_cache)
 
 
+def get_topk_neighborhood_idx(sdtm, init_group_ptr=[], k=20, reverse=False):
+    return sdtm._row_idx[get_topk_neighborhood_ptrs(sdtm=sdtm, init_group_ptr=init_group_ptr, k=k, reverse=reverse)]
 
 
+def find_stable_eps_neighborhood(sdtm, init_group_ptr=[], eps=0.1, max_iters=50, max_group_size=50,
+                                 return_stats=False, history_size=8, query_cache=None):
+    """
+    with return_stats returns (group_ptr, NeighborhoodIterationTracker.stats)
+    """
 
+    #TODO: if not isinstance(init_group_ptr, (np.int,np.bool)):
 
-def weighted_features_summarizer(sdtm, init_group_ptr):
-    sdtm_proj_on_group_sdtm = sdtm.select_rows(init_group_ptr)
-    filtered_words_sdtm = sdtm.select_columns(sdtm_proj_on_group_sdtm.summary > 0)
-    within_wieghts = filtered_words_sdtm.select_rows(init_group_ptr).summary._data
+    tracker = NeighborhoodIterationTracker(init_group_ptr, max_iters=max_iters, max_group_size=max_group_size, history_size=history_size)
 
-    all_weights = 1.0 / filtered_words_sdtm.summarize_sdf(L1_col_sum)._data
-    words_weights = all_weights * within_wieghts
-    words_weights = words_weights / words_weights.sum()
+    old_group_ptr = init_group_ptr
+    new_group_ptr = get_eps_neighborhood_ptrs(sdtm=sdtm,
+                                               init_group_ptr=old_group_ptr,
+                                               eps=eps,
+                                               query_cache=query_cache)
 
-    sdtm_weighted_summary = filtered_words_sdtm.summarize_sdf(lambda xx:words_weights * xx.T)
+    # converged as soon as the group size is stable
+    while tracker.step(old_group_ptr, new_group_ptr, converged=len(old_group_ptr) == len(new_group_ptr)):
+        old_group_ptr = new_group_ptr
+        new_group_ptr = get_eps_neighborhood_ptrs(sdtm=sdtm,
+                                                   init_group_ptr=old_group_ptr,
+                                                   eps=eps,
+                                                   query_cache=query_cache)
 
-    return sdtm_weighted_summary
+    group_ptr = new_group_ptr if tracker.termination == "max_group_size" else old_group_ptr
 
+    return (group_ptr, tracker.stats) if return_stats else group_ptr
 
-def get_eps_neighborhood_ptrs(sdtm, init_group_ptr=[], eps=0.1):
-    return (weighted_features_summarizer(sdtm=sdtm, init_group_ptr=init_group_ptr) >= eps)._filtered_ptrs
 
-def get_eps_neighborhood_idx(sdtm, init_group_ptr=[], eps=0.1):
-    return (weighted_features_summarizer(sdtm=sdtm, init_group_ptr=init_group_ptr) >= eps)._filtered_idx
+def find_stable_topk_neighborhood(sdtm, init_group_ptr=[], k=20, max_iters=50, min_eps=0.05, reverse=False,
+                                  return_stats=False, history_size=8, query_cache=None):
+    """
+    with return_stats returns (group_ptr, NeighborhoodIterationTracker.stats)
+    """
 
+    #TODO: if not isinstance(init_group_ptr, (np.int,np.bool)):
 
-def get_topk_neighborhood_ptrs(sdtm, init_group_ptr=[], k=20, reverse=False):
-    return weighted_features_summarizer(sdtm=sdtm, init_group_ptr=init_group_ptr).top_k_ptrs(k, reverse)
+    tracker = NeighborhoodIterationTracker(init_group_ptr, max_iters=max_iters, min_eps=min_eps, history_size=history_size)
 
+    old_group_ptr = init_group_ptr
+    new_group_ptr = get_topk_neighborhood_ptrs(sdtm=sdtm,
+                                               init_group_ptr=old_group_ptr,
+                                               k=k,
+                                               reverse=reverse,
+                                               query_cache=query_cache)
 
-def get_topk_neighborhood_idx(sdtm, init_group_ptr=[], k=20, reverse=False):
-    return weighted_features_summarizer(sdtm=sdtm, init_group_ptr=init_group_ptr).top_k_idx(k, reverse)
+    while tracker.step(old_group_ptr, new_group_ptr):
+        old_group_ptr = new_group_ptr
+        new_group_ptr = get_topk_neighborhood_ptrs(sdtm=sdtm,
+                                                   init_group_ptr=old_group_ptr,
+                                                   k=k,
+                                                   reverse=reverse,
+                                                   query_cache=query_cache)
 
+    return (new_group_ptr, tracker.stats) if return_stats else new_group_ptr
 
-def find_stable_eps_neighborhood(sdtm, init_group_ptr=[], eps=0.1, max_iters=50, max_group_size=50):
 
-    #TODO: if not isinstance(init_group_ptr, (np.int,np.bool)):
 
-    n_iteration = 0
+def groups_indicator(groups_ptrs, n_docs):
+    """
+    (n_seeds x n_docs) csr indicator matrix of groups of doc ptrs
+    """
 
-    old_group_ptr = init_group_ptr
-    old_step_n_text = len(old_group_ptr)
+    groups_ptrs = [np.atleast_1d(np.asarray(group_ptrs, dtype=np.int64)) for group_ptrs in groups_ptrs]
+    indptr = np.r_[0, np.cumsum([len(group_ptrs) for group_ptrs in groups_ptrs])]
+    indices = np.concatenate(groups_ptrs) if len(groups_ptrs) > 0 else np.empty(0, dtype=np.int64)
 
+    return sparse.csr_matrix((np.ones(len(indices)), indices, indptr), shape=(len(groups_ptrs), n_docs))
 
-    new_group_ptr = get_eps_neighborhood_ptrs(sdtm=sdtm,
-                                               init_group_ptr=old_group_ptr,
-                                               eps=eps)
 
-    new_step_n_text = len(new_group_ptr)
+def indicator_groups(seeds_indicator):
+    seeds_indicator = sparse.csr_matrix(seeds_indicator)
+    return [seeds_indicator.indices[seeds_indicator.indptr[i]:seeds_indicator.indptr[i + 1]] for i in range(seeds_indicator.shape[0])]
 
-    do_iteration = (old_step_n_text != new_step_n_text) and (n_iteration <= max_iters) and (len(new_group_ptr) <= max_group_size)
 
-    while do_iteration:
+def sparse_scores_top_k(scores_data, scores_ptrs, n_docs, k=20, reverse=False):
+    """
+    top_k_positions of the dense scores of n_docs with nonzeros scores_data at scores_ptrs,
+    the dense scores are only built when there are less than k nonzeros larger (smaller with reverse) than zero
+    """
 
-        n_iteration = n_iteration + 1
-        #print "n_iteration = ",n_iteration
+    candidates = scores_data < 0 if reverse else scores_data > 0
 
-        old_group_ptr = new_group_ptr
-        old_step_n_text = len(old_group_ptr)
+    if candidates.sum() >= k:
+        candidates_ptrs = scores_ptrs[candidates]
+        return candidates_ptrs[top_k_positions(scores_data[candidates], k=k, reverse=reverse, tie_keys=candidates_ptrs)]
 
+    scores = np.zeros(n_docs)
+    scores[scores_ptrs] = scores_data
 
-        new_group_ptr = get_eps_neighborhood_ptrs(sdtm=sdtm,
-                                                   init_group_ptr=old_group_ptr,
-                                                   eps=eps)
+    return top_k_positions(scores, k=k, reverse=reverse)
 
-        new_step_n_text = len(new_group_ptr)
 
-        do_iteration = (old_step_n_text != new_step_n_text) and (n_iteration <= max_iters) and (len(new_group_ptr) <= max_group_size)
+def sparse_scores_above(scores_data, scores_ptrs, n_docs, lower_bound=0.1):
+    """
+    sorted ptrs of the docs whose dense scores (nonzeros scores_data at scores_ptrs) are > lower_bound,
+    as SparseDataFrameSummary.__ge__
+    """
 
-    return new_group_ptr if len(new_group_ptr) > max_group_size else old_group_ptr
+    if lower_bound >= 0:
+        return np.sort(scores_ptrs[scores_data > lower_bound])
 
+    scores = np.zeros(n_docs)
+    scores[scores_ptrs] = scores_data
 
-def find_stable_topk_neighborhood(sdtm, init_group_ptr=[], k=20, max_iters=50, min_eps=0.05, reverse=False):
+    return np.nonzero(scores > lower_bound)[0]
 
-    #TODO: if not isinstance(init_group_ptr, (np.int,np.bool)):
-    n_iteration = 0
-    #print "n_iteration = ",n_iteration
 
-    old_group_ptr = init_group_ptr
-    old_group_ptr_set = set(old_group_ptr)
-    #print "old_group_ptr = ",old_group_ptr
+def _batch_find_stable_neighborhood(sdtm, seeds_indicator, next_group_ptrs, make_tracker, is_converged,
+                                    batch_size, inversed_summarizer, query=None, query_cache=None, keep_featureless=True):
+    """
+    iterate the neighborhoods of all seeds (rows of seeds_indicator) batch_size seeds at a time,
+    next_group_ptrs(scores_data, scores_ptrs) is the next group of a seed from the nonzeros of its scores,
+    each seed stops independently by its make_tracker(init_ptrs) tracker (is_converged(old_ptrs, new_ptrs) overrides
+    the min_eps rule when given), the stopped seeds drop out of the active batch.
+    a group without active features is kept with keep_featureless (as WieghtedFeaturesNeighborhood),
+    else its next group is next_group_ptrs of no scores (as the get_*_neighborhood_ptrs functions).
+    with a query_cache, only the groups missing in the cache (under query) are scored.
+    return (old_groups, new_groups, trackers)
+    """
 
-    new_group_ptr = get_topk_neighborhood_ptrs(sdtm=sdtm,
-                                               init_group_ptr=old_group_ptr,
-                                               k=k,
-                                               reverse=reverse)
+    features_stats = WieghtedFeaturesStats.of(sdtm, inversed_summarizer)
+    n_docs = sdtm.shape[0]
 
-    #print "new_group_ptr = ",new_group_ptr
+    init_groups = indicator_groups(seeds_indicator)
+    old_groups, new_groups = list(init_groups), [None] * len(init_groups)
+    trackers = [make_tracker(init_group) for init_group in init_groups]
 
-    new_group_ptr_set = set(new_group_ptr)
-    sym_diff = new_group_ptr_set.symmetric_difference(old_group_ptr_set)
-    #print len(sym_diff)
+    for start in range(0, len(init_groups), batch_size):
+        active_seeds = np.arange(start, min(start + batch_size, len(init_groups)))
+        n_iteration = 0
 
+        while len(active_seeds) > 0:
+            if n_iteration > 0:
+                for seed in active_seeds:
+                    old_groups[seed] = new_groups[seed]
 
-    #TODO: with min_eps constraint
-    do_iteration = (len(sym_diff) > 0) and (n_iteration <= max_iters)
-    #print "do_iteration = ",do_iteration
+            scored_seeds = active_seeds
 
-    while do_iteration:
+            if query_cache is not None:
+                query_keys = dict((seed, query_cache.query_key(features_stats, query, old_groups[seed])) for seed in active_seeds)
+                scored_seeds = []
 
-        n_iteration = n_iteration + 1
-        #print "n_iteration = ",n_iteration
+                for seed in active_seeds:
+                    new_groups[seed] = query_cache.get(query_keys[seed])
+                    if new_groups[seed] is None:
+                        scored_seeds.append(seed)
 
-        old_group_ptr = new_group_ptr
-        old_group_ptr_set = set(old_group_ptr)
-        #print "old_group_ptr = ",old_group_ptr
+            if len(scored_seeds) > 0:
+                scores, has_active_features = features_stats.batch_weighted_scores(groups_indicator([old_groups[seed] for seed in scored_seeds], n_docs))
 
+                for i, seed in enumerate(scored_seeds):
+                    if has_active_features[i]:
+                        row = slice(scores.indptr[i], scores.indptr[i + 1])
+                        new_groups[seed] = next_group_ptrs(scores.data[row], scores.indices[row].astype(np.int64))
+                    elif keep_featureless:
+                        new_groups[seed] = old_groups[seed]
+                    else:
+                        new_groups[seed] = next_group_ptrs(np.empty(0), np.empty(0, dtype=np.int64))
 
-        new_group_ptr = get_topk_neighborhood_ptrs(sdtm=sdtm,
-                                                   init_group_ptr=old_group_ptr,
-                                                   k=k,
-                                                   reverse=reverse)
+                    if query_cache is not None:
+                        new_groups[seed] = query_cache.put(query_keys[seed], new_groups[seed])
+
+            still_active = []
+
+            for seed in active_seeds:
+                converged = None if is_converged is None else is_converged(old_groups[seed], new_groups[seed])
+
+                if trackers[seed].step(old_groups[seed], new_groups[seed], converged=converged):
+                    still_active.append(seed)
+
+            active_seeds = np.array(still_active, dtype=np.int64)
+            n_iteration = n_iteration + 1
+
+    return old_groups, new_groups, trackers
+
+
+def batch_iteration_stats(trackers):
+    """
+    per seed {"n_iterations": int array, "terminations": str array} of the trackers of a batch search
+    """
+
+    return {"n_iterations":np.array([tracker.n_iterations for tracker in trackers], dtype=np.int64),
+            "terminations":np.array([tracker.termination for tracker in trackers], dtype=object)}
+
+
+def batch_find_stable_topk_neighborhood(sdtm, seeds_indicator, k=20, max_iters=50, min_eps=0.05, reverse=False,
+                                        batch_size=256, inversed_summarizer=L1_col_sum, return_stats=False, history_size=8,
+                                        query_cache=None):
+    """
+    WieghtedFeaturesNeighborhood.find_stable_topk_neighborhood of every seed group (rows of the seeds x docs
+    seeds_indicator), return the list of the stable neighborhoods' ptrs in seeds' order (and batch_iteration_stats
+    with return_stats). as there, a group without active features is its own neighborhood
+    (find_stable_topk_neighborhood would take the first k docs of zero score instead)
+    """
+
+    n_docs = sdtm.shape[0]
+
+    next_group_ptrs = lambda scores_data, scores_ptrs:sparse_scores_top_k(scores_data, scores_ptrs, n_docs, k=k, reverse=reverse)
+    make_tracker = lambda init_ptrs:NeighborhoodIterationTracker(init_ptrs, max_iters=max_iters, min_eps=min_eps, history_size=history_size)
+
+    # the same neighbors as WieghtedFeaturesNeighborhood.get_topk_neighbors_ptrs
+    _, new_groups, trackers = _batch_find_stable_neighborhood(sdtm, seeds_indicator, next_group_ptrs, make_tracker, None,
+                                                              batch_size, inversed_summarizer,
+                                                              query=("topk_neighbors", k, reverse), query_cache=query_cache)
+
+    return (new_groups, batch_iteration_stats(trackers)) if return_stats else new_groups
+
+
+def batch_find_stable_eps_neighborhood(sdtm, seeds_indicator, eps=0.1, max_iters=50, max_group_size=50,
+                                       batch_size=256, inversed_summarizer=L1_col_sum, return_stats=False, history_size=8,
+                                       query_cache=None):
+    """
+    find_stable_eps_neighborhood of every seed group (rows of the seeds x docs seeds_indicator),
+    return the list of the stable neighborhoods' ptrs in seeds' order (and batch_iteration_stats with return_stats).
+    as there, a group without active features has an empty neighborhood and the groups converge once their size
+    is stable (WieghtedFeaturesNeighborhood.find_stable_mins_neighborhood keeps a featureless group and waits
+    for an equal set)
+    """
+
+    n_docs = sdtm.shape[0]
 
-        new_group_ptr_set = set(new_group_ptr)
-        sym_diff = new_group_ptr_set.symmetric_difference(old_group_ptr_set)
-        #print len(sym_diff)
+    next_group_ptrs = lambda scores_data, scores_ptrs:sparse_scores_above(scores_data, scores_ptrs, n_docs, eps)
+    make_tracker = lambda init_ptrs:NeighborhoodIterationTracker(init_ptrs, max_iters=max_iters, max_group_size=max_group_size, history_size=history_size)
+    is_converged = lambda old_group_ptrs, new_group_ptrs:len(old_group_ptrs) == len(new_group_ptrs)
 
-        do_iteration = (len(sym_diff) > 0) and (n_iteration <= max_iters)
-        #print "do_iteration = ",do_iteration
+    # the same neighbors as get_eps_neighborhood_ptrs
+    old_groups, new_groups, trackers = _batch_find_stable_neighborhood(sdtm, seeds_indicator, next_group_ptrs, make_tracker, is_converged,
+                                                                       batch_size, inversed_summarizer,
+                                                                       query=("eps_neighborhood", eps), query_cache=query_cache,
+                                                                       keep_featureless=False)
 
-    return new_group_ptr
+    groups = [new_group_ptrs if tracker.termination == "max_group_size" else old_group_ptrs
+              for old_group_ptrs, new_group_ptrs, tracker in zip(old_groups, new_groups, trackers)]
 
+    return (groups, batch_iteration_stats(trackers)) if return_stats else groups
 
 
 if __name__ == '__main__':
@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+import io
+import json
+import lzma
+import struct
+import zlib
+
+import numpy as np
+from scipy import sparse
+
+from .sparse import SparseDataFrame, SparseLabelIndex, as_ptrs
+from .sdf_disk import object_path, import_object_path
+
+
+# a row block store file: BLOCK_STORE_MAGIC, the compressed row blocks, the compressed labels,
+# the json footer (shape, dtype, codec, block index, ...), the footer length (little endian uint64), BLOCK_STORE_MAGIC
+BLOCK_STORE_FORMAT = "playnlp-row-blocks"
+BLOCK_STORE_VERSION = 1
+BLOCK_STORE_MAGIC = b"PLAYBLK1"
+
+# codec: (compress(raw, level), decompress(compressed))
+BLOCK_CODECS = {"zlib":(lambda raw, level:zlib.compress(raw, 6 if level is None else level), zlib.decompress),
+                "lzma":(lambda raw, level:lzma.compress(raw, preset=6 if level is None else level), lzma.decompress),
+                "none":(lambda raw, level:bytes(raw), bytes)}
+
+
+def min_uint_dtype(max_value):
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if max_value <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+
+    return np.dtype(np.uint64)
+
+
+def encode_row_block(data, indices, nnzs):
+    """
+    return (raw, nnzs_dtype, deltas_dtype): the raw bytes of a row block (rows' entries with sorted indices),
+    the rows' nnzs, the delta-encoded indices (the first index of a row, then the gap to the previous index) and data,
+    nnzs and deltas are stored in the smallest unsigned dtype holding them
+    """
+
+    indices = indices.astype(np.int64)
+
+    deltas = indices.copy()
+    deltas[1:] -= indices[:-1]
+
+    row_starts = (np.cumsum(nnzs) - nnzs)[nnzs > 0]
+    deltas[row_starts] = indices[row_starts]
+
+    nnzs_dtype = min_uint_dtype(nnzs.max() if len(nnzs) > 0 else 0)
+    deltas_dtype = min_uint_dtype(deltas.max() if len(deltas) > 0 else 0)
+
+    raw = b"".join([nnzs.astype(nnzs_dtype).tobytes(), deltas.astype(deltas_dtype).tobytes(), data.tobytes()])
+
+    return raw, nnzs_dtype, deltas_dtype
+
+
+def decode_row_block(raw, n_rows, nnz, nnzs_dtype, deltas_dtype, data_dtype):
+    """
+    return (data, indices, indptr) of a row block encoded by encode_row_block
+    """
+
+    nnzs_dtype, deltas_dtype, data_dtype = np.dtype(nnzs_dtype), np.dtype(deltas_dtype), np.dtype(data_dtype)
+
+    nnzs = np.frombuffer(raw, dtype=nnzs_dtype, count=n_rows).astype(np.int64)
+    offset = n_rows * nnzs_dtype.itemsize
+
+    deltas = np.frombuffer(raw, dtype=deltas_dtype, count=nnz, offset=offset).astype(np.int64)
+    offset = offset + nnz * deltas_dtype.itemsize
+
+    data = np.frombuffer(raw, dtype=data_dtype, count=nnz, offset=offset).copy()
+
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(nnzs, out=indptr[1:])
+
+    # indices are the running sums of deltas restarted at each row
+    running = np.cumsum(deltas)
+    row_starts = indptr[:-1][nnzs > 0]
+    indices = running - np.repeat(running[row_starts] - deltas[row_starts], nnzs[nnzs > 0])
+
+    return data, indices, indptr
+
+
+def stack_row_blocks(blocks, n_cols, dtype):
+    """
+    csr of the row blocks [(data, indices, indptr)] one after another
+    """
+
+    if len(blocks) == 0:
+        return sparse.csr_matrix((0, n_cols), dtype=dtype)
+
+    nnzs = np.concatenate([np.diff(indptr) for _, _, indptr in blocks])
+
+    indptr = np.zeros(len(nnzs) + 1, dtype=np.int64)
+    np.cumsum(nnzs, out=indptr[1:])
+
+    return sparse.csr_matrix((np.concatenate([data for data, _, _ in blocks]),
+                              np.concatenate([indices for _, indices, _ in blocks]),
+                              indptr),
+                             shape=(len(nnzs), n_cols))
+
+
+def _dump_labels(labels):
+    labels_file = io.BytesIO()
+    np.save(labels_file, labels, allow_pickle=labels.dtype.hasobject)
+    return labels_file.getvalue()
+
+
+def write_row_block_store(sdf, path, block_size=4096, codec="zlib", level=None):
+    """
+    write sdf's rows to the file path in blocks of block_size rows, each block compressed by codec (in BLOCK_CODECS),
+    return the stats of the store: n_blocks, raw_bytes (csr data / indices / indptr), stored_bytes, compression_ratio
+    """
+
+    assert codec in BLOCK_CODECS
+    assert block_size >= 1
+
+    compress = BLOCK_CODECS[codec][0]
+
+    csr = sdf.smatrix_as("csr")
+
+    if not csr.has_sorted_indices:
+        csr = csr.copy()
+        csr.sort_indices()
+
+    n_rows = csr.shape[0]
+    indptr = csr.indptr.astype(np.int64)
+
+    footer = {"format":BLOCK_STORE_FORMAT,
+              "version":BLOCK_STORE_VERSION,
+              "sdf_class":object_path(type(sdf)),
+              "summarizer":object_path(sdf["summarizer"]) if sdf._has_default_summarizer else None,
+              "shape":list(csr.shape),
+              "dtype":csr.dtype.str,
+              "codec":codec,
+              "block_size":block_size,
+              # offset, length, n_rows, nnz, nnzs dtype, deltas dtype of each block
+              "blocks":[],
+              "labels":{}}
+
+    with open(path, "wb") as wfile:
+        wfile.write(BLOCK_STORE_MAGIC)
+        offset = len(BLOCK_STORE_MAGIC)
+
+        for start in range(0, n_rows, block_size):
+            stop = min(start + block_size, n_rows)
+            entries = slice(indptr[start], indptr[stop])
+
+            raw, nnzs_dtype, deltas_dtype = encode_row_block(csr.data[entries], csr.indices[entries], np.diff(indptr[start:stop + 1]))
+            compressed = compress(raw, level)
+
+            wfile.write(compressed)
+            footer["blocks"].append([offset, len(compressed), stop - start, int(indptr[stop] - indptr[start]),
+                                     nnzs_dtype.str, deltas_dtype.str])
+            offset = offset + len(compressed)
+
+        for key in ("col_idx", "row_idx"):
+            compressed = compress(_dump_labels(np.asarray(sdf[key])), level)
+
+            wfile.write(compressed)
+            footer["labels"][key] = [offset, len(compressed)]
+            offset = offset + len(compressed)
+
+        footer_raw = json.dumps(footer).encode("utf-8")
+
+        wfile.write(footer_raw)
+        wfile.write(struct.pack("<Q", len(footer_raw)))
+        wfile.write(BLOCK_STORE_MAGIC)
+
+        stored_bytes = offset + len(footer_raw) + 8 + len(BLOCK_STORE_MAGIC)
+
+    raw_bytes = csr.data.nbytes + csr.indices.nbytes + csr.indptr.nbytes
+
+    return {"n_blocks":len(footer["blocks"]),
+            "raw_bytes":raw_bytes,
+            "stored_bytes":stored_bytes,
+            "compression_ratio":raw_bytes / float(max(stored_bytes, 1))}
+
+
+class RowBlockStore(object):
+    """
+    random access to the rows of a file written by write_row_block_store:
+    select_rows / select_by_idx decompress only the blocks holding the selected rows,
+    the last cache_size decoded blocks are kept (LRU)
+    """
+
+    def __init__(self, path, cache_size=8):
+        self.path = path
+        self.cache_size = cache_size
+
+        self._file = open(path, "rb")
+
+        try:
+            self._read_footer()
+        except:
+            self._file.close()
+            raise
+
+        self._block_cache = OrderedDict()
+        self._row_label_index = None
+
+        self.n_decoded_blocks = 0
+
+
+    def _read(self, offset, length):
+        self._file.seek(offset)
+        return self._file.read(length)
+
+
+    def _read_footer(self):
+        self._file.seek(-(8 + len(BLOCK_STORE_MAGIC)), 2)
+        footer_length, magic = struct.unpack("<Q", self._file.read(8))[0], self._file.read(len(BLOCK_STORE_MAGIC))
+
+        assert magic == BLOCK_STORE_MAGIC, "%s is not a row block store" % self.path
+
+        self._file.seek(-(footer_length + 8 + len(BLOCK_STORE_MAGIC)), 2)
+        footer = json.loads(self._file.read(footer_length).decode("utf-8"))
+
+        assert footer["format"] == BLOCK_STORE_FORMAT
+        assert footer["version"] <= BLOCK_STORE_VERSION, "%s has version %s, newer than %s" % (self.path, footer["version"], BLOCK_STORE_VERSION)
+
+        self.footer = footer
+        self.shape = tuple(footer["shape"])
+        self.dtype = np.dtype(footer["dtype"])
+        self.block_size = footer["block_size"]
+
+        self._decompress = BLOCK_CODECS[footer["codec"]][1]
+
+        for key in ("col_idx", "row_idx"):
+            labels_raw = self._decompress(self._read(*footer["labels"][key]))
+            setattr(self, key, np.load(io.BytesIO(labels_raw), allow_pickle=True))
+
+        try:
+            self.sdf_class = import_object_path(footer["sdf_class"])
+        except (AttributeError, ImportError, ValueError):
+            self.sdf_class = SparseDataFrame
+
+        try:
+            self.summarizer = import_object_path(footer["summarizer"]) if footer["summarizer"] is not None else None
+        except (AttributeError, ImportError, ValueError):
+            self.summarizer = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def close(self):
+        self._file.close()
+        self._block_cache.clear()
+
+
+    @property
+    def n_blocks(self):
+        return len(self.footer["blocks"])
+
+
+    @property
+    def row_label_index(self):
+        if self._row_label_index is None:
+            self._row_label_index = SparseLabelIndex(self.row_idx)
+
+        return self._row_label_index
+
+
+    def read_block(self, block_ptr):
+        """
+        (data, indices, indptr) of the rows of block block_ptr
+        """
+
+        if block_ptr in self._block_cache:
+            self._block_cache.move_to_end(block_ptr)
+            return self._block_cache[block_ptr]
+
+        offset, length, n_rows, nnz, nnzs_dtype, deltas_dtype = self.footer["blocks"][block_ptr]
+
+        block = decode_row_block(self._decompress(self._read(offset, length)), n_rows, nnz, nnzs_dtype, deltas_dtype, self.dtype)
+        self.n_decoded_blocks = self.n_decoded_blocks + 1
+
+        if self.cache_size > 0:
+            self._block_cache[block_ptr] = block
+
+            while len(self._block_cache) > self.cache_size:
+                self._block_cache.popitem(last=False)
+
+        return block
+
+
+    def read_rows_csr(self, row_ptrs=None):
+        """
+        csr of the rows row_ptrs (in row_ptrs' order, None means all), only their blocks are read
+        """
+
+        if row_ptrs is None:
+            return stack_row_blocks([self.read_block(block_ptr) for block_ptr in range(self.n_blocks)], self.shape[1], self.dtype)
+
+        row_ptrs = np.asarray(row_ptrs, dtype=np.int64)
+        block_ptrs = np.unique(row_ptrs // self.block_size)
+
+        blocks = [self.read_block(block_ptr) for block_ptr in block_ptrs]
+        stacked = stack_row_blocks(blocks, self.shape[1], self.dtype)
+
+        # a row is found at its block's start in the stack plus its offset in the block
+        blocks_n_rows = np.array([len(indptr) - 1 for _, _, indptr in blocks], dtype=np.int64)
+        stacked_starts = np.cumsum(blocks_n_rows) - blocks_n_rows
+
+        return stacked[stacked_starts[np.searchsorted(block_ptrs, row_ptrs // self.block_size)] + row_ptrs % self.block_size]
+
+
+    def select_rows(self, select_row=None):
+        """
+        a sdf of the selected rows (ptrs or a bool mask, None means all)
+        """
+
+        row_ptrs = None if select_row is None else as_ptrs(select_row, self.shape[0])
+
+        return self.sdf_class(smatrix=self.read_rows_csr(row_ptrs),
+                              col_idx=self.col_idx,
+                              row_idx=self.row_idx if row_ptrs is None else self.row_idx[row_ptrs],
+                              summarizer=self.summarizer,
+                              copy_idx=False)
+
+
+    def select_by_idx(self, row_idx=None):
+        """
+        a sdf of the rows labeled row_idx (None means all)
+        """
+
+        return self.select_rows(None if row_idx is None else self.row_label_index.get_ptrs(row_idx))
+
+
+    def to_sdf(self):
+        return self.select_rows()
+
+
+if __name__ == '__main__':
+    pass
@@ -4,10 +4,119 @@ try:
 except:
     import pickle
 
+import csv
+import io
+import json
+import mmap
+import struct
 
-def write_pickle_file(obj, write_file, write_file_prefix=None, close_after_write=True):
+import numpy as np
 
-    if isinstance(write_file, file):
+
+try:
+    FILE_TYPES, PATH_TYPES = (file,), (str, unicode)
+except NameError:
+    FILE_TYPES, PATH_TYPES = (io.IOBase,), (str,)
+
+
+# out-of-band pickle files: OOB_PICKLE_MAGIC, n_buffers, pickle length and each buffer length (little endian uint64),
+# the pickle stream (protocol 5) then the raw buffers, each one starting at a multiple of OOB_ALIGNMENT
+OOB_PICKLE_MAGIC = b"PLAYPKL5"
+OOB_ALIGNMENT = 64
+
+
+def _padding(offset):
+    return -offset % OOB_ALIGNMENT
+
+
+def dump_oob_pickle(obj, wfile):
+    """
+    write obj to the binary file wfile as an out-of-band pickle file,
+    the PickleBuffers of obj (numpy arrays' buffers) are written as they are, without copying them into the pickle
+    """
+
+    buffers = []
+    pickled = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+    raws = [buffer.raw() for buffer in buffers]
+
+    header = OOB_PICKLE_MAGIC + struct.pack("<%dQ" % (len(raws) + 2), len(raws), len(pickled), *[raw.nbytes for raw in raws])
+
+    wfile.write(header)
+    wfile.write(pickled)
+    offset = len(header) + len(pickled)
+
+    for raw in raws:
+        wfile.write(b"\0" * _padding(offset))
+        offset = offset + _padding(offset)
+
+        wfile.write(raw)
+        offset = offset + raw.nbytes
+
+    return True
+
+
+def load_oob_pickle(rfile, mmap_buffers=False):
+    """
+    read an out-of-band pickle file from the binary file rfile,
+    with mmap_buffers=True the buffers are read-only views of the memory-mapped file instead of copies read into memory
+    """
+
+    start = rfile.tell() if mmap_buffers else 0
+
+    assert rfile.read(len(OOB_PICKLE_MAGIC)) == OOB_PICKLE_MAGIC, "not an out-of-band pickle file"
+
+    n_buffers, pickle_length = struct.unpack("<2Q", rfile.read(16))
+    buffers_lengths = struct.unpack("<%dQ" % n_buffers, rfile.read(8 * n_buffers))
+
+    pickled = rfile.read(pickle_length)
+    offset = len(OOB_PICKLE_MAGIC) + 8 * (n_buffers + 2) + pickle_length
+
+    if mmap_buffers and n_buffers > 0:
+        mapped = memoryview(mmap.mmap(rfile.fileno(), 0, access=mmap.ACCESS_READ))
+
+    buffers = []
+
+    for length in buffers_lengths:
+        padding = _padding(offset)
+        offset = offset + padding
+
+        if mmap_buffers:
+            buffers.append(mapped[start + offset:start + offset + length])
+        else:
+            rfile.read(padding)
+            # not a zero filled bytearray, and not the uint8 array itself: scipy copies arrays viewing a larger ndarray
+            buffer = memoryview(np.empty(length, dtype=np.uint8))
+            rfile.readinto(buffer)
+            buffers.append(buffer)
+
+        offset = offset + length
+
+    if mmap_buffers:
+        # leave rfile after the mapped buffers, as if they were read
+        rfile.seek(start + offset)
+
+    return pickle.loads(pickled, buffers=buffers)
+
+
+def write_pickle_file(obj, write_file, write_file_prefix=None, close_after_write=True, out_of_band=False):
+    """
+    with out_of_band=True obj is written by dump_oob_pickle (pickle protocol 5 with out-of-band buffers)
+    """
+
+    if out_of_band:
+        if isinstance(write_file, PATH_TYPES):
+            with open(write_file, "wb") as wfile:
+                return dump_oob_pickle(obj, wfile)
+
+        assert not write_file.closed
+        dump_oob_pickle(obj, write_file)
+
+        if close_after_write:
+            write_file.close()
+
+        return True
+
+    if isinstance(write_file, FILE_TYPES):
         assert not write_file.closed
         pickle.dump(obj, write_file)
 
@@ -16,7 +125,7 @@ def write_pickle_file(obj, write_file, write_file_prefix=None, close_after_write
 
         return True
 
-    elif isinstance(write_file, (str, unicode)):
+    elif isinstance(write_file, PATH_TYPES):
         # TODO: output_file includes filename and path
         with open(write_file, "wb") as wfile:
             pickle.dump(obj, wfile)
@@ -28,18 +137,34 @@ def write_pickle_file(obj, write_file, write_file_prefix=None, close_after_write
         return False
 
 
-def read_pickle_file(read_file, close_after_read=True):
+def read_pickle_file(read_file, close_after_read=True, out_of_band=False, mmap_buffers=False):
+    """
+    with out_of_band=True read_file is read by load_oob_pickle (mmap_buffers=True maps the buffers instead of reading them)
+    """
 
     read_results = None
 
-    if isinstance(read_file, file):
+    if out_of_band:
+        if isinstance(read_file, PATH_TYPES):
+            with open(read_file, "rb") as rfile:
+                return load_oob_pickle(rfile, mmap_buffers=mmap_buffers)
+
+        assert not read_file.closed
+        read_results = load_oob_pickle(read_file, mmap_buffers=mmap_buffers)
+
+        if close_after_read:
+            read_file.close()
+
+        return read_results
+
+    if isinstance(read_file, FILE_TYPES):
         assert not read_file.closed
         read_results = pickle.load(read_file)
 
         if close_after_read:
             read_file.close()
 
-    elif isinstance(read_file, (str, unicode)):
+    elif isinstance(read_file, PATH_TYPES):
         # TODO: output_file includes filename and path
         with open(read_file, "rb") as rfile:
             read_results = pickle.load(rfile)
@@ -47,6 +172,52 @@ def read_pickle_file(read_file, close_after_read=True):
     return read_results
 
 
+def iter_chunks(items, chunk_size=10000):
+    """
+    lists of chunk_size items of the iterable items (the last one may be shorter)
+    """
+
+    assert chunk_size >= 1
+
+    chunk = []
+
+    for item in items:
+        chunk.append(item)
+
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+
+    if len(chunk) > 0:
+        yield chunk
+
+
+def iter_jsonl_chunks(path, id_key="id", text_key="text", chunk_size=10000, encoding="utf-8"):
+    """
+    chunks of (id, text) pairs of the records of the json lines file path (blank lines are skipped),
+    the file is read lazily, chunk_size records at a time
+    """
+
+    with io.open(path, "r", encoding=encoding) as rfile:
+        records = (json.loads(line) for line in rfile if line.strip())
+
+        for chunk in iter_chunks(((record[id_key], record[text_key]) for record in records), chunk_size=chunk_size):
+            yield chunk
+
+
+def iter_csv_chunks(path, id_col="id", text_col="text", chunk_size=10000, encoding="utf-8", **reader_kwargs):
+    """
+    chunks of (id, text) pairs of the rows of the csv file path (with a header row naming id_col and text_col),
+    the file is read lazily, chunk_size rows at a time; reader_kwargs go to csv.DictReader
+    """
+
+    with io.open(path, "r", encoding=encoding, newline="") as rfile:
+        rows = csv.DictReader(rfile, **reader_kwargs)
+
+        for chunk in iter_chunks(((row[id_col], row[text_col]) for row in rows), chunk_size=chunk_size):
+            yield chunk
+
+
 if __name__ == '__main__':
     pass
 
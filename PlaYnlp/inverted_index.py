@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from .join import gather_rows_ptrs
+
+
+class InvertedIndex(object):
+    """
+    term -> posting list (ptrs of the docs containing the term) of a sdtm,
+    the posting lists are the buffers of the sdtm's csc form, no copy is made
+    """
+
+    def __init__(self, csc):
+        assert csc.format == "csc"
+        self.csc = csc
+
+
+    @classmethod
+    def of(cls, sdtm):
+        # kept in the sdtm, rebuilt when its csc form changes
+        csc = sdtm.smatrix_as("csc")
+
+        if not "inverted_index" in sdtm.keys() or not sdtm["inverted_index"].csc is csc:
+            sdtm["inverted_index"] = cls(csc)
+
+        return sdtm["inverted_index"]
+
+
+    @property
+    def n_docs(self):
+        return self.csc.shape[0]
+
+
+    @property
+    def n_terms(self):
+        return self.csc.shape[1]
+
+
+    @property
+    def posting_lengths(self):
+        return np.diff(self.csc.indptr)
+
+
+    def posting_list(self, term_ptr):
+        return self.csc.indices[self.csc.indptr[term_ptr]:self.csc.indptr[term_ptr + 1]]
+
+
+    def postings(self, term_ptrs):
+        """
+        return (entries_ptrs, nnzs): the ptrs of the posting entries of term_ptrs in the csc buffers and each posting length
+        """
+
+        return gather_rows_ptrs(self.csc.indptr, term_ptrs)
+
+
+    def candidate_docs(self, term_ptrs):
+        """
+        sorted ptrs of the docs containing any of term_ptrs (the union of their posting lists)
+        """
+
+        entries_ptrs, _ = self.postings(term_ptrs)
+        return np.unique(self.csc.indices[entries_ptrs])
+
+
+    def score(self, term_ptrs, weights):
+        """
+        return (doc_ptrs, scores): the weighted sums sum_j weights_j * x_ij over term_ptrs
+        of the docs in the union of the posting lists (the other docs score 0), doc_ptrs are sorted
+        """
+
+        entries_ptrs, nnzs = self.postings(term_ptrs)
+
+        values = self.csc.data[entries_ptrs] * np.repeat(np.asarray(weights, dtype=np.float64), nnzs)
+        doc_ptrs, docs_inverse = np.unique(self.csc.indices[entries_ptrs], return_inverse=True)
+
+        return doc_ptrs, np.bincount(docs_inverse.ravel(), weights=values, minlength=len(doc_ptrs))
+
+
+if __name__ == '__main__':
+    pass
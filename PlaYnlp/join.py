@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from scipy import sparse
+
+
+MERGE_METHODS = ("force_append", "keep", "replace", "sum", "mean")
+
+
+def gather_rows_ptrs(indptr, rows):
+    """
+    return (ptrs, nnzs): ptrs of the rows' entries in data / indices (in rows' order) and nnz of each row
+    """
+
+    rows = np.asarray(rows, dtype=np.int64)
+
+    starts = indptr[rows].astype(np.int64)
+    nnzs = indptr[rows + 1].astype(np.int64) - starts
+    offsets = np.cumsum(nnzs) - nnzs
+
+    ptrs = np.repeat(starts - offsets, nnzs) + np.arange(nnzs.sum(), dtype=np.int64)
+
+    return ptrs, nnzs
+
+
+class CSRJoinPart(object):
+    """
+    a block of rows (src_rows of a csr matrix) written into out_rows of the joined matrix,
+    src columns are remapped by col_map and data is multiplied by scale (None, scalar or per-row array)
+    """
+
+    def __init__(self, csr, src_rows, out_rows, col_map, scale=None):
+        assert len(src_rows) == len(out_rows)
+
+        self.csr = csr
+        self.src_rows = np.asarray(src_rows, dtype=np.int64)
+        self.out_rows = np.asarray(out_rows, dtype=np.int64)
+        self.col_map = col_map
+        self.scale = scale
+
+
+def assemble_csr(shape, parts, dtype=None):
+    """
+    build the joined csr matrix of shape in one pass over parts,
+    an output row may receive entries from more than one part, then the duplicated entries are summed
+    """
+
+    if dtype is None:
+        dtype = np.result_type(*[part.csr.dtype for part in parts]) if len(parts) > 0 else np.float64
+
+    row_nnzs = np.zeros(shape[0], dtype=np.int64)
+    row_n_parts = np.zeros(shape[0], dtype=np.int64)
+
+    for part in parts:
+        row_nnzs[part.out_rows] += np.diff(part.csr.indptr)[part.src_rows]
+        row_n_parts[part.out_rows] += 1
+
+    indptr = np.zeros(shape[0] + 1, dtype=np.int64)
+    np.cumsum(row_nnzs, out=indptr[1:])
+
+    data = np.empty(indptr[-1], dtype=dtype)
+    indices = np.empty(indptr[-1], dtype=np.int64)
+
+    cursor = indptr[:-1].copy()
+
+    for part in parts:
+        src_ptrs, nnzs = gather_rows_ptrs(part.csr.indptr, part.src_rows)
+
+        starts = cursor[part.out_rows]
+        offsets = np.cumsum(nnzs) - nnzs
+        out_ptrs = np.repeat(starts - offsets, nnzs) + np.arange(len(src_ptrs), dtype=np.int64)
+
+        part_data = part.csr.data[src_ptrs]
+
+        if part.scale is not None:
+            if np.ndim(part.scale) == 0:
+                part_data = part_data * part.scale
+            else:
+                part_data = part_data * np.repeat(part.scale, nnzs)
+
+        data[out_ptrs] = part_data
+        indices[out_ptrs] = part.col_map[part.csr.indices[src_ptrs]]
+
+        cursor[part.out_rows] += nnzs
+
+    if shape[1] < np.iinfo(np.int32).max and indptr[-1] < np.iinfo(np.int32).max:
+        indices = indices.astype(np.int32)
+        indptr = indptr.astype(np.int32)
+
+    joined = sparse.csr_matrix((data, indices, indptr), shape=shape)
+
+    if (row_n_parts > 1).any():
+        joined.sum_duplicates()
+
+    return joined
+
+
+def union_col_map(*cols_idx):
+    """
+    return (union_col_idx, col_maps): the sorted union of labels and the integer remap arrays of each cols_idx
+    """
+
+    union_col_idx = np.unique(np.concatenate(cols_idx))
+
+    return union_col_idx, [np.searchsorted(union_col_idx, col_idx) for col_idx in cols_idx]
+
+
+def join_sdfs(sdf, other_sdf, method="replace"):
+    """
+    return (smatrix, col_idx, row_idx) of sdf.merge_sdf(other_sdf, method):
+    columns are the sorted union of both col_idx,
+    rows are [rows only in sdf | shared rows sorted by idx | rows only in other_sdf]
+    (or [all rows in sdf | all rows in other_sdf] with method == "force_append")
+    """
+
+    assert method in MERGE_METHODS
+
+    a, b = sdf._smatrix.tocsr(), other_sdf._smatrix.tocsr()
+    a_row_idx, b_row_idx = sdf._row_idx, other_sdf._row_idx
+
+    new_col_idx, (a_col_map, b_col_map) = union_col_map(sdf._col_idx, other_sdf._col_idx)
+
+    dtype = np.result_type(a.dtype, b.dtype)
+
+    if method == "force_append":
+        n_a, n_b = a.shape[0], b.shape[0]
+
+        parts = [CSRJoinPart(a, np.arange(n_a), np.arange(n_a), a_col_map),
+                 CSRJoinPart(b, np.arange(n_b), np.arange(n_a, n_a + n_b), b_col_map)]
+
+        new_row_idx = np.r_[a_row_idx, b_row_idx]
+
+    else:
+        a_in_b_ptrs = other_sdf.row_label_index.get_indexer(a_row_idx)
+        b_in_a_ptrs = sdf.row_label_index.get_indexer(b_row_idx)
+
+        a_only_ptrs = np.nonzero(a_in_b_ptrs < 0)[0]
+        b_only_ptrs = np.nonzero(b_in_a_ptrs < 0)[0]
+
+        a_inter_ptrs = np.nonzero(a_in_b_ptrs >= 0)[0]
+        a_inter_ptrs = a_inter_ptrs[np.argsort(a_row_idx[a_inter_ptrs], kind="mergesort")]
+        b_inter_ptrs = a_in_b_ptrs[a_inter_ptrs]
+
+        n_a_only, n_inter, n_b_only = len(a_only_ptrs), len(a_inter_ptrs), len(b_only_ptrs)
+
+        a_only_out = np.arange(n_a_only)
+        inter_out = np.arange(n_a_only, n_a_only + n_inter)
+        b_only_out = np.arange(n_a_only + n_inter, n_a_only + n_inter + n_b_only)
+
+        parts = [CSRJoinPart(a, a_only_ptrs, a_only_out, a_col_map)]
+
+        if method == "keep":
+            parts.append(CSRJoinPart(a, a_inter_ptrs, inter_out, a_col_map))
+
+        elif method == "replace":
+            parts.append(CSRJoinPart(b, b_inter_ptrs, inter_out, b_col_map))
+
+        elif method == "sum":
+            parts.append(CSRJoinPart(a, a_inter_ptrs, inter_out, a_col_map))
+            parts.append(CSRJoinPart(b, b_inter_ptrs, inter_out, b_col_map))
+
+        elif method == "mean":
+            parts.append(CSRJoinPart(a, a_inter_ptrs, inter_out, a_col_map, scale=0.5))
+            parts.append(CSRJoinPart(b, b_inter_ptrs, inter_out, b_col_map, scale=0.5))
+
+            if n_inter > 0:
+                dtype = np.result_type(dtype, np.float64)
+
+        parts.append(CSRJoinPart(b, b_only_ptrs, b_only_out, b_col_map))
+
+        new_row_idx = np.r_[a_row_idx[a_only_ptrs],
+                            a_row_idx[a_inter_ptrs],
+                            b_row_idx[b_only_ptrs]]
+
+    new_smatrix = assemble_csr((len(new_row_idx), len(new_col_idx)), parts, dtype=dtype)
+
+    return new_smatrix, new_col_idx, new_row_idx
+
+
+def join_many_sdfs(sdfs, method="replace"):
+    """
+    return (smatrix, col_idx, row_idx) of the k-way merge of sdfs in one pass:
+    columns are the sorted union of all col_idx,
+    rows are [rows only in sdfs[0] | shared rows sorted by idx | rows only in sdfs[1] | ... | rows only in sdfs[-1]]
+    (or all rows of sdfs in order with method == "force_append").
+
+    shared rows are taken from the first ("keep") / last ("replace") sdf containing them,
+    or summed ("sum") / averaged over the sdfs containing them ("mean"),
+    so for two sdfs it is the same as join_sdfs.
+    """
+
+    assert method in MERGE_METHODS
+    assert len(sdfs) > 0
+
+    csrs = [sdf._smatrix.tocsr() for sdf in sdfs]
+    rows_idx = [sdf._row_idx for sdf in sdfs]
+
+    new_col_idx, col_maps = union_col_map(*[sdf._col_idx for sdf in sdfs])
+
+    dtype = np.result_type(*[csr.dtype for csr in csrs])
+
+    n_rows = np.array([csr.shape[0] for csr in csrs], dtype=np.int64)
+    row_offsets = np.r_[0, np.cumsum(n_rows)]
+
+    all_row_idx = np.concatenate(rows_idx)
+
+    if method == "force_append":
+        parts = [CSRJoinPart(csr, np.arange(n_rows[k]), np.arange(row_offsets[k], row_offsets[k + 1]), col_maps[k])
+                 for k, csr in enumerate(csrs)]
+
+        new_row_idx = all_row_idx
+
+    else:
+        # occurrences are all rows of sdfs in order, resolved to their unique labels once
+        occ_sdf = np.repeat(np.arange(len(sdfs)), n_rows)
+        occ_ptrs = np.arange(len(all_row_idx), dtype=np.int64) - row_offsets[occ_sdf]
+
+        uniq_row_idx, occ_uniq, uniq_counts = np.unique(all_row_idx, return_inverse=True, return_counts=True)
+        occ_uniq = occ_uniq.ravel()
+
+        uniq_is_shared = uniq_counts > 1
+        occ_is_shared = uniq_is_shared[occ_uniq]
+
+        n_shared = int(uniq_is_shared.sum())
+        n_first_only = int((~occ_is_shared[:n_rows[0]]).sum())
+
+        shared_rank = np.cumsum(uniq_is_shared) - 1
+        only_rank = np.cumsum(~occ_is_shared) - 1
+
+        occ_out = np.where(occ_is_shared,
+                           n_first_only + shared_rank[occ_uniq],
+                           np.where(occ_sdf == 0, only_rank, only_rank + n_shared))
+
+        if method == "keep":
+            _, selected_occ = np.unique(occ_uniq, return_index=True)
+
+        elif method == "replace":
+            _, last_occ_rev = np.unique(occ_uniq[::-1], return_index=True)
+            selected_occ = len(occ_uniq) - 1 - last_occ_rev
+
+        else:
+            selected_occ = np.arange(len(occ_uniq))
+
+        occ_selected = np.zeros(len(occ_uniq), dtype=bool)
+        occ_selected[selected_occ] = True
+
+        if method == "mean" and n_shared > 0:
+            dtype = np.result_type(dtype, np.float64)
+
+        parts = []
+
+        for k, csr in enumerate(csrs):
+            k_occ = np.nonzero(occ_selected & (occ_sdf == k))[0]
+            scale = 1.0 / uniq_counts[occ_uniq[k_occ]] if method == "mean" else None
+
+            parts.append(CSRJoinPart(csr, occ_ptrs[k_occ], occ_out[k_occ], col_maps[k], scale=scale))
+
+        new_row_idx = np.empty(len(uniq_row_idx), dtype=all_row_idx.dtype)
+        new_row_idx[occ_out] = all_row_idx
+
+    new_smatrix = assemble_csr((len(new_row_idx), len(new_col_idx)), parts, dtype=dtype)
+
+    return new_smatrix, new_col_idx, new_row_idx
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+
+# n-grams of up to PACKED_MAX_N codepoints are packed exactly into their id: (codepoint + 1) per CODEPOINT_BITS digit,
+# so packed ids of different n never collide. longer n-grams get a rolling hash id with HASHED_ID_FLAG set
+CODEPOINT_BITS = 21
+PACKED_MAX_N = 3
+HASHED_ID_FLAG = np.uint64(1 << 63)
+HASH_MULTIPLIER = np.uint64(0x100000001b3)
+
+
+def text_codepoints(text):
+    """
+    uint32 array of the codepoints of the str text
+    """
+
+    # surrogatepass keeps the lone surrogates of surrogateescape-decoded texts
+    return np.frombuffer(text.encode("utf-32-le", "surrogatepass"), dtype=np.uint32)
+
+
+def flatten_ns(n):
+    """
+    the ints of n (an int or nested lists of ints) in order, other items are ignored (as ngram did)
+    """
+
+    if isinstance(n, int):
+        return [n]
+
+    if isinstance(n, list):
+        return [n_i for nn in n for n_i in flatten_ns(nn)]
+
+    return []
+
+
+def ngram_ids(codepoints, n):
+    """
+    uint64 ids of the n-grams of codepoints (one per start position, n >= 1),
+    packed codepoints for n <= PACKED_MAX_N, a rolling hash (with HASHED_ID_FLAG set) for longer n
+    """
+
+    assert n >= 1
+
+    n_ngrams = len(codepoints) - n + 1
+
+    if n_ngrams <= 0:
+        return np.empty(0, dtype=np.uint64)
+
+    codepoints = codepoints.astype(np.uint64)
+    ids = np.zeros(n_ngrams, dtype=np.uint64)
+
+    # the windows' codepoints are folded column by column over all windows at once
+    if n <= PACKED_MAX_N:
+        for k in range(n):
+            ids = (ids << np.uint64(CODEPOINT_BITS)) | (codepoints[k:k + n_ngrams] + np.uint64(1))
+
+    else:
+        ids[:] = np.uint64(n)
+
+        with np.errstate(over="ignore"):
+            for k in range(n):
+                ids = ids * HASH_MULTIPLIER + codepoints[k:k + n_ngrams]
+
+        ids = ids | HASHED_ID_FLAG
+
+    return ids
+
+
+def ngram_strings(codepoints, n):
+    """
+    all n-grams of the codepoints of a text as a numpy unicode array viewed over codepoints (n >= 1)
+    """
+
+    n_ngrams = len(codepoints) - n + 1
+
+    if n_ngrams <= 0:
+        return np.empty(0, dtype="<U%d" % max(n, 1))
+
+    return np.ndarray((n_ngrams,), dtype="<U%d" % n, buffer=codepoints, strides=(codepoints.itemsize,))
+
+
+class NgramFilter(object):
+    """
+    a hashed set of the n-grams to be filtered out: the ids of filter_list's strings, sorted for binary search.
+    the hashed ids (n > PACKED_MAX_N) which are found are checked against the strings themselves
+    """
+
+    def __init__(self, filter_list=()):
+        self.strings = set(xx for xx in filter_list if isinstance(xx, str))
+
+        ids = [ngram_ids(text_codepoints(xx), len(xx))[0] for xx in self.strings if len(xx) > 0]
+        self.ids = np.unique(np.array(ids, dtype=np.uint64))
+
+
+    def __len__(self):
+        return len(self.strings)
+
+
+    def __contains__(self, ngram):
+        return ngram in self.strings
+
+
+    def is_filtered(self, ids, n, text=None, starts=None):
+        """
+        bool mask of the ids (of n-grams of size n) found in the filter,
+        hashed ids are checked against the strings of text at starts
+        """
+
+        if len(self.ids) == 0 or len(ids) == 0:
+            return np.zeros(len(ids), dtype=bool)
+
+        positions = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+        found = self.ids[positions] == ids
+
+        if n > PACKED_MAX_N and found.any():
+            for k in np.nonzero(found)[0]:
+                found[k] = text[starts[k]:starts[k] + n] in self.strings
+
+        return found
+
+
+def text_ngram_ids(text, n, ngram_filter=None):
+    """
+    return (ids, starts, ns): the ids of the n-grams of the str text for each n of n (an int >= 1 or a list),
+    in the order of ngram (by n, then by start), their start positions and sizes; the filtered ones are left out
+    """
+
+    codepoints = text_codepoints(text)
+    ids, starts, ns = [], [], []
+
+    for n_i in flatten_ns(n):
+        n_ids = ngram_ids(codepoints, n_i)
+        n_starts = np.arange(len(n_ids))
+
+        if ngram_filter is not None and len(ngram_filter) > 0:
+            kept = ~ngram_filter.is_filtered(n_ids, n_i, text=text, starts=n_starts)
+            n_ids, n_starts = n_ids[kept], n_starts[kept]
+
+        ids.append(n_ids)
+        starts.append(n_starts)
+        ns.append(np.full(len(n_ids), n_i, dtype=np.int64))
+
+    if len(ids) == 0:
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    return np.concatenate(ids), np.concatenate(starts), np.concatenate(ns)
+
+
+def text_ngrams(text, n, ngram_filter=None):
+    """
+    the list of the n-grams (strings) of the str text for each n of n, in the order of ngram
+    """
+
+    codepoints = text_codepoints(text)
+    # numpy unicode strings drop trailing NULs, those texts are sliced instead
+    has_nul = "\0" in text
+
+    ngrams = []
+
+    for n_i in flatten_ns(n):
+        if n_i < 1:
+            ngrams.extend(xx for xx in (text[k:k + n_i] for k in range(len(text) - n_i + 1))
+                          if ngram_filter is None or not xx in ngram_filter)
+            continue
+
+        if ngram_filter is not None and len(ngram_filter) > 0:
+            n_ids = ngram_ids(codepoints, n_i)
+            kept = np.nonzero(~ngram_filter.is_filtered(n_ids, n_i, text=text, starts=np.arange(len(n_ids))))[0]
+        else:
+            kept = None
+
+        if has_nul:
+            starts = range(len(text) - n_i + 1) if kept is None else kept.tolist()
+            ngrams.extend(text[k:k + n_i] for k in starts)
+        else:
+            n_strings = ngram_strings(codepoints, n_i)
+            ngrams.extend((n_strings if kept is None else n_strings[kept]).tolist())
+
+    return ngrams
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+import multiprocessing
+
+import numpy as np
+from scipy import sparse
+
+from .term_counts import count_texts
+
+
+# vect_gen_init_kwargs depending on the whole corpus, which the shards could not apply locally
+CORPUS_LEVEL_KWARGS = ("min_df", "max_df", "max_features", "vocabulary")
+
+
+# the state of a worker process, set once by _init_count_worker
+_worker_state = {}
+
+
+def feature_names_of(vectorizer):
+    if hasattr(vectorizer, "get_feature_names_out"):
+        return vectorizer.get_feature_names_out()
+
+    return vectorizer.get_feature_names()
+
+
+def count_shard(texts, vect_gen=None, vect_gen_init_kwargs={}):
+    """
+    return (csr, terms) of texts with the sorted terms:
+    vect_gen(**vect_gen_init_kwargs).fit_transform, or count_texts when vect_gen is None.
+    a shard without any token has no terms (CountVectorizer's empty vocabulary error is only raised
+    by parallel_count_texts when all the shards are empty, as the serial fit_transform)
+    """
+
+    if vect_gen is None:
+        return count_texts(texts, **vect_gen_init_kwargs)
+
+    vectorizer = vect_gen(**vect_gen_init_kwargs)
+
+    try:
+        csr = sparse.csr_matrix(vectorizer.fit_transform(texts))
+    except ValueError as error:
+        if not "empty vocabulary" in str(error):
+            raise
+
+        return sparse.csr_matrix((len(texts), 0), dtype=np.int64), np.array([], dtype=object)
+
+    return csr, np.asarray(feature_names_of(vectorizer))
+
+
+def is_jieba_tokenizer(tokenizer):
+    """
+    whether tokenizer calls jieba: a function / method of jieba, or a function whose code refers to the jieba module
+    or which wraps such a tokenizer in its closure (e.g. tokenize_gen(jieba.cut))
+    """
+
+    seen = set()
+    pending = [tokenizer]
+
+    while len(pending) > 0:
+        fn = pending.pop()
+
+        if fn is None or id(fn) in seen:
+            continue
+
+        seen.add(id(fn))
+
+        fn = getattr(fn, "__func__", fn)
+        module = getattr(fn, "__module__", None) or ""
+
+        if module == "jieba" or module.startswith("jieba."):
+            return True
+
+        code = getattr(fn, "__code__", None)
+
+        if code is None:
+            continue
+
+        fn_globals = getattr(fn, "__globals__", {})
+
+        # "jieba" (a global or an import in the function) or an alias of the jieba module
+        if any(name == "jieba" or getattr(fn_globals.get(name), "__name__", None) == "jieba" for name in code.co_names):
+            return True
+
+        pending.extend(cell.cell_contents for cell in (getattr(fn, "__closure__", None) or ())
+                       if callable(getattr(cell, "cell_contents", None)))
+
+    return False
+
+
+def _init_count_worker(vect_gen, vect_gen_init_kwargs, init_jieba):
+    # with the fork start method the tokenizer is inherited (lambdas included), else it is pickled once per worker
+    _worker_state["vect_gen"] = vect_gen
+    _worker_state["vect_gen_init_kwargs"] = vect_gen_init_kwargs
+
+    # jieba's dictionary is loaded once per worker, not on the first cut of each shard
+    if init_jieba:
+        import jieba
+        jieba.initialize()
+
+
+def _count_shard(texts):
+    return count_shard(texts, vect_gen=_worker_state["vect_gen"], vect_gen_init_kwargs=_worker_state["vect_gen_init_kwargs"])
+
+
+def merge_term_counts(blocks, dtype=None):
+    """
+    return (csr, terms): the row blocks [(csr, sorted terms)] stacked one after another over the sorted union of
+    their terms, each block's columns are mapped by binary search (so the indices stay sorted)
+    """
+
+    blocks = list(blocks)
+    shard_terms = [terms for _, terms in blocks if len(terms) > 0]
+
+    terms = np.unique(np.concatenate(shard_terms)) if len(shard_terms) > 0 else np.empty(0, dtype=object)
+
+    if len(blocks) == 0:
+        return sparse.csr_matrix((0, len(terms)), dtype=np.int64 if dtype is None else dtype), terms
+
+    mapped_blocks = []
+
+    for csr, block_terms in blocks:
+        col_map = np.searchsorted(terms, block_terms) if len(block_terms) > 0 else np.empty(0, dtype=np.int64)
+
+        mapped = sparse.csr_matrix((csr.data, col_map[csr.indices], csr.indptr), shape=(csr.shape[0], len(terms)))
+        mapped.has_sorted_indices = csr.has_sorted_indices
+        mapped_blocks.append(mapped)
+
+    csr = sparse.vstack(mapped_blocks, format="csr", dtype=dtype)
+
+    return csr, terms
+
+
+def parallel_count_texts(texts, n_jobs=None, chunk_size=10000, vect_gen=None, vect_gen_init_kwargs={},
+                         start_method=None, init_jieba=None):
+    """
+    return (csr, terms) of texts as count_shard does, with texts sharded into chunks of chunk_size texts
+    tokenized and counted over n_jobs processes;
+    the shards' counts are merged in texts' order over the sorted union of their terms,
+    so the result is the same as the serial count_shard(texts, vect_gen, vect_gen_init_kwargs).
+    init_jieba loads jieba's dictionary once in each process, by default (None) when the tokenizer
+    of vect_gen_init_kwargs is jieba-based (is_jieba_tokenizer)
+    """
+
+    assert not any(key in vect_gen_init_kwargs for key in CORPUS_LEVEL_KWARGS)
+
+    n_jobs = multiprocessing.cpu_count() if n_jobs is None else n_jobs
+    dtype = vect_gen_init_kwargs.get("dtype", None)
+
+    # at most chunk_size texts per shard, but at least one shard per process
+    shard_size = max(1, min(chunk_size, -(-len(texts) // n_jobs)))
+    shards = [texts[start:start + shard_size] for start in range(0, len(texts), shard_size)]
+
+    if init_jieba is None:
+        init_jieba = is_jieba_tokenizer(vect_gen_init_kwargs.get("tokenizer", None))
+
+    context = multiprocessing.get_context(start_method)
+    pool = context.Pool(processes=n_jobs, initializer=_init_count_worker,
+                        initargs=(vect_gen, vect_gen_init_kwargs, init_jieba))
+
+    try:
+        # imap keeps the shards' order
+        blocks = list(pool.imap(_count_shard, shards))
+    finally:
+        pool.close()
+        pool.join()
+
+    csr, terms = merge_term_counts(blocks, dtype=dtype)
+
+    if vect_gen is not None and len(terms) == 0:
+        # as CountVectorizer's fit_transform of all the texts
+        raise ValueError("empty vocabulary; perhaps the documents only contain stop words")
+
+    return csr, terms
+
+
+if __name__ == '__main__':
+    pass
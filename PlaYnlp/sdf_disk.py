@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+import importlib
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+from scipy import sparse
+
+
+# a sdf directory: SDF_DISK_HEADER (json) and one .npy file per array of SDF_DISK_ARRAYS
+SDF_DISK_FORMAT = "playnlp-sdf"
+SDF_DISK_VERSION = 1
+SDF_DISK_HEADER = "header.json"
+SDF_DISK_ARRAYS = ("data", "indices", "indptr", "col_idx", "row_idx")
+
+
+def object_path(obj):
+    """
+    "module:qualname" of a class or a module level function, None if it could not be imported back
+    """
+
+    module, qualname = getattr(obj, "__module__", None), getattr(obj, "__qualname__", getattr(obj, "__name__", None))
+
+    if module is None or qualname is None or "<" in qualname:
+        return None
+
+    return "%s:%s" % (module, qualname)
+
+
+def import_object_path(path):
+    module, qualname = path.split(":")
+    obj = importlib.import_module(module)
+
+    for name in qualname.split("."):
+        obj = getattr(obj, name)
+
+    return obj
+
+
+def write_sdf_dir(sdf, path, overwrite=False):
+    """
+    write sdf to the directory path: its smatrix (as csr / csc with sorted indices) data / indices / indptr,
+    col_idx and row_idx as .npy files and a json header (format, version, class, shape, summarizer, arrays).
+    the directory is written aside and renamed to path at the end, so path is never left half written.
+    """
+
+    if os.path.exists(path):
+        assert overwrite, "%s exists" % path
+
+    smatrix = sdf["smatrix"]
+
+    if not smatrix.format in ("csr", "csc"):
+        smatrix = smatrix.tocsr()
+
+    if not smatrix.has_sorted_indices:
+        smatrix = smatrix.copy()
+        smatrix.sort_indices()
+
+    arrays = {"data":smatrix.data,
+              "indices":smatrix.indices,
+              "indptr":smatrix.indptr,
+              "col_idx":np.asarray(sdf["col_idx"]),
+              "row_idx":np.asarray(sdf["row_idx"])}
+
+    header = {"format":SDF_DISK_FORMAT,
+              "version":SDF_DISK_VERSION,
+              "sdf_class":object_path(type(sdf)),
+              "smatrix_format":smatrix.format,
+              "shape":list(smatrix.shape),
+              "nnz":int(smatrix.indptr[-1]),
+              "summarizer":object_path(sdf["summarizer"]) if sdf._has_default_summarizer else None,
+              "arrays":{}}
+
+    tmp_path = "%s.tmp-%s" % (path.rstrip(os.sep), uuid.uuid4().hex[:8])
+    os.makedirs(tmp_path)
+
+    try:
+        for key in SDF_DISK_ARRAYS:
+            array = arrays[key]
+
+            # object labels could not be mapped, they are pickled into their .npy file
+            np.save(os.path.join(tmp_path, "%s.npy" % key), array, allow_pickle=array.dtype.hasobject)
+
+            header["arrays"][key] = {"file":"%s.npy" % key,
+                                     "dtype":array.dtype.str,
+                                     "shape":list(array.shape),
+                                     "mmap":not array.dtype.hasobject}
+
+        with open(os.path.join(tmp_path, SDF_DISK_HEADER), "w") as wfile:
+            json.dump(header, wfile, indent=1, sort_keys=True)
+
+        if os.path.exists(path):
+            shutil.rmtree(path)
+
+        os.rename(tmp_path, path)
+
+    except:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    return True
+
+
+def read_sdf_header(path):
+    with open(os.path.join(path, SDF_DISK_HEADER)) as rfile:
+        header = json.load(rfile)
+
+    assert header.get("format") == SDF_DISK_FORMAT, "%s is not a sdf directory" % path
+    assert header["version"] <= SDF_DISK_VERSION, "%s has version %s, newer than %s" % (path, header["version"], SDF_DISK_VERSION)
+
+    return header
+
+
+def open_sdf_dir(path, sdf_class=None, mmap_mode="r"):
+    """
+    open the sdf directory path, the arrays are memory-mapped by np.load(mmap_mode=mmap_mode) (None reads them),
+    so only the pages of the rows / cols which are touched are read.
+    sdf_class defaults to the class in the header (SparseDataFrame if it could not be imported)
+    """
+
+    from .sparse import SparseDataFrame
+
+    header = read_sdf_header(path)
+
+    if sdf_class is None:
+        try:
+            sdf_class = import_object_path(header["sdf_class"])
+        except (AttributeError, ImportError, ValueError):
+            sdf_class = SparseDataFrame
+
+    summarizer = None
+
+    if header["summarizer"] is not None:
+        try:
+            summarizer = import_object_path(header["summarizer"])
+        except (AttributeError, ImportError, ValueError):
+            summarizer = None
+
+    arrays = {}
+
+    for key in SDF_DISK_ARRAYS:
+        array_header = header["arrays"][key]
+        array_file = os.path.join(path, array_header["file"])
+
+        if array_header["mmap"]:
+            arrays[key] = np.load(array_file, mmap_mode=mmap_mode)
+        else:
+            arrays[key] = np.load(array_file, allow_pickle=True)
+
+    smatrix_class = sparse.csr_matrix if header["smatrix_format"] == "csr" else sparse.csc_matrix
+
+    smatrix = smatrix_class((arrays["data"], arrays["indices"], arrays["indptr"]), shape=tuple(header["shape"]), copy=False)
+    # written sorted, the flag saves a scan (or an in-place sort) of the mapped indices
+    smatrix.has_sorted_indices = True
+
+    return sdf_class(smatrix=smatrix,
+                     col_idx=arrays["col_idx"],
+                     row_idx=arrays["row_idx"],
+                     summarizer=summarizer,
+                     copy_idx=False)
+
+
+if __name__ == '__main__':
+    pass
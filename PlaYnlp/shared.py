@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+import uuid
+
+import numpy as np
+from scipy import sparse
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+
+# the buffers of a sdf published into a shared memory block
+SHARED_SDF_ARRAYS = ("data", "indices", "indptr", "col_idx", "row_idx")
+
+# the offset of each buffer in the block is aligned to SHARED_ALIGNMENT bytes
+SHARED_ALIGNMENT = 64
+
+
+def sdf_arrays(sdf):
+    smatrix = sdf["smatrix"]
+
+    if not smatrix.format in ("csr", "csc"):
+        smatrix = smatrix.tocsr()
+
+    return smatrix, {"data":smatrix.data,
+                     "indices":smatrix.indices,
+                     "indptr":smatrix.indptr,
+                     "col_idx":np.asarray(sdf["col_idx"]),
+                     "row_idx":np.asarray(sdf["row_idx"])}
+
+
+def _attach_block(name):
+    try:
+        # python >= 3.13: an attached block is not unlinked by this process' resource tracker
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+class SharedSparseDataFrame(object):
+    """
+    the owner of a shared memory block holding a sdf's data / indices / indptr and col_idx / row_idx.
+
+    handle is a small picklable dict (block name, offsets, dtypes, shapes), attach_sdf(handle) returns a read-only sdf
+    on the block without copying it. object dtype labels could not be shared, they are carried by the handle.
+
+    the block lives until the owner is closed (or leaves its with block): close() unlinks it, the sdfs already
+    attached keep their mapping valid until they are garbage collected, but no new sdf can attach.
+    """
+
+    def __init__(self, sdf, name=None):
+        assert shared_memory is not None, "multiprocessing.shared_memory is not available (python >= 3.8)"
+
+        name = "playnlp_%s" % uuid.uuid4().hex[:12] if name is None else name
+        smatrix, arrays = sdf_arrays(sdf)
+
+        self.handle = {"sdf_class":type(sdf),
+                       "format":smatrix.format,
+                       "shape":smatrix.shape,
+                       "summarizer":sdf["summarizer"] if sdf._has_default_summarizer else None,
+                       "block_name":None,
+                       "arrays":{},
+                       "inline_arrays":{}}
+
+        shared_arrays, size = [], 0
+
+        for key in SHARED_SDF_ARRAYS:
+            array = np.ascontiguousarray(arrays[key])
+
+            if array.dtype.hasobject:
+                self.handle["inline_arrays"][key] = array
+            else:
+                shared_arrays.append((key, array, size))
+                size = size + -(-array.nbytes // SHARED_ALIGNMENT) * SHARED_ALIGNMENT
+
+        self._block = shared_memory.SharedMemory(name=name, create=True, size=max(size, 1))
+        self.handle["block_name"] = self._block.name
+
+        for key, array, offset in shared_arrays:
+            np.ndarray(array.shape, dtype=array.dtype, buffer=self._block.buf, offset=offset)[...] = array
+            self.handle["arrays"][key] = (offset, array.dtype.str, array.shape)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    @property
+    def is_closed(self):
+        return self._block is None
+
+
+    @property
+    def nbytes(self):
+        return 0 if self._block is None else self._block.size
+
+
+    def close(self):
+        block, self._block = self._block, None
+
+        if block is not None:
+            block.close()
+            block.unlink()
+
+
+    def attach(self):
+        return attach_sdf(self.handle)
+
+
+def share_sdf(sdf, name=None):
+    return SharedSparseDataFrame(sdf, name=name)
+
+
+def attach_sdf(handle):
+    """
+    a read-only sdf on the shared memory block of handle (SharedSparseDataFrame.handle),
+    the sdf keeps the attached block in sdf["shared_block"], it is closed with the sdf
+    """
+
+    assert shared_memory is not None, "multiprocessing.shared_memory is not available (python >= 3.8)"
+
+    block = _attach_block(handle["block_name"])
+    arrays = dict(handle["inline_arrays"])
+
+    for key, (offset, dtype, shape) in handle["arrays"].items():
+        array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf, offset=offset)
+        array.flags.writeable = False
+        arrays[key] = array
+
+    smatrix_class = sparse.csr_matrix if handle["format"] == "csr" else sparse.csc_matrix
+
+    smatrix = smatrix_class((arrays["data"], arrays["indices"], arrays["indptr"]), shape=handle["shape"], copy=False)
+
+    sdf = handle["sdf_class"](smatrix=smatrix,
+                              col_idx=arrays["col_idx"],
+                              row_idx=arrays["row_idx"],
+                              summarizer=handle["summarizer"],
+                              copy_idx=False)
+
+    sdf["shared_block"] = block
+
+    return sdf
+
+
+if __name__ == '__main__':
+    pass
@@ -1,9 +1,24 @@
 # -*- coding: utf-8 -*-
 
+from collections import OrderedDict
+
 import numpy as np
 from scipy import sparse
 import pandas as pd
 from .dataio import write_pickle_file
+from .sdf_disk import write_sdf_dir, open_sdf_dir
+from .join import MERGE_METHODS, join_sdfs, join_many_sdfs
+from .stats import summarize_buffers, top_k_positions, TopKAccumulator
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import copyreg
+except ImportError:
+    import copy_reg as copyreg
 
 # L1_norm_col_summarizer = lambda xx:np.abs(xx).sum(axis=0)
 # L0_norm_col_summarizer = lambda xx:xx.sign().sum(axis=0)
@@ -15,21 +30,256 @@ def L0_norm_col_summarizer(xx):
     return xx.sign().sum(axis=0)
 
 
+# summarizers which are computed straight from the csr / csc buffers: summarizer -> (stat, axis)
+BUFFER_SUMMARIZERS = {L1_norm_col_summarizer:("L1", 0),
+                      L0_norm_col_summarizer:("sign", 0)}
+
+
+def as_ptrs(selector, n):
+    """
+    int ptrs of a selector (bool mask, ptrs, list or slice) on an axis of length n
+    """
+
+    if isinstance(selector, slice):
+        return np.arange(n)[selector]
+
+    selector = np.atleast_1d(np.asarray(selector))
+
+    if selector.dtype == bool:
+        assert selector.shape[0] == n
+        return np.nonzero(selector)[0]
+
+    ptrs = selector.astype(np.int64)
+    return np.where(ptrs < 0, ptrs + n, ptrs)
+
+
+def compose_ptrs(parent_ptrs, ptrs):
+    if parent_ptrs is None:
+        return ptrs
+
+    if ptrs is None:
+        return parent_ptrs
+
+    return parent_ptrs[ptrs]
+
+
 def gen_ptrs_idx(idx, idx_dtype=None):
     if idx_dtype == None:
         dt = np.dtype([("ptr", np.int64), ("idx", idx.dtype)])
     else:
         dt = np.dtype([("ptr", np.int64), ("idx", idx_dtype)])
-    ptrs_idx = np.array(zip(np.arange(len(idx), dtype=np.int64), idx), dtype=dt)
+    ptrs_idx = np.array(list(zip(np.arange(len(idx), dtype=np.int64), idx)), dtype=dt)
     return ptrs_idx
 
 def ptrs_idx_projection(ptrs_idx, proj_idx):
-    return ptrs_idx[np.in1d(ptrs_idx["idx"], proj_idx)]
+    return ptrs_idx[np.isin(ptrs_idx["idx"], proj_idx)]
 
 def sort_by_idx(ptrs_idx):
     return np.sort(ptrs_idx, order=["idx"])
 
 
+def as_labels_array(labels):
+    return np.atleast_1d(np.asarray(labels))
+
+
+class SparseLabelIndex(object):
+    """
+    hash index of labels (col_idx or row_idx) -> ptrs, built lazily on the first lookup.
+    if labels are duplicated, a label is resolved to its first ptr (as find_col_ptrs / find_row_ptrs did).
+    """
+
+    def __init__(self, labels):
+        self._labels = labels
+        self._ptrs_dict = None
+
+
+    def __len__(self):
+        return len(self._labels)
+
+
+    def __contains__(self, label):
+        return label in self.ptrs_dict
+
+
+    @property
+    def labels(self):
+        return self._labels
+
+
+    @property
+    def is_built(self):
+        return self._ptrs_dict is not None
+
+
+    @property
+    def ptrs_dict(self):
+        if self._ptrs_dict is None:
+            ptrs_dict = {}
+            for ptr, label in enumerate(self._labels.tolist()):
+                ptrs_dict.setdefault(label, ptr)
+
+            self._ptrs_dict = ptrs_dict
+
+        return self._ptrs_dict
+
+
+    def is_index_of(self, labels):
+        return self._labels is labels
+
+
+    def get_indexer(self, labels):
+        """
+        bulk label -> ptr resolution, missing labels are resolved to -1
+        """
+
+        _labels = as_labels_array(labels).tolist()
+        get_ptr = self.ptrs_dict.get
+
+        return np.fromiter((get_ptr(label, -1) for label in _labels), dtype=np.int64, count=len(_labels))
+
+
+    def get_ptrs(self, labels):
+        ptrs = self.get_indexer(labels)
+
+        # check labels is subset of self._labels
+        assert (ptrs >= 0).all(), "missing labels: %s" % (as_labels_array(labels)[ptrs < 0],)
+
+        return ptrs
+
+
+    def missing_labels(self, labels):
+        _labels = as_labels_array(labels)
+        return _labels[self.get_indexer(_labels) < 0]
+
+
+    def take(self, ptrs):
+        return type(self)(self._labels[ptrs])
+
+
+    def rebind(self, labels):
+        # labels is an equal copy of self._labels, so the built hash table can be shared
+        assert len(labels) == len(self._labels)
+
+        label_index = type(self)(labels)
+        label_index._ptrs_dict = self._ptrs_dict
+        return label_index
+
+
+
+class SummaryCache(object):
+    """
+    bounded LRU cache of summary data, keyed by (summarizer, axis, view ptrs).
+    the cache is bound to one smatrix (token) and is cleared when a different smatrix is seen.
+    """
+
+    def __init__(self, max_size=32):
+        self._max_size = max_size
+        self._token = None
+        self._entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def _check_token(self, token):
+        if self._token is not token:
+            if self._token is not None:
+                self.invalidations = self.invalidations + 1
+
+            self._entries.clear()
+            self._token = token
+
+
+    def get(self, token, key):
+        self._check_token(token)
+
+        if key in self._entries:
+            self.hits = self.hits + 1
+            summary_data = self._entries.pop(key)
+            self._entries[key] = summary_data
+            return summary_data
+
+        self.misses = self.misses + 1
+        return None
+
+
+    def put(self, token, key, summary_data):
+        """
+        cache a read-only copy of summary_data and return it
+        """
+
+        self._check_token(token)
+
+        summary_data = np.array(summary_data)
+        summary_data.flags.writeable = False
+        self._entries[key] = summary_data
+
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+        return summary_data
+
+
+    def clear(self):
+        self._entries.clear()
+        self._token = None
+
+
+    @property
+    def stats(self):
+        n_lookups = self.hits + self.misses
+
+        return {"hits":self.hits,
+                "misses":self.misses,
+                "invalidations":self.invalidations,
+                "size":len(self._entries),
+                "max_size":self._max_size,
+                "hit_rate":float(self.hits) / n_lookups if n_lookups > 0 else 0.0}
+
+
+def reduce_by_state(obj):
+    """
+    __reduce_ex__ of the dict subclasses: obj is rebuilt from obj.__getstate__() only (not from its items),
+    the numpy arrays in the state are pickled as out-of-band PickleBuffers under pickle protocol 5
+    """
+
+    return (copyreg.__newobj__, (type(obj),), obj.__getstate__())
+
+
+def ptrs_key(ptrs):
+    return None if ptrs is None else ptrs.tobytes()
+
+
+def is_cacheable_summarizer(summarizer):
+    # lambdas are re-created on every call (and usually close over changing weights), caching them never hits
+    return getattr(summarizer, "__name__", None) != "<lambda>"
+
+
+
+class _SparseDataFrameLocIndexer(object):
+    """
+    sdf.loc[row_labels], sdf.loc[row_labels, col_labels], sdf.loc[:, col_labels]
+    """
+
+    def __init__(self, sdf):
+        self._sdf = sdf
+
+
+    def __getitem__(self, labels):
+        if isinstance(labels, tuple):
+            assert len(labels) == 2
+            row_labels, col_labels = labels
+        else:
+            row_labels, col_labels = labels, slice(None)
+
+        return self._sdf.select_by_idx(row_idx=row_labels, col_idx=col_labels)
+
+
 
 class SparseDataFrameSummary(dict):
     _key_mapper = {"data":"summary_data",
@@ -50,12 +300,16 @@ class SparseDataFrameSummary(dict):
         self.update(kwargs)
 
 
+    def __reduce_ex__(self, protocol):
+        return reduce_by_state(self)
+
+
     def __getstate__(self):
-        pass
+        return dict(self)
 
 
     def __setstate__(self, state):
-        pass
+        self.update(state)
 
 
     def __getattr__(self, key):
@@ -152,27 +406,82 @@ class SparseDataFrameSummary(dict):
     @property
     def _argsort_ptrs(self):
 #        assert self._is_sortable
-        return self._data.argsort()
+        return self._data.argsort(kind="mergesort")
 
     def top_k_ptrs(self, k=20, reverse=False):
-        if reverse:
-            return self._argsort_ptrs[:k]
-        else:
-            return self._argsort_ptrs[-k:]
+        # partial sort, ties are ordered by ptrs (as a stable argsort)
+        return top_k_positions(self._data, k=k, reverse=reverse)
 
     def top_k_idx(self, k=20, reverse=False):
         return self._idx[self.top_k_ptrs(k, reverse)]
 
+    def top_k_data(self, k=20, reverse=False):
+        return self._data[self.top_k_ptrs(k, reverse)]
+
+    def top_k_accumulator(self, k=20, reverse=False, ptrs_offset=0):
+        """
+        a TopKAccumulator with this summary's top k, ptrs are shifted by ptrs_offset
+        (the offset of this block / shard), to be merged with the accumulators of other blocks
+        """
+
+        top_k_ptrs = self.top_k_ptrs(k, reverse)
+
+        return TopKAccumulator(k=k, reverse=reverse).push(self._data[top_k_ptrs],
+                                                          top_k_ptrs + ptrs_offset,
+                                                          idx=self._idx[top_k_ptrs])
+
+
+class SparseDataFrameMultiSummary(SparseDataFrameSummary):
+    """
+    summary of several stats at once, summary_data[:, k] is the summary data of summary_stats[k]
+    """
+
+    _key_mapper = {"data":"summary_data",
+                   "idx":"summary_idx",
+                   "stats":"summary_stats", }
+
+    def __init__(self, summary_data, summary_idx, summary_stats=(), sdf=None, **kwargs):
+        SparseDataFrameSummary.__init__(self, summary_data=summary_data, summary_idx=summary_idx, **kwargs)
+
+        self["summary_stats"] = tuple(summary_stats)
+
+        if sdf != None:
+            self["sdf"] = sdf
+            if self["sdf"].is_matched_col_shape(self['summary_idx']):
+                self["summary_type"] = "col"
+
+            if self["sdf"].is_matched_row_shape(self['summary_idx']):
+                self["summary_type"] = "row"
+
+
+    def stat(self, stat):
+        summary_kwargs = {"sdf":self["sdf"]} if self._has_sdf else {}
+
+        return SparseDataFrameSummary(summary_data=self["summary_data"][:, self["summary_stats"].index(stat)],
+                                      summary_idx=self["summary_idx"],
+                                      **summary_kwargs)
+
+
+    @property
+    def to_pandas_df(self):
+        return pd.DataFrame(self["summary_data"], columns=list(self["summary_stats"]), index=self["summary_idx"])
+
+
 
 class SparseDataFrame(dict):
     _key_mapper = {}
     _summerizer_class = SparseDataFrameSummary
     _dump_file_prefix = "sdf"
 
-    def __init__(self, smatrix, col_idx=None, row_idx=None, summarizer=None):
+    # keys of a view which are materialized from its base on first access
+    _view_lazy_keys = ("smatrix", "col_idx", "row_idx")
+
+    _summary_cache_size = 32
+
+    def __init__(self, smatrix, col_idx=None, row_idx=None, summarizer=None, copy_idx=True):
         self["smatrix"] = smatrix
 
-        if col_idx != None:
+        if col_idx is not None:
             assert isinstance(col_idx, (list, np.ndarray))
 
             if isinstance(col_idx, list):
@@ -181,12 +490,12 @@ class SparseDataFrame(dict):
 
             else:
                 assert self["smatrix"].shape[1] == col_idx.shape[0]
-                self["col_idx"] = np.array(col_idx)
+                self["col_idx"] = np.array(col_idx) if copy_idx else col_idx
         else:
             self["col_idx"] = np.arange(self["smatrix"].shape[1])
 
 
-        if row_idx != None:
+        if row_idx is not None:
             assert isinstance(row_idx, (list, np.ndarray))
 
             if isinstance(row_idx, list):
@@ -195,7 +504,7 @@ class SparseDataFrame(dict):
 
             else:
                 assert self["smatrix"].shape[0] == row_idx.shape[0]
-                self["row_idx"] = np.array(row_idx)
+                self["row_idx"] = np.array(row_idx) if copy_idx else row_idx
 
         else:
             self["row_idx"] = np.arange(self["smatrix"].shape[0])
@@ -205,26 +514,189 @@ class SparseDataFrame(dict):
             self["summarizer"] = summarizer
 
 
+    def __reduce_ex__(self, protocol):
+        return reduce_by_state(self)
+
+
     def __getstate__(self):
-        pass
+        """
+        smatrix (its format, shape and csr / csc buffers), col_idx, row_idx and the default summarizer,
+        the views are materialized and the caches (formats, label indexes, summaries, ...) are left out
+        """
+
+        smatrix = self["smatrix"]
+
+        if not smatrix.format in ("csr", "csc"):
+            smatrix = smatrix.tocsr()
+
+        return {"format":smatrix.format,
+                "shape":smatrix.shape,
+                "data":smatrix.data,
+                "indices":smatrix.indices,
+                "indptr":smatrix.indptr,
+                "col_idx":self["col_idx"],
+                "row_idx":self["row_idx"],
+                "summarizer":self["summarizer"] if self._has_default_summarizer else None}
 
 
     def __setstate__(self, state):
-        pass
+        smatrix_class = sparse.csr_matrix if state["format"] == "csr" else sparse.csc_matrix
+
+        self["smatrix"] = smatrix_class((state["data"], state["indices"], state["indptr"]), shape=state["shape"], copy=False)
+        self["col_idx"] = state["col_idx"]
+        self["row_idx"] = state["row_idx"]
+
+        if state["summarizer"] is not None:
+            self["summarizer"] = state["summarizer"]
 
 
     def __getattr__(self, key):
 
-        if key.startswith("_") and key[1:] in self.keys():
+        if key.startswith("_") and self._has_key(key[1:]):
             return self[key[1:]]
         else:
 
-            if key.startswith("_") and key[1:] in self._key_mapper.keys() and self._key_mapper[key[1:]] in self.keys():
+            if key.startswith("_") and key[1:] in self._key_mapper.keys() and self._has_key(self._key_mapper[key[1:]]):
                 return self[self._key_mapper[key[1:]]]
             else:
                 return None
 
 
+    def __missing__(self, key):
+        if not (key in self._view_lazy_keys and "view_base" in self.keys()):
+            raise KeyError(key)
+
+        base = self["view_base"]
+        row_ptrs, col_ptrs = self["view_row_ptrs"], self["view_col_ptrs"]
+
+        if key == "smatrix":
+            smatrix = base["smatrix"]
+
+            if row_ptrs is not None:
+                smatrix = smatrix[row_ptrs, :]
+
+            if col_ptrs is not None:
+                smatrix = smatrix[:, col_ptrs]
+
+            self["smatrix"] = smatrix
+            self["view_smatrix"] = smatrix
+            self["view_base_smatrix"] = base["smatrix"]
+
+        elif key == "col_idx":
+            self["col_idx"] = base["col_idx"] if col_ptrs is None else base["col_idx"][col_ptrs]
+
+        elif key == "row_idx":
+            self["row_idx"] = base["row_idx"] if row_ptrs is None else base["row_idx"][row_ptrs]
+
+        return dict.__getitem__(self, key)
+
+
+    def _has_key(self, key):
+        return key in self.keys() or (key in self._view_lazy_keys and "view_base" in self.keys())
+
+
+    @classmethod
+    def view_of(cls, sdf, row_ptrs=None, col_ptrs=None, summarizer=None):
+        """
+        a lazy view of sdf's rows / cols selected by ptrs (None means all),
+        its smatrix, col_idx and row_idx are materialized only when they are accessed
+        """
+
+        view = cls.__new__(cls)
+
+        view["view_base"] = sdf
+        view["view_row_ptrs"] = row_ptrs
+        view["view_col_ptrs"] = col_ptrs
+
+        if summarizer != None and callable(summarizer):
+            view["summarizer"] = summarizer
+
+        return view
+
+
+    @property
+    def is_view(self):
+        return "view_base" in self.keys()
+
+
+    @property
+    def is_materialized(self):
+        return "smatrix" in self.keys()
+
+
+    @property
+    def shape(self):
+        if self.is_materialized:
+            return self["smatrix"].shape
+
+        base_shape = self["view_base"].shape
+        row_ptrs, col_ptrs = self["view_row_ptrs"], self["view_col_ptrs"]
+
+        return (base_shape[0] if row_ptrs is None else len(row_ptrs),
+                base_shape[1] if col_ptrs is None else len(col_ptrs))
+
+
+    def select_view(self, row_ptrs=None, col_ptrs=None):
+        """
+        a lazy view of self's rows / cols selected by ptrs (None means all),
+        selections on a view are composed into one (row_ptrs, col_ptrs) pair on the same base
+        """
+
+        if self.is_view:
+            base = self["view_base"]
+            row_ptrs = compose_ptrs(self["view_row_ptrs"], row_ptrs)
+            col_ptrs = compose_ptrs(self["view_col_ptrs"], col_ptrs)
+        else:
+            base = self
+
+        return type(self).view_of(base,
+                                  row_ptrs=row_ptrs,
+                                  col_ptrs=col_ptrs,
+                                  summarizer=self["summarizer"] if self._has_default_summarizer else None)
+
+
+    def materialize(self):
+        """
+        return a sdf (not a view) of self's data
+        """
+
+        new_sdf = type(self)(smatrix=self["smatrix"],
+                             col_idx=self["col_idx"],
+                             row_idx=self["row_idx"],
+                             summarizer=self["summarizer"] if self._has_default_summarizer else None)
+
+        new_sdf.inherit_label_index("col", self)
+        new_sdf.inherit_label_index("row", self)
+        return new_sdf
+
+
+    @property
+    def smatrix_formats(self):
+        smatrix = self["smatrix"]
+        cached_formats = [fmt for fmt in ("csr", "csc")
+                          if "smatrix_as_%s" % fmt in self.keys() and self["smatrix_as_%s" % fmt][0] is smatrix]
+
+        return set([smatrix.format] + cached_formats)
+
+
+    def smatrix_as(self, fmt):
+        """
+        smatrix in format fmt ("csr" or "csc"), converted once and cached
+        """
+
+        smatrix = self["smatrix"]
+
+        if smatrix.format == fmt:
+            return smatrix
+
+        cache_key = "smatrix_as_%s" % fmt
+
+        if not (cache_key in self.keys() and self[cache_key][0] is smatrix):
+            self[cache_key] = (smatrix, smatrix.asformat(fmt))
+
+        return self[cache_key][1]
+
+
 #     @property
 #     def _smatrix(self):
 #         return self["smatrix"]
@@ -244,9 +716,48 @@ class SparseDataFrame(dict):
                             col_idx=self["row_idx"],
                             row_idx=self["col_idx"],
                             summarizer=self["summarizer"] if self._has_default_summarizer else None)
+
+        tr_sdf.inherit_label_index("col", self, "row")
+        tr_sdf.inherit_label_index("row", self, "col")
         return tr_sdf
 
 
+    @property
+    def col_label_index(self):
+        return self._get_label_index("col")
+
+
+    @property
+    def row_label_index(self):
+        return self._get_label_index("row")
+
+
+    def _get_label_index(self, axis):
+        idx_key, label_index_key = "%s_idx" % axis, "%s_label_index" % axis
+
+        if not (label_index_key in self.keys() and self[label_index_key].is_index_of(self[idx_key])):
+            self[label_index_key] = SparseLabelIndex(self[idx_key])
+
+        return self[label_index_key]
+
+
+    def inherit_label_index(self, axis, sdf, sdf_axis=None):
+        """
+        share sdf's (built) label index of sdf_axis as self's label index of axis,
+        the labels of both axes must be equal
+        """
+
+        sdf_label_index_key = "%s_label_index" % (axis if sdf_axis is None else sdf_axis)
+
+        if sdf_label_index_key in sdf.keys() and sdf[sdf_label_index_key].is_built:
+            self["%s_label_index" % axis] = sdf[sdf_label_index_key].rebind(self["%s_idx" % axis])
+
+
+    @property
+    def loc(self):
+        return _SparseDataFrameLocIndexer(self)
+
+
     @property
     def _has_default_summarizer(self):
         return "summarizer" in self.keys()
@@ -258,6 +769,61 @@ class SparseDataFrame(dict):
             return self.summarize_sdf(summarizer=self["summarizer"])
 
 
+    @property
+    def _summary_cache_owner(self):
+        # a view whose smatrix is (still) derived from its base's current smatrix shares the base's summary cache,
+        # once either smatrix is replaced the view summarizes its own smatrix
+        if not self.is_view:
+            return self
+
+        if not self.is_materialized:
+            return self["view_base"]
+
+        if self["smatrix"] is self["view_smatrix"] and self["view_base"]["smatrix"] is self["view_base_smatrix"]:
+            return self["view_base"]
+
+        return self
+
+
+    @property
+    def summary_cache(self):
+        owner = self._summary_cache_owner
+
+        if not "summary_cache" in owner.keys():
+            owner["summary_cache"] = SummaryCache(max_size=owner._summary_cache_size)
+
+        return owner["summary_cache"]
+
+
+    @property
+    def summary_cache_stats(self):
+        return self.summary_cache.stats
+
+
+    def clear_summary_cache(self):
+        self.summary_cache.clear()
+
+
+    @property
+    def _summary_source(self):
+        # (sdf, row_ptrs, col_ptrs) whose smatrix buffers hold self's data
+        owner = self._summary_cache_owner
+
+        if owner is self:
+            return self, None, None
+        else:
+            return owner, self["view_row_ptrs"], self["view_col_ptrs"]
+
+
+    def _summary_cache_token_key(self, summarizer, axis=None):
+        owner = self._summary_cache_owner
+
+        if owner is self:
+            return self["smatrix"], (summarizer, axis, None, None)
+        else:
+            return owner["smatrix"], (summarizer, axis, ptrs_key(self["view_row_ptrs"]), ptrs_key(self["view_col_ptrs"]))
+
+
     def change_default_summerizer(self, summarizer=None):
         if summarizer != None and callable(summarizer):
             self["summarizer"] = summarizer
@@ -266,9 +832,44 @@ class SparseDataFrame(dict):
             return False
 
 
-    def summarize_sdf(self, summarizer=L1_norm_col_summarizer):
+    def summarize_sdf(self, summarizer=L1_norm_col_summarizer, use_cache=True):
+
+        # use_cache=False for one-off summaries (e.g. of short-lived row groups) which would only evict the others
+        use_cache = use_cache and is_cacheable_summarizer(summarizer)
+
+        if use_cache:
+            cache_token, cache_key = self._summary_cache_token_key(summarizer)
+            _summary_data = self.summary_cache.get(cache_token, cache_key)
+        else:
+            _summary_data = None
 
-        summary_data = summarizer(self["smatrix"])
+        if _summary_data is None:
+            _summary_data = self._compute_summary_data(summarizer)
+
+            if use_cache:
+                _summary_data = self.summary_cache.put(cache_token, cache_key, _summary_data)
+
+
+        if _summary_data.shape[0] == self.shape[0]:
+            return self._summerizer_class(summary_data=_summary_data,
+                                          summary_idx=self["row_idx"],
+                                          sdf=self)
+
+        if _summary_data.shape[0] == self.shape[1]:
+            return self._summerizer_class(summary_data=_summary_data,
+                                          summary_idx=self["col_idx"],
+                                          sdf=self)
+
+
+    def _compute_summary_data(self, summarizer):
+
+        source, row_ptrs, col_ptrs = self._summary_source
+
+        if summarizer in BUFFER_SUMMARIZERS and sparse.issparse(source["smatrix"]):
+            stat, axis = BUFFER_SUMMARIZERS[summarizer]
+            summary_data = summarize_buffers(source, (stat,), axis=axis, row_ptrs=row_ptrs, col_ptrs=col_ptrs)[stat]
+        else:
+            summary_data = summarizer(self["smatrix"])
 
         if len(summary_data.shape) == 1:
             _summary_data = summary_data
@@ -281,76 +882,100 @@ class SparseDataFrame(dict):
             else:
                 _summary_data = np.array(summary_data)[:, 0]
 
+        return np.asarray(_summary_data)
 
-        if _summary_data.shape[0] == self["smatrix"].shape[0]:
-            return self._summerizer_class(summary_data=_summary_data,
-                                          summary_idx=self["row_idx"],
-                                          sdf=self)
 
-        if _summary_data.shape[0] == self["smatrix"].shape[1]:
-            return self._summerizer_class(summary_data=_summary_data,
-                                          summary_idx=self["col_idx"],
-                                          sdf=self)
+    def summarize_stats(self, stats=("L0", "L1", "L2", "max", "mean"), axis=0):
+        """
+        summary of several stats computed together from the csr / csc buffers (no intermediate matrix copies),
+        stats in PlaYnlp.stats.SUMMARY_STATS, axis == 0 summarizes each column, axis == 1 each row
+        """
+
+        stats = tuple(stats)
+
+        cache_token, cache_key = self._summary_cache_token_key(stats, axis=axis)
+        summary_data = self.summary_cache.get(cache_token, cache_key)
+
+        if summary_data is None:
+            source, row_ptrs, col_ptrs = self._summary_source
+            stats_data = summarize_buffers(source, stats, axis=axis, row_ptrs=row_ptrs, col_ptrs=col_ptrs)
+
+            summary_data = np.column_stack([stats_data[stat] for stat in stats])
+            summary_data = self.summary_cache.put(cache_token, cache_key, summary_data)
+
+        return SparseDataFrameMultiSummary(summary_data=summary_data,
+                                           summary_idx=self["col_idx"] if axis == 0 else self["row_idx"],
+                                           summary_stats=stats,
+                                           sdf=self)
 
 
     def select_columns(self, select_col=None):
 
-        if select_col != None:
+        if select_col is not None:
             if isinstance(select_col, self._summerizer_class) and select_col._is_bool:
                 _select_col_idx = select_col._data
             else:
                 _select_col_idx = select_col
+
+            col_ptrs = as_ptrs(_select_col_idx, self.shape[1])
         else:
-            _select_col_idx = np.arange(len(self["col_idx"]))
+            col_ptrs = None
 
-        new_col_idx = self["col_idx"][_select_col_idx]
+        new_sdf = self.select_view(col_ptrs=col_ptrs)
 
-        new_smatrix = self["smatrix"][:, _select_col_idx]
-
-        return type(self)(smatrix=new_smatrix,
-                          col_idx=new_col_idx,
-                          row_idx=self["row_idx"],
-                          summarizer=self["summarizer"] if self._has_default_summarizer else None)
+        new_sdf.inherit_label_index("row", self)
+        return new_sdf
 
 
     def select_rows(self, select_row=None):
-        if select_row != None:
+        if select_row is not None:
             if isinstance(select_row, self._summerizer_class) and select_row._is_bool:
                 _select_row_idx = select_row._data
             else:
                 _select_row_idx = select_row
-        else:
-            _select_row_idx = np.arange(len(self["row_idx"]))
 
-        new_row_idx = self["row_idx"][_select_row_idx]
+            row_ptrs = as_ptrs(_select_row_idx, self.shape[0])
+        else:
+            row_ptrs = None
 
-        new_smatrix = self["smatrix"][_select_row_idx, :]
+        new_sdf = self.select_view(row_ptrs=row_ptrs)
 
-        return type(self)(smatrix=new_smatrix,
-                          col_idx=self["col_idx"],
-                          row_idx=new_row_idx,
-                          summarizer=self["summarizer"] if self._has_default_summarizer else None)
+        new_sdf.inherit_label_index("col", self)
+        return new_sdf
 
 
     def sub_sdf(self, select_col=None, select_row=None):
         return self.select_columns(select_col).select_rows(select_row)
 
 
+    def select_by_idx(self, row_idx=None, col_idx=None):
+        """
+        label based selection, row_idx / col_idx are labels (None or slice(None) means all)
+        """
+
+        is_all = lambda labels:labels is None or (isinstance(labels, slice) and labels == slice(None))
+
+        select_col = None if is_all(col_idx) else self.find_col_ptrs(col_idx)
+        select_row = None if is_all(row_idx) else self.find_row_ptrs(row_idx)
+
+        return self.sub_sdf(select_col=select_col, select_row=select_row)
+
+
     def is_matched_col_shape(self, vec):
         if isinstance(vec, list):
-            return len(vec) == self["smatrix"].shape[1]
+            return len(vec) == self.shape[1]
 
         if isinstance(vec, np.ndarray):
             assert len(vec.shape) == 1
-            return vec.shape[0] == self["smatrix"].shape[1]
+            return vec.shape[0] == self.shape[1]
 
     def is_matched_row_shape(self, vec):
         if isinstance(vec, list):
-            return len(vec) == self["smatrix"].shape[0]
+            return len(vec) == self.shape[0]
 
         if isinstance(vec, np.ndarray):
             assert len(vec.shape) == 1
-            return vec.shape[0] == self["smatrix"].shape[0]
+            return vec.shape[0] == self.shape[0]
 
 
     def is_col_vec(self, vec):
@@ -361,12 +986,31 @@ class SparseDataFrame(dict):
         return self.is_matched_col_shape(vec)
 
 
-    def to_pickle_file(self, output_file, with_prefix=True, close_after_dump=True):
+    def to_pickle_file(self, output_file, with_prefix=True, close_after_dump=True, out_of_band=False):
 
         return write_pickle_file(obj=self,
                                  write_file=output_file,
                                  write_file_prefix=with_prefix,
-                                 close_after_write=close_after_dump)
+                                 close_after_write=close_after_dump,
+                                 out_of_band=out_of_band)
+
+
+    def to_disk(self, output_dir, overwrite=False):
+        """
+        write self to the directory output_dir in the memory-mappable format of PlaYnlp.sdf_disk
+        """
+
+        return write_sdf_dir(self, output_dir, overwrite=overwrite)
+
+
+    @classmethod
+    def open(cls, input_dir, mmap_mode="r"):
+        """
+        a sdf of cls on the memory-mapped arrays of the directory input_dir (written by to_disk),
+        opening it reads only the header, the rows / cols are paged in when they are touched
+        """
+
+        return open_sdf_dir(input_dir, sdf_class=cls, mmap_mode=mmap_mode)
 
 #        if isinstance(output_file, file):
 #            assert not output_file.closed
@@ -383,18 +1027,17 @@ class SparseDataFrame(dict):
 
 
     def find_col_ptrs(self, finding_idx):
-
-        # check finding_idx is subset of self._col_idx
-        assert len(np.setdiff1d(finding_idx, self._col_idx)) == 0
-
-        return np.r_[map(lambda xx:np.nonzero(self._col_idx == xx)[0], finding_idx)].T[0]
+        return self.col_label_index.get_ptrs(finding_idx)
 
     def find_row_ptrs(self, finding_idx):
+        return self.row_label_index.get_ptrs(finding_idx)
+
 
-        # check finding_idx is subset of self._row_idx
-        assert len(np.setdiff1d(finding_idx, self._row_idx)) == 0
+    def missing_col_idx(self, finding_idx):
+        return self.col_label_index.missing_labels(finding_idx)
 
-        return np.r_[map(lambda xx:np.nonzero(self._row_idx == xx)[0], finding_idx)].T[0]
+    def missing_row_idx(self, finding_idx):
+        return self.row_label_index.missing_labels(finding_idx)
 
 
     def extend_zeros_cols(self, sdf):
@@ -416,10 +1059,13 @@ class SparseDataFrame(dict):
             extended_col_idx = np.r_[self._col_idx, sdf_diff_self_col_idx]
 
 
-            return type(self)(smatrix=extended_smatrix,
-                              col_idx=extended_col_idx,
-                              row_idx=self["row_idx"],
-                              summarizer=self["summarizer"] if self._has_default_summarizer else None)
+            extended_sdf = type(self)(smatrix=extended_smatrix,
+                                      col_idx=extended_col_idx,
+                                      row_idx=self["row_idx"],
+                                      summarizer=self["summarizer"] if self._has_default_summarizer else None)
+
+            extended_sdf.inherit_label_index("row", self)
+            return extended_sdf
 
 
         else:
@@ -438,189 +1084,287 @@ class SparseDataFrame(dict):
         method == "mean" means if self and sdf have same idx rows, it will replace the rows as mean of sdf and self
         """
 
-        assert method in ("force_append", "keep", "replace", "sum", "mean")
+        assert method in MERGE_METHODS
+
+        new_smatrix, new_col_idx, new_row_idx = join_sdfs(self, sdf, method=method)
+
+        return type(self)(smatrix=new_smatrix,
+                          col_idx=new_col_idx,
+                          row_idx=new_row_idx,
+                          summarizer=self["summarizer"] if self._has_default_summarizer else None)
+
+
+    @property
+    def to_pandas_df(self):
+        # TODO: write a general converting output class Convert and interfaces
+        # sdf.to = Convert(self, ...)
+        # sdf.to.pandas = Convert(sdf, ...).pandas ...
+
+        return pd.DataFrame(self._smatrix.todense(), columns=self._col_idx, index=self._row_idx)
+
 
 
-        self_ext_cols = self.extend_zeros_cols(sdf)
-        sdf_ext_cols = sdf.extend_zeros_cols(self)
 
-        _union_idx = np.r_[self_ext_cols._col_idx, sdf_ext_cols._col_idx]
-        self_col_ptrs_idx = gen_ptrs_idx(self_ext_cols._col_idx, _union_idx.dtype)
-        sdf_col_ptrs_idx = gen_ptrs_idx(sdf_ext_cols._col_idx, _union_idx.dtype)
 
-        _union_idx = np.r_[self_ext_cols._row_idx, sdf_ext_cols._row_idx]
-        self_row_ptrs_idx = gen_ptrs_idx(self_ext_cols._row_idx, _union_idx.dtype)
-        sdf_row_ptrs_idx = gen_ptrs_idx(sdf_ext_cols._row_idx, _union_idx.dtype)
 
 
-        inter_col_idx = np.intersect1d(self_col_ptrs_idx["idx"], sdf_col_ptrs_idx["idx"])
-        inter_row_idx = np.intersect1d(self_row_ptrs_idx["idx"], sdf_row_ptrs_idx["idx"])
 
 
-        self_inter_col_ptrs_idx = sort_by_idx(ptrs_idx_projection(self_col_ptrs_idx, inter_col_idx))
-        sdf_inter_col_ptrs_idx = sort_by_idx(ptrs_idx_projection(sdf_col_ptrs_idx, inter_col_idx))
 
-        self_inter_row_ptrs_idx = sort_by_idx(ptrs_idx_projection(self_row_ptrs_idx, inter_row_idx))
-        sdf_inter_row_ptrs_idx = sort_by_idx(ptrs_idx_projection(sdf_row_ptrs_idx, inter_row_idx))
 
 
-        self_only_row_ptrs_idx = np.setdiff1d(self_row_ptrs_idx, self_inter_row_ptrs_idx)
-        sdf_only_row_ptrs_idx = np.setdiff1d(sdf_row_ptrs_idx, sdf_inter_row_ptrs_idx)
 
 
-        self_ext_cols_smatrix = self_ext_cols._smatrix[:, self_inter_col_ptrs_idx["ptr"]]
-        sdf_ext_cols_smatrix = sdf_ext_cols._smatrix[:, sdf_inter_col_ptrs_idx["ptr"]]
 
-        if method in ("keep", "replace", "sum", "mean"):
-            if method == "keep":
-#                print 'self_only_row_ptrs_idx["idx"] = ',self_only_row_ptrs_idx["idx"]
-#                print 'self_inter_row_ptrs_idx["idx"] = ',self_inter_row_ptrs_idx["idx"]
-#                print 'sdf_only_row_ptrs_idx["idx"] = ',sdf_only_row_ptrs_idx["idx"]
 
-                vstack_smatrix = [self_ext_cols_smatrix[self_only_row_ptrs_idx["ptr"], :]]
-                new_row_idx = self_only_row_ptrs_idx["idx"]
 
 
-                if self_inter_row_ptrs_idx["ptr"].size > 0:
+def grow_buffer(buffer, min_size, dtype=None):
+    """
+    return buffer (or a copy with doubled capacity when it is smaller than min_size or dtype changes)
+    """
 
-                    vstack_smatrix.append(self_ext_cols_smatrix[self_inter_row_ptrs_idx["ptr"], :])
+    dtype = buffer.dtype if dtype is None else dtype
 
-                    new_row_idx = np.r_[new_row_idx,
-                                        self_inter_row_ptrs_idx["idx"]]
+    if len(buffer) >= min_size and dtype == buffer.dtype:
+        return buffer
 
+    new_buffer = np.empty(max(min_size, 2 * len(buffer)), dtype=dtype)
+    new_buffer[:len(buffer)] = buffer
+    return new_buffer
 
-                if sdf_only_row_ptrs_idx["ptr"].size > 0:
 
-                    vstack_smatrix.append(sdf_ext_cols_smatrix[sdf_only_row_ptrs_idx["ptr"], :])
+def labels_result_type(labels, other_labels):
+    try:
+        return np.result_type(labels.dtype, other_labels.dtype)
+    except TypeError:
+        return np.dtype(object)
 
-                    new_row_idx = np.r_[new_row_idx,
-                                        sdf_only_row_ptrs_idx["idx"]]
 
+class SparseDataFrameBuilder(object):
+    """
+    append-only builder of a SparseDataFrame for incremental ingestion:
+    data / indices / indptr and row_idx / col_idx are kept in capacity-doubled buffers,
+    so appending rows costs amortized O(nnz of the new rows), and new terms are appended to col_idx.
 
-                new_smatrix = sparse.vstack(vstack_smatrix).tocsc()
-                new_col_idx = self_inter_col_ptrs_idx["idx"]
+    snapshot() returns a read-only sdf on the current buffers without copying them,
+    later appends never write into the part of the buffers a snapshot refers to.
+    """
 
+    def __init__(self, col_idx=None, summarizer=None, sdf_class=SparseDataFrame,
+                 init_n_rows=1024, init_nnz=65536, dtype=np.float64):
 
-            elif method == "replace":
+        self._sdf_class = sdf_class
+        self._summarizer = summarizer
 
-                vstack_smatrix = [self_ext_cols_smatrix[self_only_row_ptrs_idx["ptr"], :]]
-                new_row_idx = self_only_row_ptrs_idx["idx"]
+        self._n_rows, self._n_cols, self._nnz = 0, 0, 0
 
+        self._data = np.empty(init_nnz, dtype=dtype)
+        self._indices = np.empty(init_nnz, dtype=np.int32)
+        self._indptr = np.zeros(init_n_rows + 1, dtype=np.int32)
 
-                if sdf_inter_row_ptrs_idx["ptr"].size > 0:
+        self._row_idx = np.empty(init_n_rows, dtype=np.int64)
+        self._col_idx = np.empty(0, dtype=np.int64)
+        self._col_ptrs = {}
 
-                    vstack_smatrix.append(sdf_ext_cols_smatrix[sdf_inter_row_ptrs_idx["ptr"], :])
+        if col_idx is not None:
+            self.extend_col_idx(np.asarray(col_idx))
 
-                    new_row_idx = np.r_[new_row_idx,
-                                        sdf_inter_row_ptrs_idx["idx"]]
 
+    @classmethod
+    def from_sdf(cls, sdf, **kwargs):
+        kwargs.setdefault("sdf_class", type(sdf))
+        kwargs.setdefault("summarizer", sdf["summarizer"] if sdf._has_default_summarizer else None)
+        kwargs.setdefault("dtype", sdf._smatrix.dtype)
 
-                if sdf_only_row_ptrs_idx["ptr"].size > 0:
+        builder = cls(col_idx=sdf._col_idx, **kwargs)
+        builder.append_sdf(sdf)
+        return builder
 
-                    vstack_smatrix.append(sdf_ext_cols_smatrix[sdf_only_row_ptrs_idx["ptr"], :])
 
-                    new_row_idx = np.r_[new_row_idx,
-                                        sdf_only_row_ptrs_idx["idx"]]
+    @property
+    def n_rows(self):
+        return self._n_rows
 
 
-                new_smatrix = sparse.vstack(vstack_smatrix).tocsc()
-                new_col_idx = self_inter_col_ptrs_idx["idx"]
+    @property
+    def n_cols(self):
+        return self._n_cols
 
 
+    @property
+    def nnz(self):
+        return self._nnz
 
-            elif method == "sum":
 
-                vstack_smatrix = [self_ext_cols_smatrix[self_only_row_ptrs_idx["ptr"], :]]
-                new_row_idx = self_only_row_ptrs_idx["idx"]
+    def _set_index_dtype(self, max_value):
+        if max_value >= np.iinfo(np.int32).max and self._indptr.dtype != np.int64:
+            self._indices = self._indices.astype(np.int64)
+            self._indptr = self._indptr.astype(np.int64)
 
 
-                if sdf_inter_row_ptrs_idx["ptr"].size > 0:
+    def extend_col_idx(self, col_idx):
+        """
+        return ptrs of col_idx in the builder's col_idx, new labels are appended
+        """
 
-                    vstack_smatrix.append(sdf_ext_cols_smatrix[sdf_inter_row_ptrs_idx["ptr"], :] + self_ext_cols_smatrix[self_inter_row_ptrs_idx["ptr"], :])
+        col_ptrs = self._col_ptrs
+        new_labels = []
 
-                    new_row_idx = np.r_[new_row_idx,
-                                        sdf_inter_row_ptrs_idx["idx"]]
+        _col_idx = col_idx.tolist()
+        mapping = np.empty(len(_col_idx), dtype=np.int64)
 
+        for k, label in enumerate(_col_idx):
+            ptr = col_ptrs.get(label)
 
-                if sdf_only_row_ptrs_idx["ptr"].size > 0:
+            if ptr is None:
+                ptr = self._n_cols + len(new_labels)
+                col_ptrs[label] = ptr
+                new_labels.append(label)
 
-                    vstack_smatrix.append(sdf_ext_cols_smatrix[sdf_only_row_ptrs_idx["ptr"], :])
+            mapping[k] = ptr
 
-                    new_row_idx = np.r_[new_row_idx,
-                                        sdf_only_row_ptrs_idx["idx"]]
+        if len(new_labels) > 0:
+            new_labels = np.array(new_labels, dtype=col_idx.dtype)
+            dtype = new_labels.dtype if self._n_cols == 0 else labels_result_type(self._col_idx, new_labels)
 
+            self._col_idx = grow_buffer(self._col_idx, self._n_cols + len(new_labels), dtype=dtype)
+            self._col_idx[self._n_cols:self._n_cols + len(new_labels)] = new_labels
+            self._n_cols = self._n_cols + len(new_labels)
 
-                new_smatrix = sparse.vstack(vstack_smatrix).tocsc()
-                new_col_idx = self_inter_col_ptrs_idx["idx"]
+        return mapping
 
 
+    def append_rows(self, smatrix, row_idx=None, col_idx=None):
+        """
+        append rows of smatrix, col_idx are the labels of smatrix's columns (default: the builder's first columns)
+        """
 
-            elif method == "mean":
+        csr = sparse.csr_matrix(smatrix)
+        n_new_rows, n_new_nnz = csr.shape[0], csr.nnz
 
-                vstack_smatrix = [self_ext_cols_smatrix[self_only_row_ptrs_idx["ptr"], :]]
-                new_row_idx = self_only_row_ptrs_idx["idx"]
+        if col_idx is None:
+            assert csr.shape[1] <= self._n_cols
+            col_map = None
+        else:
+            assert len(col_idx) == csr.shape[1]
+            col_map = self.extend_col_idx(np.asarray(col_idx))
 
+        if row_idx is None:
+            row_idx = np.arange(self._n_rows, self._n_rows + n_new_rows)
+        else:
+            row_idx = np.asarray(row_idx)
+            assert len(row_idx) == n_new_rows
 
-                if sdf_inter_row_ptrs_idx["ptr"].size > 0:
+        n_rows, nnz = self._n_rows, self._nnz
 
-                    vstack_smatrix.append((sdf_ext_cols_smatrix[sdf_inter_row_ptrs_idx["ptr"], :] + self_ext_cols_smatrix[self_inter_row_ptrs_idx["ptr"], :]) / 2.0)
+        self._set_index_dtype(max(nnz + n_new_nnz, self._n_cols))
 
-                    new_row_idx = np.r_[new_row_idx,
-                                        sdf_inter_row_ptrs_idx["idx"]]
+        self._data = grow_buffer(self._data, nnz + n_new_nnz, dtype=np.result_type(self._data.dtype, csr.dtype))
+        self._indices = grow_buffer(self._indices, nnz + n_new_nnz)
+        self._indptr = grow_buffer(self._indptr, n_rows + n_new_rows + 1)
 
+        row_dtype = row_idx.dtype if n_rows == 0 else labels_result_type(self._row_idx, row_idx)
+        self._row_idx = grow_buffer(self._row_idx, n_rows + n_new_rows, dtype=row_dtype)
 
-                if sdf_only_row_ptrs_idx["ptr"].size > 0:
+        src_start = csr.indptr[0]
 
-                    vstack_smatrix.append(sdf_ext_cols_smatrix[sdf_only_row_ptrs_idx["ptr"], :])
+        new_data = csr.data[src_start:src_start + n_new_nnz]
+        new_indices = csr.indices[src_start:src_start + n_new_nnz]
 
-                    new_row_idx = np.r_[new_row_idx,
-                                        sdf_only_row_ptrs_idx["idx"]]
+        if col_map is not None:
+            new_indices = col_map[new_indices]
 
+        if not (csr.has_sorted_indices and (col_map is None or (np.diff(col_map) > 0).all())):
+            # keep indices sorted within rows, snapshots are read-only and could not be sorted in place
+            order = np.lexsort((new_indices, np.repeat(np.arange(n_new_rows), np.diff(csr.indptr))))
+            new_data, new_indices = new_data[order], new_indices[order]
 
-                new_smatrix = sparse.vstack(vstack_smatrix).tocsc()
-                new_col_idx = self_inter_col_ptrs_idx["idx"]
+        self._data[nnz:nnz + n_new_nnz] = new_data
+        self._indices[nnz:nnz + n_new_nnz] = new_indices
 
+        self._indptr[n_rows + 1:n_rows + n_new_rows + 1] = csr.indptr[1:] - src_start + nnz
+        self._row_idx[n_rows:n_rows + n_new_rows] = row_idx
 
-        elif method == "force_append":
+        self._n_rows, self._nnz = n_rows + n_new_rows, nnz + n_new_nnz
 
-            new_smatrix = sparse.vstack([self_ext_cols_smatrix,
-                                         sdf_ext_cols_smatrix]).tocsc()
+        return self
 
-            new_col_idx = self_inter_col_ptrs_idx["idx"]
-            new_row_idx = np.r_[self_ext_cols._row_idx,
-                                sdf_ext_cols._row_idx]
 
+    def append_sdf(self, sdf):
+        return self.append_rows(sdf._smatrix, row_idx=sdf._row_idx, col_idx=sdf._col_idx)
 
 
-        return type(self)(smatrix=new_smatrix,
-                          col_idx=new_col_idx,
-                          row_idx=new_row_idx,
-                          summarizer=self["summarizer"] if self._has_default_summarizer else None)
+    def snapshot(self):
+        n_rows, n_cols, nnz = self._n_rows, self._n_cols, self._nnz
 
+        buffers = [self._data[:nnz], self._indices[:nnz], self._indptr[:n_rows + 1],
+                   self._col_idx[:n_cols], self._row_idx[:n_rows]]
 
-    @property
-    def to_pandas_df(self):
-        # TODO: write a general converting output class Convert and interfaces
-        # sdf.to = Convert(self, ...)
-        # sdf.to.pandas = Convert(sdf, ...).pandas ...
+        for buffer in buffers:
+            buffer.flags.writeable = False
 
-        return pd.DataFrame(self._smatrix.todense(), columns=self._col_idx, index=self._row_idx)
+        data, indices, indptr, col_idx, row_idx = buffers
+
+        smatrix = sparse.csr_matrix((data, indices, indptr), shape=(n_rows, n_cols), copy=False)
+        smatrix.has_sorted_indices = True
 
+        return self._sdf_class(smatrix=smatrix,
+                               col_idx=col_idx,
+                               row_idx=row_idx,
+                               summarizer=self._summarizer,
+                               copy_idx=False)
 
 
+def merge_many(sdfs, method="replace", trace_memory=False):
+    """
+    merge all sdfs in one pass (instead of len(sdfs) - 1 calls of merge_sdf),
+    method in ("force_append","keep","replace","sum","mean"), see PlaYnlp.join.join_many_sdfs
 
+    with trace_memory=True, it returns (merged_sdf, merge_stats) and merge_stats["peak_memory"] is
+    the peak bytes traced by tracemalloc during the merge (None if tracemalloc is not available)
+    """
 
+    assert method in MERGE_METHODS
+    assert len(sdfs) > 0
 
+    do_trace = trace_memory and tracemalloc is not None
+    start_tracing = do_trace and not tracemalloc.is_tracing()
 
+    if start_tracing:
+        tracemalloc.start()
 
+    if do_trace:
+        base_memory = tracemalloc.get_traced_memory()[0]
+        # the peak of an already running trace could predate the merge
+        tracemalloc.reset_peak()
 
+    try:
+        new_smatrix, new_col_idx, new_row_idx = join_many_sdfs(sdfs, method=method)
 
+        if do_trace:
+            peak_memory = tracemalloc.get_traced_memory()[1] - base_memory
 
+    finally:
+        if start_tracing:
+            tracemalloc.stop()
 
+    first_sdf = sdfs[0]
 
+    merged_sdf = type(first_sdf)(smatrix=new_smatrix,
+                                 col_idx=new_col_idx,
+                                 row_idx=new_row_idx,
+                                 summarizer=first_sdf["summarizer"] if first_sdf._has_default_summarizer else None)
 
+    if trace_memory:
+        merge_stats = {"n_sdfs":len(sdfs),
+                       "input_nnz":sum(sdf._smatrix.nnz for sdf in sdfs),
+                       "output_nnz":new_smatrix.nnz,
+                       "peak_memory":peak_memory if do_trace else None}
 
+        return merged_sdf, merge_stats
 
+    return merged_sdf
 
 
 if __name__ == '__main__':
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from .join import gather_rows_ptrs
+
+
+# "L0": number of nonzeros, "sign": sum of signs (L0_norm_col_summarizer),
+# "max" / "min" / "mean" take the implicit zeros into account
+SUMMARY_STATS = ("L0", "L1", "L2", "sum", "sign", "max", "min", "mean")
+
+FLOAT_STATS = ("L2", "mean")
+
+
+def stats_dtype(stat, data_dtype):
+    if stat == "L0":
+        return np.dtype(np.int64)
+
+    if stat in FLOAT_STATS:
+        return np.result_type(data_dtype, np.float64)
+
+    if data_dtype.kind in "biu":
+        return np.dtype(np.int64)
+
+    return data_dtype
+
+
+def _summed_stats(stats, data, weights, sum_by_group):
+    """
+    the additive stats: sum_by_group(values) sums values (weighted by weights) over groups
+    """
+
+    results = {}
+    weighted = lambda values:values if weights is None else values * weights
+
+    for stat in stats:
+        if stat == "L0":
+            results[stat] = sum_by_group(weighted((data != 0).astype(np.float64)))
+        elif stat == "L1":
+            results[stat] = sum_by_group(weighted(np.abs(data)))
+        elif stat == "L2":
+            results[stat] = np.sqrt(sum_by_group(weighted(np.square(data, dtype=np.float64))))
+        elif stat == "sign":
+            results[stat] = sum_by_group(weighted(np.sign(data)))
+        elif stat in ("sum", "mean"):
+            if not "_sum" in results:
+                results["_sum"] = sum_by_group(weighted(data))
+
+    return results
+
+
+def _extreme_stats(stats, results, n_inner, covered, reduce_groups):
+    """
+    max / min of each group, with the implicit zeros of groups not covering all n_inner selected inners
+    """
+
+    for stat in ("max", "min"):
+        if stat in stats:
+            ufunc = np.maximum if stat == "max" else np.minimum
+            extreme = reduce_groups(ufunc)
+
+            if n_inner > 0:
+                has_zeros = covered < n_inner
+                extreme[has_zeros] = ufunc(extreme[has_zeros], 0)
+
+            results[stat] = extreme
+
+    return results
+
+
+def major_axis_stats(smatrix, stats, out_ptrs=None, inner_ptrs=None):
+    """
+    stats of the major axis of a csr (rows) / csc (cols) matrix, on the selected out_ptrs (None means all),
+    summed over the selected inner_ptrs (None means all, repeated ptrs are counted repeatedly)
+    """
+
+    n_out_all, n_inner_all = smatrix.shape if smatrix.format == "csr" else smatrix.shape[::-1]
+
+    if out_ptrs is None:
+        nnz = smatrix.indptr[-1]
+        data, indices = smatrix.data[smatrix.indptr[0]:nnz], smatrix.indices[smatrix.indptr[0]:nnz]
+        nnzs = np.diff(smatrix.indptr)
+    else:
+        ptrs, nnzs = gather_rows_ptrs(smatrix.indptr, out_ptrs)
+        data, indices = smatrix.data[ptrs], smatrix.indices[ptrs]
+
+    n_out = len(nnzs)
+    groups = np.repeat(np.arange(n_out), nnzs)
+
+    if inner_ptrs is None:
+        weights = None
+        n_inner = n_inner_all
+    else:
+        weights = np.bincount(inner_ptrs, minlength=n_inner_all)[indices]
+        n_inner = len(inner_ptrs)
+
+    sum_by_group = lambda values:np.bincount(groups, weights=values, minlength=n_out)
+
+    results = _summed_stats(stats, data, weights, sum_by_group)
+
+    if "max" in stats or "min" in stats:
+        if weights is None:
+            covered = nnzs
+        else:
+            covered = sum_by_group(weights).astype(np.int64)
+            selected = weights > 0
+            data, groups = data[selected], groups[selected]
+
+        counts = np.bincount(groups, minlength=n_out)
+        starts = np.cumsum(counts) - counts
+        nonempty = counts > 0
+
+        def reduce_groups(ufunc):
+            extreme = np.zeros(n_out, dtype=data.dtype)
+            if len(data) > 0:
+                extreme[nonempty] = ufunc.reduceat(data, starts[nonempty])
+            return extreme
+
+        results = _extreme_stats(stats, results, n_inner, covered, reduce_groups)
+
+    return results, n_inner
+
+
+def minor_axis_stats(smatrix, stats, out_ptrs=None, inner_ptrs=None):
+    """
+    stats of the minor axis of a csr (cols) / csc (rows) matrix, on the selected out_ptrs (None means all),
+    summed over the selected major inner_ptrs (None means all, repeated ptrs are counted repeatedly)
+    """
+
+    n_inner_all, n_out_all = smatrix.shape if smatrix.format == "csr" else smatrix.shape[::-1]
+
+    if inner_ptrs is None:
+        nnz = smatrix.indptr[-1]
+        data, indices = smatrix.data[smatrix.indptr[0]:nnz], smatrix.indices[smatrix.indptr[0]:nnz]
+        n_inner = n_inner_all
+    else:
+        ptrs, _ = gather_rows_ptrs(smatrix.indptr, inner_ptrs)
+        data, indices = smatrix.data[ptrs], smatrix.indices[ptrs]
+        n_inner = len(inner_ptrs)
+
+    sum_by_group = lambda values:np.bincount(indices, weights=values, minlength=n_out_all)
+
+    results = _summed_stats(stats, data, None, sum_by_group)
+
+    if "max" in stats or "min" in stats:
+        covered = np.bincount(indices, minlength=n_out_all)
+
+        def reduce_groups(ufunc):
+            extreme = np.full(n_out_all, np.inf if ufunc is np.minimum else -np.inf)
+            ufunc.at(extreme, indices, data.astype(np.float64))
+            extreme[covered == 0] = 0
+            return extreme
+
+        results = _extreme_stats(stats, results, n_inner, covered, reduce_groups)
+
+    if out_ptrs is not None:
+        results = dict((stat, values[out_ptrs]) for stat, values in results.items())
+
+    return results, n_inner
+
+
+def summarize_buffers(sdf, stats=("L1",), axis=0, row_ptrs=None, col_ptrs=None):
+    """
+    {stat: summary data} of sdf's smatrix restricted to row_ptrs / col_ptrs (None means all),
+    computed straight from sdf's csr / csc buffers (no intermediate matrix).
+    axis == 0 summarizes each column over rows, axis == 1 each row over columns.
+    """
+
+    for stat in stats:
+        assert stat in SUMMARY_STATS
+
+    assert axis in (0, 1)
+
+    # out: the axis of the summary's entries, inner: the axis summed over
+    if axis == 0:
+        out_ptrs, inner_ptrs = col_ptrs, row_ptrs
+        out_format, inner_format = "csc", "csr"
+    else:
+        out_ptrs, inner_ptrs = row_ptrs, col_ptrs
+        out_format, inner_format = "csr", "csc"
+
+    available_formats = sdf.smatrix_formats
+
+    if out_format in available_formats and inner_format in available_formats:
+        selected_nnz = lambda smatrix, ptrs:smatrix.nnz if ptrs is None else np.diff(smatrix.indptr)[ptrs].sum()
+        use_out_format = selected_nnz(sdf.smatrix_as(out_format), out_ptrs) <= selected_nnz(sdf.smatrix_as(inner_format), inner_ptrs)
+    else:
+        use_out_format = out_format in available_formats
+
+    if use_out_format:
+        smatrix = sdf.smatrix_as(out_format)
+        results, n_inner = major_axis_stats(smatrix, stats, out_ptrs=out_ptrs, inner_ptrs=inner_ptrs)
+    else:
+        smatrix = sdf.smatrix_as(inner_format)
+        results, n_inner = minor_axis_stats(smatrix, stats, out_ptrs=out_ptrs, inner_ptrs=inner_ptrs)
+
+    summary_data = {}
+
+    for stat in stats:
+        if stat in ("sum", "mean"):
+            values = results["_sum"] if stat == "sum" else results["_sum"] / float(max(n_inner, 1))
+        else:
+            values = results[stat]
+
+        summary_data[stat] = values.astype(stats_dtype(stat, smatrix.dtype))
+
+    return summary_data
+
+
+def top_k_positions(data, k=20, reverse=False, tie_keys=None):
+    """
+    positions of the k largest (or k smallest with reverse=True) entries of data in ascending order of data,
+    the same as np.argsort(data, kind="mergesort")[-k:] (or [:k]): ties are ordered by tie_keys (default: positions).
+    it partially sorts data (argpartition) and only fully sorts the k selected entries.
+    """
+
+    data = np.asarray(data)
+    n = len(data)
+
+    if tie_keys is None:
+        tie_keys = np.arange(n)
+
+    has_nan = data.dtype.kind in "fc" and np.isnan(data).any()
+
+    if k <= 0 or k >= n or has_nan:
+        order = np.lexsort((tie_keys, data))
+        return order[:k] if reverse else order[-k:]
+
+    if reverse:
+        threshold = data[np.argpartition(data, k - 1)[:k]].max()
+        selected = np.nonzero(data < threshold)[0]
+    else:
+        threshold = data[np.argpartition(data, n - k)[n - k:]].min()
+        selected = np.nonzero(data > threshold)[0]
+
+    ties = np.nonzero(data == threshold)[0]
+    ties = ties[np.argsort(tie_keys[ties], kind="mergesort")]
+    n_ties = k - len(selected)
+
+    selected = np.r_[selected, ties[:n_ties] if reverse else ties[len(ties) - n_ties:]]
+
+    return selected[np.lexsort((tie_keys[selected], data[selected]))]
+
+
+class TopKAccumulator(object):
+    """
+    streaming top-k: push (scores, ptrs[, idx]) of row blocks or shards (ptrs are global, e.g. block offset + local ptr),
+    or merge accumulators of other shards; only k candidates are kept.
+    the result is the same as top_k_positions over all pushed scores with ties ordered by ptrs.
+    """
+
+    def __init__(self, k=20, reverse=False):
+        self.k = k
+        self.reverse = reverse
+
+        self._scores = np.empty(0)
+        self._ptrs = np.empty(0, dtype=np.int64)
+        self._idx = None
+
+
+    def push(self, scores, ptrs, idx=None):
+        scores, ptrs = np.asarray(scores), np.asarray(ptrs, dtype=np.int64)
+        assert len(scores) == len(ptrs)
+
+        all_scores = np.r_[self._scores, scores] if len(self._scores) > 0 else scores
+        all_ptrs = np.r_[self._ptrs, ptrs]
+
+        selected = top_k_positions(all_scores, k=self.k, reverse=self.reverse, tie_keys=all_ptrs)
+
+        if idx is not None or self._idx is not None:
+            assert idx is not None and (self._idx is not None or len(self._ptrs) == 0)
+            all_idx = np.r_[self._idx, np.asarray(idx)] if self._idx is not None else np.asarray(idx)
+            self._idx = all_idx[selected]
+
+        self._scores, self._ptrs = all_scores[selected], all_ptrs[selected]
+
+        return self
+
+
+    def merge(self, accumulator):
+        assert accumulator.k == self.k and accumulator.reverse == self.reverse
+
+        if len(accumulator._ptrs) > 0:
+            self.push(accumulator._scores, accumulator._ptrs, idx=accumulator._idx)
+
+        return self
+
+
+    @property
+    def scores(self):
+        return self._scores
+
+
+    @property
+    def ptrs(self):
+        return self._ptrs
+
+
+    @property
+    def idx(self):
+        return self._idx
+
+
+if __name__ == '__main__':
+    pass
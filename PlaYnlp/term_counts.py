@@ -0,0 +1,444 @@
+# -*- coding: utf-8 -*-
+
+import re
+import zlib
+
+import numpy as np
+from scipy import sparse
+
+from .ngrams import NgramFilter, flatten_ns, ngram_ids, text_codepoints, text_ngram_ids, text_ngrams
+
+
+# CountVectorizer's default token_pattern, used when no tokenizer is given
+DEFAULT_TOKEN_PATTERN = r"(?u)\b\w\w+\b"
+
+# the odd multiplier (2 ** 64 / golden ratio) mixing term keys before they are hashed to columns
+HASH_MIX_MULTIPLIER = np.uint64(0x9e3779b97f4a7c15)
+
+
+class TermKeyVocabulary(object):
+    """
+    uint64 term keys -> column ptrs in first seen order,
+    looked up by binary search over the sorted keys (no python object per term)
+    """
+
+    def __init__(self):
+        self.keys = np.empty(0, dtype=np.uint64)
+
+        self._sorted_keys = np.empty(0, dtype=np.uint64)
+        self._sorted_cols = np.empty(0, dtype=np.int64)
+
+
+    def __len__(self):
+        return len(self.keys)
+
+
+    def lookup(self, keys):
+        """
+        column ptrs of keys, -1 for the keys not in the vocabulary
+        """
+
+        keys = np.asarray(keys, dtype=np.uint64)
+
+        if len(self._sorted_keys) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+
+        positions = np.minimum(np.searchsorted(self._sorted_keys, keys), len(self._sorted_keys) - 1)
+        found = self._sorted_keys[positions] == keys
+
+        return np.where(found, self._sorted_cols[positions], -1)
+
+
+    def add(self, keys):
+        """
+        return (cols, new_positions): the column ptrs of keys (the new keys are appended in order of first occurrence)
+        and the positions in keys of the first occurrence of each new key
+        """
+
+        keys = np.asarray(keys, dtype=np.uint64)
+        cols = self.lookup(keys)
+
+        is_new = cols < 0
+
+        if is_new.any():
+            new_keys, first_positions = np.unique(keys[is_new], return_index=True)
+            # first occurrences in keys' order define the new columns' order
+            order = np.argsort(first_positions, kind="mergesort")
+            new_positions = np.nonzero(is_new)[0][first_positions[order]]
+
+            new_cols = np.arange(len(self.keys), len(self.keys) + len(new_keys))
+            self.keys = np.r_[self.keys, new_keys[order]]
+
+            merged_keys = np.r_[self._sorted_keys, new_keys[order]]
+            merged_cols = np.r_[self._sorted_cols, new_cols]
+            merged_order = np.argsort(merged_keys, kind="mergesort")
+
+            self._sorted_keys, self._sorted_cols = merged_keys[merged_order], merged_cols[merged_order]
+
+            cols = self.lookup(keys)
+        else:
+            new_positions = np.empty(0, dtype=np.int64)
+
+        return cols, new_positions
+
+
+class NgramTokenizer(object):
+    """
+    character n-gram tokenizer for n (an int or a list) without the n-grams in filter_list.
+    called on a text it returns the n-gram strings (as tokenize_gen(lambda text:ngram(text, n, filter_list))),
+    batch_token_keys gives the integer keys of a batch of texts for the counting backend
+    """
+
+    def __init__(self, n, filter_list=()):
+        assert all(n_i >= 1 for n_i in flatten_ns(n))
+
+        self.n = n
+        self.ngram_filter = filter_list if isinstance(filter_list, NgramFilter) else NgramFilter(filter_list)
+
+
+    def __call__(self, text):
+        return text_ngrams(text, self.n, ngram_filter=self.ngram_filter) if isinstance(text, str) else []
+
+
+    def batch_token_keys(self, texts):
+        """
+        return (keys, doc_lengths, tokens_of): the uint64 keys (PlaYnlp.ngrams ids) of all texts' n-grams one text after
+        another, the number of n-grams of each text and tokens_of(positions) giving the strings of the n-grams at positions
+        """
+
+        keys, starts, ns, doc_lengths = [], [], [], []
+
+        for text in texts:
+            if isinstance(text, str):
+                text_keys, text_starts, text_ns = text_ngram_ids(text, self.n, ngram_filter=self.ngram_filter)
+            else:
+                text_keys, text_starts, text_ns = np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+            keys.append(text_keys)
+            starts.append(text_starts)
+            ns.append(text_ns)
+            doc_lengths.append(len(text_keys))
+
+        doc_lengths = np.array(doc_lengths, dtype=np.int64)
+
+        if len(keys) == 0:
+            return np.empty(0, dtype=np.uint64), doc_lengths, None
+
+        starts, ns = np.concatenate(starts), np.concatenate(ns)
+        doc_ends = np.cumsum(doc_lengths)
+
+        def tokens_of(positions):
+            doc_ptrs = np.searchsorted(doc_ends, positions, side="right")
+            return [texts[doc_ptr][start:start + n_i] for doc_ptr, start, n_i
+                    in zip(doc_ptrs.tolist(), starts[positions].tolist(), ns[positions].tolist())]
+
+        return np.concatenate(keys), doc_lengths, tokens_of
+
+
+class TermColumns(object):
+    """
+    a fixed vocabulary: the column ptrs of terms (in terms' order), the tokens outside it get -1.
+    the sorted uint64 keys of the terms (for a NgramTokenizer's batch_token_keys) are built on first use
+    """
+
+    def __init__(self, terms):
+        self.terms = np.asarray(terms)
+
+        self._term_cols = dict((term, col) for col, term in enumerate(self.terms.tolist()))
+        assert len(self._term_cols) == len(self.terms), "terms are not unique"
+        self._sorted_keys, self._sorted_cols = None, None
+
+
+    def __len__(self):
+        return len(self.terms)
+
+
+    def token_cols(self, tokens):
+        get_col = self._term_cols.get
+        return np.fromiter((get_col(token, -1) for token in tokens), dtype=np.int64, count=len(tokens))
+
+
+    def key_cols(self, keys):
+        if self._sorted_keys is None:
+            # 0 is never the id of a n-gram, it stands for the empty term
+            term_keys = np.array([ngram_ids(text_codepoints(term), len(term))[0] if len(term) > 0 else 0
+                                  for term in self.terms.tolist()], dtype=np.uint64)
+            order = np.argsort(term_keys, kind="mergesort")
+
+            self._sorted_keys, self._sorted_cols = term_keys[order], order.astype(np.int64)
+
+        if len(self._sorted_keys) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+
+        positions = np.minimum(np.searchsorted(self._sorted_keys, keys), len(self._sorted_keys) - 1)
+
+        return np.where(self._sorted_keys[positions] == keys, self._sorted_cols[positions], -1)
+
+
+class HashedColumns(object):
+    """
+    the hashing trick: a token's column is its mixed key modulo n_features, with no vocabulary kept.
+    the keys are stable across processes (crc32 of the utf-8 tokens, PlaYnlp.ngrams ids for a NgramTokenizer),
+    the terms are the column numbers
+    """
+
+    def __init__(self, n_features=2 ** 20):
+        assert n_features >= 1
+
+        self.n_features = n_features
+
+
+    def __len__(self):
+        return self.n_features
+
+
+    @property
+    def terms(self):
+        return np.arange(self.n_features)
+
+
+    def token_cols(self, tokens):
+        keys = np.fromiter((zlib.crc32(token.encode("utf-8", "surrogatepass")) for token in tokens), dtype=np.uint64, count=len(tokens))
+        return self.key_cols(keys)
+
+
+    def key_cols(self, keys):
+        with np.errstate(over="ignore"):
+            mixed = np.asarray(keys, dtype=np.uint64) * HASH_MIX_MULTIPLIER
+
+        mixed ^= mixed >> np.uint64(29)
+
+        return (mixed % np.uint64(self.n_features)).astype(np.int64)
+
+
+def text_preprocessor(lowercase=True):
+    if lowercase:
+        return lambda text:text.lower() if isinstance(text, str) else text
+
+    return lambda text:text
+
+
+def pattern_tokenizer(token_pattern=DEFAULT_TOKEN_PATTERN):
+    token_regex = re.compile(token_pattern)
+    return lambda text:token_regex.findall(text) if isinstance(text, str) else []
+
+
+def token_lists_cols(token_lists, vocabulary):
+    """
+    return (cols, doc_lengths): the column ptrs of the tokens of all token_lists one list after another
+    (new tokens are added to the dict vocabulary: token -> column ptr) and the number of tokens of each list
+    """
+
+    doc_lengths = np.fromiter((len(tokens) for tokens in token_lists), dtype=np.int64, count=len(token_lists))
+
+    get_col = vocabulary.setdefault
+    cols = np.fromiter((get_col(token, len(vocabulary)) for tokens in token_lists for token in tokens),
+                       dtype=np.int64, count=int(doc_lengths.sum()))
+
+    return cols, doc_lengths
+
+
+def count_docs_cols(cols, doc_lengths, n_cols, dtype=np.int64):
+    """
+    csr of the counts of cols in each doc (the cols of the docs one doc after another, doc_lengths of them),
+    the (doc, col) pairs are counted by np.unique over doc * n_cols + col, so the indices are sorted
+    """
+
+    n_docs = len(doc_lengths)
+
+    pairs = np.repeat(np.arange(n_docs, dtype=np.int64), doc_lengths) * max(n_cols, 1) + cols
+    pairs, counts = np.unique(pairs, return_counts=True)
+
+    indptr = np.zeros(n_docs + 1, dtype=np.int64)
+    np.cumsum(np.bincount(pairs // max(n_cols, 1), minlength=n_docs), out=indptr[1:])
+
+    csr = sparse.csr_matrix((counts.astype(dtype), pairs % max(n_cols, 1), indptr), shape=(n_docs, n_cols))
+    csr.has_sorted_indices = True
+
+    return csr
+
+
+def drop_missing_cols(cols, doc_lengths):
+    """
+    return (cols, doc_lengths) without the -1 cols (the tokens outside a fixed vocabulary)
+    """
+
+    kept = cols >= 0
+
+    if kept.all():
+        return cols, doc_lengths
+
+    doc_ptrs = np.repeat(np.arange(len(doc_lengths)), doc_lengths)
+
+    return cols[kept], np.bincount(doc_ptrs[kept], minlength=len(doc_lengths)).astype(np.int64)
+
+
+def count_texts_in_columns(texts, columns, tokenizer=None, lowercase=True, token_pattern=DEFAULT_TOKEN_PATTERN,
+                           dtype=np.int64):
+    """
+    csr (len(texts) x len(columns)) of the counts of the tokens of texts in columns (a TermColumns or HashedColumns),
+    the tokens outside columns are dropped
+    """
+
+    preprocess = text_preprocessor(lowercase)
+    tokenizer = pattern_tokenizer(token_pattern) if tokenizer is None else tokenizer
+
+    texts = [preprocess(text) for text in texts]
+
+    if hasattr(tokenizer, "batch_token_keys"):
+        keys, doc_lengths, _ = tokenizer.batch_token_keys(texts)
+        cols = columns.key_cols(keys)
+    else:
+        token_lists = [tokenizer(text) for text in texts]
+
+        doc_lengths = np.fromiter((len(tokens) for tokens in token_lists), dtype=np.int64, count=len(token_lists))
+        cols = columns.token_cols([token for tokens in token_lists for token in tokens])
+
+    cols, doc_lengths = drop_missing_cols(cols, doc_lengths)
+
+    return count_docs_cols(cols, doc_lengths, len(columns), dtype=dtype)
+
+
+def widen_csr(csr, n_cols):
+    """
+    csr with n_cols columns (>= csr's), sharing csr's buffers
+    """
+
+    if csr.shape[1] == n_cols:
+        return csr
+
+    widened = sparse.csr_matrix((csr.data, csr.indices, csr.indptr), shape=(csr.shape[0], n_cols), copy=False)
+    widened.has_sorted_indices = csr.has_sorted_indices
+
+    return widened
+
+
+def sort_terms(csr, terms):
+    """
+    return (csr, terms) with the columns in the sorted order of terms (as CountVectorizer's vocabulary)
+    """
+
+    terms = np.array(terms)
+
+    if len(terms) == 0:
+        return csr, terms
+
+    order = np.argsort(terms, kind="mergesort")
+
+    col_map = np.empty(len(order), dtype=np.int64)
+    col_map[order] = np.arange(len(order))
+
+    sorted_csr = sparse.csr_matrix((csr.data, col_map[csr.indices], csr.indptr), shape=csr.shape)
+    sorted_csr.sort_indices()
+
+    return sorted_csr, terms[order]
+
+
+def count_texts(texts, tokenizer=None, lowercase=True, token_pattern=DEFAULT_TOKEN_PATTERN, chunk_size=10000,
+                dtype=np.int64):
+    """
+    return (csr, terms): the counts of the tokens of texts (a sequence) and the sorted terms, the same as
+    CountVectorizer(tokenizer=tokenizer, lowercase=lowercase, token_pattern=token_pattern).fit_transform(texts)
+    and its feature names.
+    tokenizer is a callable (text -> tokens) or a NgramTokenizer, whose integer keys are counted without strings,
+    texts are tokenized and counted chunk_size at a time
+    """
+
+    preprocess = text_preprocessor(lowercase)
+    tokenizer = pattern_tokenizer(token_pattern) if tokenizer is None else tokenizer
+
+    use_keys = hasattr(tokenizer, "batch_token_keys")
+
+    key_vocabulary, token_vocabulary, terms = TermKeyVocabulary(), {}, []
+    csr_blocks = []
+
+    for start in range(0, len(texts), chunk_size):
+        chunk = [preprocess(text) for text in texts[start:start + chunk_size]]
+
+        if use_keys:
+            keys, doc_lengths, tokens_of = tokenizer.batch_token_keys(chunk)
+            cols, new_positions = key_vocabulary.add(keys)
+            terms.extend(tokens_of(new_positions))
+        else:
+            cols, doc_lengths = token_lists_cols([tokenizer(text) for text in chunk], token_vocabulary)
+
+        # the vocabulary only grows, the chunk's counts are widened to the final columns at the end
+        csr_blocks.append(count_docs_cols(cols, doc_lengths, max(len(key_vocabulary), len(token_vocabulary)), dtype=dtype))
+
+    if not use_keys:
+        terms = sorted(token_vocabulary, key=token_vocabulary.get)
+
+    n_cols = len(terms)
+
+    if len(csr_blocks) == 0:
+        csr = sparse.csr_matrix((0, n_cols), dtype=dtype)
+    else:
+        csr = sparse.vstack([widen_csr(csr_block, n_cols) for csr_block in csr_blocks], format="csr")
+
+    return sort_terms(csr, terms)
+
+
+def reservoir_sample(items, sample_size, random_state=None):
+    """
+    a uniform sample of sample_size of the items of the iterable items (all of them if there are fewer),
+    in one pass keeping only sample_size items (algorithm R)
+    """
+
+    random_state = np.random.RandomState(random_state) if not isinstance(random_state, np.random.RandomState) else random_state
+
+    sample = []
+
+    for n_seen, item in enumerate(items):
+        if n_seen < sample_size:
+            sample.append(item)
+        else:
+            replaced = random_state.randint(0, n_seen + 1)
+
+            if replaced < sample_size:
+                sample[replaced] = item
+
+    return sample
+
+
+def sample_vocabulary(texts, tokenizer=None, lowercase=True, token_pattern=DEFAULT_TOKEN_PATTERN, min_df=1,
+                      max_features=None, chunk_size=10000):
+    """
+    the sorted terms of texts (a sample of the corpus) found in at least min_df of them,
+    only the max_features most frequent ones (by total count) if max_features is not None
+    """
+
+    csr, terms = count_texts(texts, tokenizer=tokenizer, lowercase=lowercase, token_pattern=token_pattern,
+                             chunk_size=chunk_size)
+
+    kept = np.bincount(csr.indices, minlength=len(terms)) >= min_df
+
+    if max_features is not None:
+        term_counts = np.asarray(csr.sum(axis=0)).ravel()
+        term_counts[~kept] = -1
+
+        # the most frequent terms, ties broken by the terms' order
+        top = np.argsort(-term_counts, kind="mergesort")[:max_features]
+        kept = np.zeros(len(terms), dtype=bool)
+        kept[top[term_counts[top] >= 0]] = True
+
+    return terms[kept]
+
+
+def count_text_chunks(chunks, columns, tokenizer=None, lowercase=True, token_pattern=DEFAULT_TOKEN_PATTERN,
+                      dtype=np.int64):
+    """
+    for each chunk of chunks (an iterable of sequences of (id, text) pairs), yield (ids, csr):
+    the ids of the chunk and the counts of their texts' tokens in columns (a TermColumns or HashedColumns),
+    only one chunk is tokenized at a time
+    """
+
+    for chunk in chunks:
+        ids = [doc_id for doc_id, _ in chunk]
+        texts = [text for _, text in chunk]
+
+        yield ids, count_texts_in_columns(texts, columns, tokenizer=tokenizer, lowercase=lowercase,
+                                          token_pattern=token_pattern, dtype=dtype)
+
+
+if __name__ == '__main__':
+    pass
@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
 
 
+from collections import OrderedDict
 import jieba, nltk
 import re
+import threading
+
+from .ngrams import NgramFilter, text_ngrams
 
 #ngram_no_filter = lambda text, n: (text[k:k+n] for k in range(len(text)-n+1))
 #
@@ -11,7 +15,44 @@ import re
 tokenize_gen = lambda token_fn: lambda text: list(token_fn(text)) if isinstance(text, (str, unicode)) else []
 
 
-def ngram(text, n , filter_list=[]):
+# the NgramFilters of the last NGRAM_FILTER_CACHE_SIZE filter_lists, keyed by id(filter_list).
+# an entry keeps its filter_list alive, so its id is not reused while it is cached
+NGRAM_FILTER_CACHE_SIZE = 64
+
+_ngram_filters = OrderedDict()
+_ngram_filters_lock = threading.Lock()
+
+
+def as_ngram_filter(filter_list):
+    """
+    the NgramFilter of filter_list, built once per filter_list object (not per call),
+    a filter_list changed in place is not seen: pass a new list or build a NgramFilter once and pass it instead
+    """
+
+    if isinstance(filter_list, NgramFilter):
+        return filter_list
+
+    filter_key = id(filter_list)
+
+    with _ngram_filters_lock:
+        cached = _ngram_filters.get(filter_key)
+
+        if cached is not None and cached[0] is filter_list:
+            _ngram_filters.move_to_end(filter_key)
+            return cached[1]
+
+    ngram_filter = NgramFilter(filter_list)
+
+    with _ngram_filters_lock:
+        _ngram_filters[filter_key] = (filter_list, ngram_filter)
+
+        while len(_ngram_filters) > NGRAM_FILTER_CACHE_SIZE:
+            _ngram_filters.popitem(last=False)
+
+    return ngram_filter
+
+
+def sliced_ngram(text, n, filter_list=[]):
     if isinstance(n, int):
         for k in range(len(text) - n + 1):
             if not(text[k:k + n] in filter_list):
@@ -19,19 +60,24 @@ def ngram(text, n , filter_list=[]):
 
     if isinstance(n, list):
         for n_i in n:
-            for xx in ngram(text=text, n=n_i, filter_list=filter_list):
+            for xx in sliced_ngram(text=text, n=n_i, filter_list=filter_list):
                 yield xx
 
 
-def ngram_no_filter(text, n):
-    if isinstance(n, int):
-        for k in range(len(text) - n + 1):
-            yield text[k:k + n]
+def ngram(text, n , filter_list=[]):
+    """
+    the n-grams of text for n (an int or a list) which are not in filter_list (a list or a NgramFilter),
+    str texts go through the vectorized engine of PlaYnlp.ngrams, other sequences are sliced one by one
+    """
 
-    if isinstance(n, list):
-        for n_i in n:
-            for xx in ngram(text=text, n=n_i):
-                yield xx
+    if isinstance(text, str) and not isinstance(filter_list, str):
+        return iter(text_ngrams(text, n, ngram_filter=as_ngram_filter(filter_list)))
+
+    return sliced_ngram(text, n, filter_list=filter_list)
+
+
+def ngram_no_filter(text, n):
+    return ngram(text, n)
 
 
 def skipped_ngram(text, n, sep=" ", skip_pattern=r"[A-Za-z0-9]+", filter_list=[]):
@@ -0,0 +1,503 @@
+# -*- coding: utf-8 -*-
+'''
+a long-lived jieba tokenizer pool: the workers load jieba's dictionary, the user dictionaries and the stopwords once,
+short-lived jobs send batches of texts over a unix socket instead of paying jieba's startup in every process.
+
+start the service (on DEFAULT_SOCKET_PATH, in a directory private to the user):
+python -m PlaYnlp.tokenizer_service --n-workers 4 --user-dict my_dict.txt
+
+then in any process of the same user (without importing jieba):
+with TokenizerClient() as client:
+    token_lists = client.cut(texts)
+    client.last_batch_stats  # latency of the batch
+
+the requests are pickles, so the socket is only open to its owner (mode 0600) and every connection has to
+authenticate with the service's authkey, a random one is written to socket_path + ".key" (mode 0600) by default
+'''
+
+import argparse
+from collections import deque
+import multiprocessing
+from multiprocessing.connection import Client, Listener
+import os
+import pickle
+import queue
+import socket
+import stat
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+
+# a socket in a directory only the user can enter
+DEFAULT_SOCKET_PATH = os.path.join(tempfile.gettempdir(), "playnlp-%d" % os.getuid(), "jieba.sock")
+
+# the stopword.txt shipped in the package
+DEFAULT_STOPWORD_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stopword.txt")
+
+AUTHKEY_BYTES = 32
+
+# the seconds to wait for a worker to be initialized
+STARTUP_TIMEOUT = 300.0
+
+# the number of the last batches whose latencies are kept for the "stats" request
+LATENCY_WINDOW = 1000
+
+
+def load_stopwords(stopword_file, encoding="utf-8"):
+    """
+    the set of the stripped non-empty lines of stopword_file
+    """
+
+    with open(stopword_file, "rb") as rfile:
+        return frozenset(line.decode(encoding).strip() for line in rfile if line.strip())
+
+
+def authkey_path(socket_path):
+    return socket_path + ".key"
+
+
+def read_authkey(socket_path):
+    """
+    the authkey written by the service at socket_path, None if there is none
+    """
+
+    try:
+        with open(authkey_path(socket_path), "rb") as rfile:
+            return rfile.read()
+    except (IOError, OSError):
+        return None
+
+
+def _write_authkey(socket_path, authkey):
+    key_path = authkey_path(socket_path)
+
+    # a key file left by an earlier service is replaced, a file of another user can not be removed from a sticky dir
+    if os.path.lexists(key_path):
+        os.remove(key_path)
+
+    key_fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_NOFOLLOW", 0), 0o600)
+
+    with os.fdopen(key_fd, "wb") as wfile:
+        wfile.write(authkey)
+
+
+def prepare_socket_path(socket_path):
+    """
+    create the private directory of the default socket path (mode 0700, owned by the user),
+    remove a stale socket left at socket_path; anything else at socket_path (a file, a live service) raises IOError
+    """
+
+    socket_dir = os.path.dirname(os.path.abspath(socket_path))
+
+    if socket_path == DEFAULT_SOCKET_PATH:
+        if not os.path.isdir(socket_dir):
+            os.makedirs(socket_dir, 0o700)
+
+        dir_stat = os.lstat(socket_dir)
+
+        if dir_stat.st_uid != os.getuid() or stat.S_IMODE(dir_stat.st_mode) & 0o077:
+            raise IOError("%s is not a private directory of this user" % socket_dir)
+
+    if not os.path.lexists(socket_path):
+        return
+
+    if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+        raise IOError("%s exists and is not a socket" % socket_path)
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        probe.connect(socket_path)
+    except (IOError, OSError):
+        # nobody listens, a socket left by a service which did not close
+        os.remove(socket_path)
+        return
+    finally:
+        probe.close()
+
+    raise IOError("a service is already listening on %s" % socket_path)
+
+
+def _remove_socket(socket_path):
+    if os.path.lexists(socket_path) and stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+        os.remove(socket_path)
+
+
+# the state of a worker process, set once by init_jieba_worker
+_worker_state = {}
+
+
+def init_jieba_worker(user_dicts=(), stopword_file=None, cut_all=False, HMM=True, ready_queue=None):
+    """
+    load jieba's dictionary (and trie), the user dictionaries and the stopwords once in this process,
+    then put the process id into ready_queue (if any), or the exception which stopped the initialization
+    """
+
+    try:
+        import jieba
+
+        jieba.initialize()
+
+        for user_dict in user_dicts:
+            jieba.load_userdict(user_dict)
+
+        _worker_state["cut"] = jieba.cut
+        _worker_state["cut_kwargs"] = {"cut_all":cut_all, "HMM":HMM}
+        _worker_state["stopwords"] = load_stopwords(stopword_file) if stopword_file is not None else frozenset()
+
+    except Exception as e:
+        if ready_queue is not None:
+            # the exception (or its repr when it does not pickle) is raised again by the service
+            try:
+                pickle.dumps(e)
+            except Exception:
+                e = RuntimeError(repr(e))
+
+            ready_queue.put(e)
+
+        raise
+
+    if ready_queue is not None:
+        ready_queue.put(os.getpid())
+
+
+def cut_texts(texts, drop_stopwords=True):
+    """
+    the token lists of texts by the worker's jieba (blank tokens and, with drop_stopwords, the stopwords dropped),
+    the texts which are not str give empty lists (as tokenize_gen)
+    """
+
+    cut, cut_kwargs = _worker_state["cut"], _worker_state["cut_kwargs"]
+    stopwords = _worker_state["stopwords"] if drop_stopwords else frozenset()
+
+    return [[token for token in cut(text, **cut_kwargs) if token.strip() and not token in stopwords]
+            if isinstance(text, str) else [] for text in texts]
+
+
+def _cut_shard(args):
+    return cut_texts(*args)
+
+
+class TokenizerService(object):
+    """
+    a server of batched tokenization requests on the unix socket socket_path over a pool of n_workers processes,
+    each one initialized once by init_jieba_worker(user_dicts, stopword_file, cut_all, HMM).
+
+    a request is {"op":"cut", "texts":[...], "drop_stopwords":bool} (answered by {"token_lists":[...], "stats":{...}}),
+    {"op":"stats"} or {"op":"shutdown"}; the connections are served by threads, a batch is split into shard_size
+    texts per task, so the batches of several clients share the workers.
+
+    the socket has mode 0600 and the clients have to know authkey, a random authkey (the default) is written to
+    authkey_path(socket_path) with mode 0600 for the clients of the same user.
+    stopword_file=DEFAULT_STOPWORD_FILE is skipped when it is missing, another missing stopword_file raises IOError.
+    the exception of a worker which fails to initialize (e.g. a missing user dictionary) is raised here, a RuntimeError
+    when the workers are not ready after startup_timeout seconds
+    """
+
+    def __init__(self, socket_path=DEFAULT_SOCKET_PATH, n_workers=None, user_dicts=(), stopword_file=DEFAULT_STOPWORD_FILE,
+                 cut_all=False, HMM=True, shard_size=256, authkey=None, start_method=None,
+                 startup_timeout=STARTUP_TIMEOUT):
+
+        self.socket_path = socket_path
+        self.n_workers = multiprocessing.cpu_count() if n_workers is None else n_workers
+        self.shard_size = shard_size
+
+        if stopword_file is not None and not os.path.exists(stopword_file):
+            if stopword_file != DEFAULT_STOPWORD_FILE:
+                raise IOError("stopword file %s does not exist" % stopword_file)
+
+            stopword_file = None
+
+        prepare_socket_path(socket_path)
+
+        start = time.time()
+
+        context = multiprocessing.get_context(start_method)
+        ready_queue = context.Queue()
+
+        self._pool = context.Pool(processes=self.n_workers,
+                                  initializer=init_jieba_worker,
+                                  initargs=(list(user_dicts), stopword_file, cut_all, HMM, ready_queue))
+
+        # the service is ready when all the workers are warm, a failing initializer would be retried forever by the pool
+        deadline = start + startup_timeout
+
+        try:
+            for _ in range(self.n_workers):
+                try:
+                    ready = ready_queue.get(timeout=max(0., deadline - time.time()))
+                except queue.Empty:
+                    raise RuntimeError("the tokenizer workers are not ready after %s seconds" % startup_timeout)
+
+                if isinstance(ready, BaseException):
+                    raise ready
+        except BaseException:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+            raise
+
+        self.startup_seconds = time.time() - start
+
+        self._authkey_file = None
+
+        if authkey is None:
+            authkey = os.urandom(AUTHKEY_BYTES)
+            _write_authkey(socket_path, authkey)
+            self._authkey_file = authkey_path(socket_path)
+
+        # the socket is created without any access for the group and the others
+        old_umask = os.umask(0o177)
+
+        try:
+            self._listener = Listener(address=socket_path, family="AF_UNIX", authkey=authkey)
+        finally:
+            os.umask(old_umask)
+
+        os.chmod(socket_path, 0o600)
+        self._closed = threading.Event()
+        self._close_lock = threading.Lock()
+
+        self._lock = threading.Lock()
+        self._n_batches, self._n_texts, self._n_tokens = 0, 0, 0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def close(self):
+        # a second close (e.g. after a "shutdown" request) waits until the first one is done
+        with self._close_lock:
+            if self._pool is None:
+                return
+
+            self._closed.set()
+
+            # wake up the accept of serve_forever, which closing the listener does not
+            try:
+                wake_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                wake_socket.connect(self.socket_path)
+                wake_socket.close()
+            except OSError:
+                pass
+
+            self._listener.close()
+
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+            _remove_socket(self.socket_path)
+
+            if self._authkey_file is not None and os.path.exists(self._authkey_file):
+                os.remove(self._authkey_file)
+
+
+    def cut(self, texts, drop_stopwords=True):
+        """
+        return (token_lists, stats) of a batch of texts, stats: n_texts, n_tokens and latency_seconds
+        """
+
+        start = time.time()
+
+        shards = [(texts[shard_start:shard_start + self.shard_size], drop_stopwords)
+                  for shard_start in range(0, len(texts), self.shard_size)]
+
+        token_lists = [tokens for shard_token_lists in self._pool.map(_cut_shard, shards, chunksize=1)
+                       for tokens in shard_token_lists]
+
+        stats = {"n_texts":len(texts),
+                 "n_tokens":sum(len(tokens) for tokens in token_lists),
+                 "latency_seconds":time.time() - start}
+
+        with self._lock:
+            self._n_batches = self._n_batches + 1
+            self._n_texts = self._n_texts + stats["n_texts"]
+            self._n_tokens = self._n_tokens + stats["n_tokens"]
+            self._latencies.append(stats["latency_seconds"])
+
+        return token_lists, stats
+
+
+    def stats(self):
+        """
+        n_workers, startup_seconds, the counts of the batches / texts / tokens served
+        and the mean / median / 99th percentile latency of the last LATENCY_WINDOW batches
+        """
+
+        with self._lock:
+            latencies = np.array(self._latencies)
+
+            stats = {"n_workers":self.n_workers,
+                     "startup_seconds":self.startup_seconds,
+                     "n_batches":self._n_batches,
+                     "n_texts":self._n_texts,
+                     "n_tokens":self._n_tokens}
+
+        for key, value in (("mean", np.mean), ("p50", np.median), ("p99", lambda xx:np.percentile(xx, 99))):
+            stats["latency_%s_seconds" % key] = float(value(latencies)) if len(latencies) > 0 else None
+
+        return stats
+
+
+    def _serve_connection(self, conn):
+        with conn:
+            while not self._closed.is_set():
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+
+                op = request.get("op", "cut")
+
+                if op == "cut":
+                    token_lists, stats = self.cut(request["texts"], drop_stopwords=request.get("drop_stopwords", True))
+                    conn.send({"token_lists":token_lists, "stats":stats})
+
+                elif op == "stats":
+                    conn.send(self.stats())
+
+                elif op == "shutdown":
+                    conn.send({"shutdown":True})
+                    threading.Thread(target=self.close).start()
+                    return
+
+                else:
+                    conn.send({"error":"unknown op %r" % (op,)})
+
+
+    def serve_forever(self):
+        """
+        accept connections (one thread each) until close() or a "shutdown" request
+        """
+
+        while not self._closed.is_set():
+            try:
+                conn = self._listener.accept()
+            except (OSError, EOFError, multiprocessing.AuthenticationError):
+                # a failed handshake (or close()'s wake up) is dropped
+                continue
+
+            if self._closed.is_set():
+                conn.close()
+                break
+
+            threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+
+
+class TokenizerClient(object):
+    """
+    a connection to a TokenizerService: cut(texts) gives the token lists of a batch,
+    last_batch_stats the service's stats of the batch plus round_trip_seconds.
+    called on one text it returns its tokens (usable as a tokenizer of vectorize_text), batches are faster.
+    authkey=None reads the key the service wrote next to socket_path
+    """
+
+    def __init__(self, socket_path=DEFAULT_SOCKET_PATH, authkey=None):
+        self.socket_path = socket_path
+        self._conn = Client(address=socket_path, family="AF_UNIX",
+                            authkey=read_authkey(socket_path) if authkey is None else authkey)
+
+        self.last_batch_stats = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+    def _request(self, request):
+        self._conn.send(request)
+        response = self._conn.recv()
+
+        assert not "error" in response, response.get("error")
+
+        return response
+
+
+    def cut(self, texts, drop_stopwords=True):
+        start = time.time()
+
+        response = self._request({"op":"cut", "texts":list(texts), "drop_stopwords":drop_stopwords})
+
+        self.last_batch_stats = dict(response["stats"], round_trip_seconds=time.time() - start)
+
+        return response["token_lists"]
+
+
+    def __call__(self, text):
+        return self.cut([text])[0]
+
+
+    def stats(self):
+        return self._request({"op":"stats"})
+
+
+    def shutdown(self):
+        self._request({"op":"shutdown"})
+        self.close()
+
+
+def wait_for_service(socket_path=DEFAULT_SOCKET_PATH, timeout=60.0, authkey=None):
+    """
+    a TokenizerClient connected to the service at socket_path, retried until timeout seconds
+    """
+
+    deadline = time.time() + timeout
+
+    while True:
+        try:
+            return TokenizerClient(socket_path, authkey=authkey)
+        except (OSError, EOFError):
+            if time.time() > deadline:
+                raise
+
+            time.sleep(0.05)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="serve batched jieba tokenization on a unix socket")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET_PATH)
+    parser.add_argument("--n-workers", type=int, default=None)
+    parser.add_argument("--user-dict", action="append", default=[])
+    parser.add_argument("--stopwords", default=DEFAULT_STOPWORD_FILE)
+    parser.add_argument("--cut-all", action="store_true")
+    parser.add_argument("--no-hmm", action="store_true")
+    parser.add_argument("--shard-size", type=int, default=256)
+    parser.add_argument("--startup-timeout", type=float, default=STARTUP_TIMEOUT)
+    args = parser.parse_args(argv)
+
+    service = TokenizerService(socket_path=args.socket, n_workers=args.n_workers, user_dicts=args.user_dict,
+                               stopword_file=args.stopwords, cut_all=args.cut_all, HMM=not args.no_hmm,
+                               shard_size=args.shard_size, startup_timeout=args.startup_timeout)
+
+    print("serving on %s, %d workers ready in %.2f s" % (args.socket, service.n_workers, service.startup_seconds))
+
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,26 @@
 # -*- coding: utf-8 -*-
 
-from .sparse import SparseDataFrame
+import numpy as np
+
+from .dataio import FILE_TYPES, PATH_TYPES
+from .sparse import SparseDataFrame, SparseDataFrameBuilder
+from .inverted_index import InvertedIndex
+from .parallel_counts import feature_names_of, parallel_count_texts
+from .term_counts import (TermColumns, HashedColumns, count_texts, count_text_chunks, reservoir_sample,
+                          sample_vocabulary)
 from sklearn.feature_extraction.text import CountVectorizer
 
+
+# "sklearn": vect_gen (CountVectorizer) fit_transform, "native": PlaYnlp.term_counts.count_texts
+VECTORIZE_BACKENDS = ("sklearn", "native")
+
+# the vect_gen_init_kwargs understood by the native backend
+NATIVE_BACKEND_KWARGS = ("tokenizer", "lowercase", "token_pattern", "dtype")
+
+# vectorize_text_stream's vocabulary: "sample" (the terms of a reservoir sample of the corpus), "hashing" (the hashing
+# trick, n_features columns) or the terms themselves
+STREAM_VOCABULARIES = ("sample", "hashing")
+
 class SparseDocumentTermMatrix(SparseDataFrame):
     _key_mapper = {"sdtm":"smatrix",
                    "term_idx":"col_idx",
@@ -17,8 +35,14 @@ class SparseDocumentTermMatrix(SparseDataFrame):
                                           col_idx = self._doc_idx,
                                           summarizer = self["summarizer"] if self._has_default_summarizer else None)#,
 #                                          vectorizer = self["vectorizer"] if "vectorizer" in self.keys() else None)
+        tr_sdf.inherit_label_index("col", self, "row")
+        tr_sdf.inherit_label_index("row", self, "col")
         return tr_sdf
     
+    @property
+    def inverted_index(self):
+        return InvertedIndex.of(self)
+    
     
 class SparseTermDocumentMatrix(SparseDataFrame):
     _key_mapper = {"stdm":"smatrix",
@@ -35,6 +59,8 @@ class SparseTermDocumentMatrix(SparseDataFrame):
                                           row_idx = self._doc_idx,
                                           summarizer = self["summarizer"] if self._has_default_summarizer else None)#,
 #                                          vectorizer = self["vectorizer"] if "vectorizer" in self.keys() else None)
+        tr_sdf.inherit_label_index("col", self, "row")
+        tr_sdf.inherit_label_index("row", self, "col")
         return tr_sdf
     
 
@@ -47,14 +73,26 @@ def vectorize_text(df, text_col=None, idx_col=None,
                    vect_gen=CountVectorizer, 
                    vect_gen_init_kwargs={},
                    summarizer=None,
-                   dump_out_pickle=None):    
+                   dump_out_pickle=None,
+                   backend="sklearn",
+                   chunk_size=10000,
+                   n_jobs=1):    
     
     """ 
     demo vect_gen_init_kwargs:
     vect_gen_init_kwargs = {"tokenizer":tokenize,"lowercase":False} 
+
+    backend="native" counts the tokens straight into the csr buffers (PlaYnlp.term_counts.count_texts, chunk_size
+    texts at a time) instead of vect_gen, vect_gen_init_kwargs are then limited to NATIVE_BACKEND_KWARGS
+    and a NgramTokenizer as tokenizer is counted by its integer n-gram ids
+
+    n_jobs != 1 (None means all cores) tokenizes and counts shards of chunk_size texts over a process pool
+    (PlaYnlp.parallel_counts.parallel_count_texts), the result is the same as the serial one.
+    the tokenizer is inherited by the workers with the fork start method, else it has to be picklable
     """
     
     assert text_col in df.columns
+    assert backend in VECTORIZE_BACKENDS
     
     if len(cond_query.keys()):
         
@@ -81,27 +119,107 @@ def vectorize_text(df, text_col=None, idx_col=None,
         q_df = q_df.ix[idx_query]
 
     
-    vectorizer = vect_gen(**vect_gen_init_kwargs)
-    
-    vectorized_sdtm = vectorizer.fit_transform(q_df[text_col])
+    if backend == "native":
+        assert all(key in NATIVE_BACKEND_KWARGS for key in vect_gen_init_kwargs)
+
+    if n_jobs != 1:
+        vectorized_sdtm, feature_names = parallel_count_texts(q_df[text_col].tolist(), n_jobs=n_jobs, chunk_size=chunk_size,
+                                                              vect_gen=vect_gen if backend == "sklearn" else None,
+                                                              vect_gen_init_kwargs=vect_gen_init_kwargs)
+
+    elif backend == "native":
+        vectorized_sdtm, feature_names = count_texts(q_df[text_col].values, chunk_size=chunk_size, **vect_gen_init_kwargs)
+
+    else:
+        vectorizer = vect_gen(**vect_gen_init_kwargs)
+
+        vectorized_sdtm = vectorizer.fit_transform(q_df[text_col])
+        feature_names = feature_names_of(vectorizer)
     
     if idx_col != None:
         assert idx_col in df.columns
         
         return_sdtm = SparseDocumentTermMatrix(smatrix = vectorized_sdtm, 
-                                               col_idx=vectorizer.get_feature_names(), 
-                                               row_idx=q_df[idx_col].values,
+                                               col_idx=feature_names, 
+                                               row_idx=q_df[idx_col].tolist(),
                                                summarizer=summarizer)#,vectorizer=vectorizer)
     else:
         return_sdtm = SparseDocumentTermMatrix(smatrix = vectorized_sdtm, 
-                                               col_idx=vectorizer.get_feature_names(),
+                                               col_idx=feature_names,
                                                summarizer=summarizer)#,vectorizer=vectorizer)
     
-    if isinstance(dump_out_pickle, (file, str, unicode)):
+    if isinstance(dump_out_pickle, FILE_TYPES + PATH_TYPES):
         return_sdtm.to_pickle_file(output_file=dump_out_pickle)
     
     
     return return_sdtm
+
+
+def vectorize_text_stream(chunks, vocabulary="sample",
+                          vect_gen_init_kwargs={},
+                          sample_size=100000,
+                          min_df=1,
+                          max_features=None,
+                          n_features=2 ** 20,
+                          random_state=0,
+                          summarizer=None,
+                          builder=None):
+    """
+    vectorize the texts of chunks, an iterable of chunks of (id, text) pairs (see PlaYnlp.dataio.iter_jsonl_chunks
+    and iter_csv_chunks), one chunk at a time: each chunk's counts are appended as a row block to builder
+    (a SparseDataFrameBuilder, a new one by default) and its snapshot is returned,
+    so besides the sdtm only one chunk and the vocabulary are held in memory.
+
+    vocabulary:
+    "sample": the terms of a reservoir sample of sample_size texts found in at least min_df of them (at most
+    max_features), the tokens outside it are dropped; the corpus is read twice, so chunks has to be a callable
+    returning the chunks or a re-iterable (not an iterator)
+    "hashing": n_features columns (labeled by their numbers), a token's column is its stable hash, one pass
+    a sequence of terms (a list, an ndarray such as another sdtm's _col_idx): a fixed vocabulary, one pass
+
+    vect_gen_init_kwargs are limited to NATIVE_BACKEND_KWARGS, as vectorize_text(backend="native")
+    """
+
+    assert all(key in NATIVE_BACKEND_KWARGS for key in vect_gen_init_kwargs)
+
+    if callable(chunks):
+        iter_chunks = chunks
+    else:
+        iter_chunks = lambda :iter(chunks)
+
+    tokenize_kwargs = dict((key, vect_gen_init_kwargs[key]) for key in ("tokenizer", "lowercase", "token_pattern")
+                           if key in vect_gen_init_kwargs)
+    dtype = vect_gen_init_kwargs.get("dtype", np.int64)
+
+    if not isinstance(vocabulary, str):
+        # a sequence of terms (e.g. the _col_idx of another sdtm) is never compared with the names below
+        columns = TermColumns(vocabulary)
+
+    elif vocabulary == "sample":
+        assert callable(chunks) or iter(chunks) is not chunks, "the sampled vocabulary needs two passes over chunks"
+
+        sample = reservoir_sample((text for chunk in iter_chunks() for _, text in chunk), sample_size,
+                                  random_state=random_state)
+        columns = TermColumns(sample_vocabulary(sample, min_df=min_df, max_features=max_features, **tokenize_kwargs))
+
+        del sample
+
+    else:
+        assert vocabulary in STREAM_VOCABULARIES
+        columns = HashedColumns(n_features)
+
+    if builder is None:
+        builder = SparseDataFrameBuilder(col_idx=columns.terms, summarizer=summarizer,
+                                         sdf_class=SparseDocumentTermMatrix, dtype=dtype)
+        col_idx = None
+    else:
+        # the blocks' columns are mapped to the builder's own columns
+        col_idx = columns.terms
+
+    for ids, csr in count_text_chunks(iter_chunks(), columns, dtype=dtype, **tokenize_kwargs):
+        builder.append_rows(csr, row_idx=ids, col_idx=col_idx)
+
+    return builder.snapshot()
                 
 
 
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+'''
+benchmark the compressed row block store against the block size and codec:
+compression ratio (raw csr bytes / file bytes), full scan throughput (raw MB/s)
+and the latency of point reads of a few random labels (select_by_idx, cold block cache)
+
+usage: python benchmarks/bench_block_store.py [n_docs] [n_terms]
+'''
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from scipy import sparse
+
+from PlaYnlp.sparse import SparseDataFrame
+from PlaYnlp.block_store import write_row_block_store, RowBlockStore
+
+
+def zipf_counts_sdf(n_docs, n_terms=100000, terms_per_doc=50, seed=0):
+    random_state = np.random.RandomState(seed)
+    nnz = n_docs * terms_per_doc
+
+    term_probs = 1.0 / np.arange(1, n_terms + 1)
+    term_probs = term_probs / term_probs.sum()
+
+    # the repeated (doc, term) pairs are summed into counts
+    smatrix = sparse.coo_matrix((np.ones(nnz), (np.repeat(np.arange(n_docs), terms_per_doc),
+                                                random_state.choice(n_terms, nnz, p=term_probs))),
+                                shape=(n_docs, n_terms)).tocsr()
+
+    return SparseDataFrame(smatrix, row_idx=np.array(["doc%08d" % ptr for ptr in range(n_docs)]))
+
+
+def run(n_docs=200000, n_terms=100000, block_sizes=(64, 256, 1024, 4096, 16384), codecs=("zlib", "lzma"),
+        n_point_reads=50, labels_per_read=5):
+
+    sdf = zipf_counts_sdf(n_docs, n_terms=n_terms)
+    random_state = np.random.RandomState(0)
+    point_reads = [sdf._row_idx[random_state.choice(n_docs, labels_per_read)] for _ in range(n_point_reads)]
+
+    store_file = os.path.join(tempfile.mkdtemp(), "store.bin")
+
+    print("%6s %8s %8s %10s %10s %12s %14s %12s" % ("codec", "block", "n_blocks", "ratio", "write (s)",
+                                                   "scan (MB/s)", "point (ms)", "blocks/read"))
+
+    for codec in codecs:
+        for block_size in block_sizes:
+            start = time.time()
+            store_stats = write_row_block_store(sdf, store_file, block_size=block_size, codec=codec)
+            write_time = time.time() - start
+
+            with RowBlockStore(store_file, cache_size=0) as store:
+                start = time.time()
+                scanned = store.to_sdf()
+                scan_time = time.time() - start
+
+                assert (scanned._smatrix != sdf._smatrix).nnz == 0
+
+                store.n_decoded_blocks = 0
+                start = time.time()
+
+                for labels in point_reads:
+                    store.select_by_idx(labels)
+
+                point_time = (time.time() - start) / n_point_reads
+                blocks_per_read = store.n_decoded_blocks / float(n_point_reads)
+
+            print("%6s %8d %8d %10.2f %10.2f %12.1f %14.3f %12.1f" % (codec, block_size, store_stats["n_blocks"],
+                                                                     store_stats["compression_ratio"], write_time,
+                                                                     store_stats["raw_bytes"] / scan_time / 2 ** 20,
+                                                                     point_time * 1000, blocks_per_read))
+
+    os.remove(store_file)
+
+
+if __name__ == '__main__':
+    run(*[int(xx) for xx in sys.argv[1:3]])
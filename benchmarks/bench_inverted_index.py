@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+'''
+benchmark the latency of selective top-k neighborhood queries against the corpus size:
+scoring every doc (csr product) vs scoring only the union of the active terms' posting lists (InvertedIndex)
+
+usage: python benchmarks/bench_inverted_index.py [max_n_docs] [n_terms]
+'''
+
+import sys
+import time
+
+import numpy as np
+from scipy import sparse
+
+from PlaYnlp.inverted_index import InvertedIndex
+from PlaYnlp.stats import top_k_positions
+from PlaYnlp.analysis.heuristics.text_clustering.weighted_features_methods import sparse_scores_top_k
+
+
+def zipf_sdtm_smatrix(n_docs, n_terms=100000, terms_per_doc=50, seed=0):
+    random_state = np.random.RandomState(seed)
+    nnz = n_docs * terms_per_doc
+
+    term_probs = 1.0 / np.arange(1, n_terms + 1)
+    term_probs = term_probs / term_probs.sum()
+
+    return sparse.coo_matrix((np.ones(nnz), (np.repeat(np.arange(n_docs), terms_per_doc),
+                                             random_state.choice(n_terms, nnz, p=term_probs))),
+                             shape=(n_docs, n_terms)).tocsr()
+
+
+def selective_queries(n_terms, n_queries=50, n_active=10, min_rank=1000, seed=0):
+    # queries of rare (tail) terms, as the active features of a typical seed group after weighting
+    random_state = np.random.RandomState(seed)
+    return [(np.sort(random_state.choice(np.arange(min_rank, n_terms), n_active, replace=False)),
+             random_state.rand(n_active)) for _ in range(n_queries)]
+
+
+def dense_top_k(csr, term_ptrs, weights, k):
+    all_weights = np.zeros(csr.shape[1])
+    all_weights[term_ptrs] = weights
+    return top_k_positions(csr.dot(all_weights), k=k)
+
+
+def index_top_k(inverted_index, term_ptrs, weights, k):
+    doc_ptrs, scores = inverted_index.score(term_ptrs, weights)
+    return sparse_scores_top_k(scores, doc_ptrs, inverted_index.n_docs, k=k)
+
+
+def run(max_n_docs=400000, n_terms=100000, k=20):
+    queries = selective_queries(n_terms)
+
+    print("%10s %12s %12s %14s %14s %8s" % ("n_docs", "nnz", "postings", "dense (ms)", "index (ms)", "speedup"))
+
+    n_docs = max_n_docs // 16
+
+    while n_docs <= max_n_docs:
+        csr = zipf_sdtm_smatrix(n_docs, n_terms=n_terms)
+        inverted_index = InvertedIndex(csr.tocsc())
+
+        n_postings = np.mean([inverted_index.posting_lengths[term_ptrs].sum() for term_ptrs, _ in queries])
+
+        start = time.time()
+        dense_results = [dense_top_k(csr, term_ptrs, weights, k) for term_ptrs, weights in queries]
+        dense_time = (time.time() - start) / len(queries)
+
+        start = time.time()
+        index_results = [index_top_k(inverted_index, term_ptrs, weights, k) for term_ptrs, weights in queries]
+        index_time = (time.time() - start) / len(queries)
+
+        assert all(np.array_equal(xx, yy) for xx, yy in zip(dense_results, index_results))
+
+        print("%10d %12d %12.1f %14.3f %14.3f %7.1fx" % (n_docs, csr.nnz, n_postings,
+                                                          dense_time * 1000, index_time * 1000, dense_time / index_time))
+
+        n_docs = n_docs * 2
+
+
+if __name__ == '__main__':
+    run(*[int(xx) for xx in sys.argv[1:3]])
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+'''
+benchmark SparseDataFrame.merge_sdf (PlaYnlp.join) against the backup implementation
+
+usage: python benchmarks/bench_merge_sdf.py [n_rows] [n_cols]
+'''
+
+import sys
+import time
+
+import numpy as np
+from scipy import sparse
+
+from PlaYnlp.sparse import SparseDataFrame
+from merge_sdf_backup import merge_sdf as backup_merge_sdf
+
+
+def random_sdf(n_rows, n_cols, row_labels, col_labels, density=0.001, seed=0):
+    random_state = np.random.RandomState(seed)
+    nnz = int(n_rows * n_cols * density)
+    smatrix = sparse.coo_matrix((np.ones(nnz), (random_state.randint(0, n_rows, nnz),
+                                                random_state.randint(0, n_cols, nnz))),
+                                shape=(n_rows, n_cols)).tocsr()
+
+    return SparseDataFrame(smatrix=smatrix,
+                           col_idx=np.array(col_labels),
+                           row_idx=np.array(row_labels))
+
+
+def gen_sdfs(n_rows=100000, n_cols=30000, overlap=0.1, seed=0):
+    random_state = np.random.RandomState(seed)
+
+    n_rows_b = n_rows // 10
+    n_shared = int(n_rows_b * overlap)
+
+    rows_a = np.array(["doc_%08d" % xx for xx in range(n_rows)])
+    rows_b = np.r_[random_state.choice(rows_a, n_shared, replace=False),
+                   np.array(["doc_%08d" % xx for xx in range(n_rows, n_rows + n_rows_b - n_shared)])]
+
+    all_cols = np.array(["term_%07d" % xx for xx in range(int(n_cols * 1.2))])
+    cols_a = random_state.choice(all_cols, n_cols, replace=False)
+    cols_b = random_state.choice(all_cols, n_cols // 2, replace=False)
+
+    return (random_sdf(n_rows, n_cols, rows_a, cols_a, seed=seed),
+            random_sdf(n_rows_b, n_cols // 2, rows_b, cols_b, seed=seed + 1))
+
+
+def timeit(fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        fn()
+        spent = time.time() - start
+        best = spent if best is None else min(best, spent)
+    return best
+
+
+def run(n_rows=100000, n_cols=30000):
+    sdf, other_sdf = gen_sdfs(n_rows=n_rows, n_cols=n_cols)
+
+    print("self: %s nnz=%d, sdf: %s nnz=%d" % (sdf._smatrix.shape, sdf._smatrix.nnz,
+                                               other_sdf._smatrix.shape, other_sdf._smatrix.nnz))
+    print("%-14s %12s %12s %8s" % ("method", "backup (s)", "join (s)", "speedup"))
+
+    for method in ("force_append", "keep", "replace", "sum", "mean"):
+        backup_time = timeit(lambda: backup_merge_sdf(sdf, other_sdf, method=method))
+        join_time = timeit(lambda: sdf.merge_sdf(other_sdf, method=method))
+
+        print("%-14s %12.4f %12.4f %7.1fx" % (method, backup_time, join_time, backup_time / join_time))
+
+
+if __name__ == '__main__':
+    run(*[int(xx) for xx in sys.argv[1:3]])
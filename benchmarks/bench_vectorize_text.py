@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+'''
+benchmark vectorize_text's backends on a synthetic chinese corpus (character n-grams):
+sklearn (CountVectorizer with a n-gram tokenizer), native with the same tokenizer as an opaque callable
+and native with a NgramTokenizer counted by its integer ids; the matrices and terms are checked to be equal
+
+usage: python benchmarks/bench_vectorize_text.py [n_docs] [chars_per_doc]
+'''
+
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from PlaYnlp.term_counts import NgramTokenizer
+from PlaYnlp.vectorizer import vectorize_text
+
+
+def synthetic_chinese_corpus(n_docs, chars_per_doc=200, n_chars=3000, seed=0):
+    random_state = np.random.RandomState(seed)
+
+    # zipf distributed characters of the CJK unified ideographs block, with some punctuation
+    char_probs = 1.0 / np.arange(1, n_chars + 1)
+    char_probs = char_probs / char_probs.sum()
+    chars = np.array([chr(0x4e00 + ptr) for ptr in range(n_chars - 2)] + [u"，", u"。"])
+
+    lengths = random_state.poisson(chars_per_doc, n_docs) + 1
+    doc_chars = chars[random_state.choice(n_chars, lengths.sum(), p=char_probs)]
+    doc_ends = np.cumsum(lengths)
+
+    return pd.DataFrame({"doc_id":["doc%08d" % ptr for ptr in range(n_docs)],
+                         "text":[u"".join(doc_chars[end - length:end]) for end, length in zip(doc_ends, lengths)]})
+
+
+def run(n_docs=20000, chars_per_doc=200, n=[2, 3], filter_list=(u"，", u"。")):
+    df = synthetic_chinese_corpus(n_docs, chars_per_doc=chars_per_doc)
+    ngram_tokenizer = NgramTokenizer(n, filter_list=filter_list)
+
+    cases = [("sklearn", "sklearn", {"tokenizer":ngram_tokenizer, "lowercase":False}),
+             ("native str", "native", {"tokenizer":lambda text:ngram_tokenizer(text), "lowercase":False}),
+             ("native ids", "native", {"tokenizer":ngram_tokenizer, "lowercase":False})]
+
+    print("%d docs, %d chars, n=%s" % (n_docs, df["text"].str.len().sum(), n))
+    print("%12s %10s %10s %12s" % ("backend", "time (s)", "docs/s", "nnz"))
+
+    sdtms = []
+
+    for name, backend, vect_gen_init_kwargs in cases:
+        start = time.time()
+        sdtm = vectorize_text(df, text_col="text", idx_col="doc_id", backend=backend,
+                              vect_gen_init_kwargs=vect_gen_init_kwargs)
+        run_time = time.time() - start
+
+        sdtms.append(sdtm)
+        print("%12s %10.2f %10.0f %12d" % (name, run_time, n_docs / run_time, sdtm._sdtm.nnz))
+
+    for sdtm in sdtms[1:]:
+        assert list(sdtm._term_idx) == list(sdtms[0]._term_idx)
+        assert (sdtm._sdtm != sdtms[0]._sdtm).nnz == 0
+
+
+if __name__ == '__main__':
+    run(*[int(xx) for xx in sys.argv[1:3]])
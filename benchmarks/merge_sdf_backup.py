@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+'''
+backup of SparseDataFrame.merge_sdf before it was rewritten on top of PlaYnlp.join
+(a frozen copy kept for benchmarks/bench_merge_sdf.py)
+'''
+
+import numpy as np
+from scipy import sparse
+
+from PlaYnlp.sparse import gen_ptrs_idx, ptrs_idx_projection, sort_by_idx
+
+
+def merge_sdf(self, sdf, method="replace"):
+    """
+    method in ("force_append","keep","replace","sum","mean")
+    
+    method == "force_append" means it will append all rows in sdf as new rows in self
+    method == "keep" means if self and sdf have same idx rows, it will keep the rows from self
+    method == "replace" means if self and sdf have same idx rows, it will replace with sdf's rows
+    method == "sum" means if self and sdf have same idx rows, it will replace the rows as sum of sdf and self
+    method == "mean" means if self and sdf have same idx rows, it will replace the rows as mean of sdf and self
+    """
+
+    assert method in ("force_append", "keep", "replace", "sum", "mean")
+
+
+    self_ext_cols = self.extend_zeros_cols(sdf)
+    sdf_ext_cols = sdf.extend_zeros_cols(self)
+
+    _union_idx = np.r_[self_ext_cols._col_idx, sdf_ext_cols._col_idx]
+    self_col_ptrs_idx = gen_ptrs_idx(self_ext_cols._col_idx, _union_idx.dtype)
+    sdf_col_ptrs_idx = gen_ptrs_idx(sdf_ext_cols._col_idx, _union_idx.dtype)
+
+    _union_idx = np.r_[self_ext_cols._row_idx, sdf_ext_cols._row_idx]
+    self_row_ptrs_idx = gen_ptrs_idx(self_ext_cols._row_idx, _union_idx.dtype)
+    sdf_row_ptrs_idx = gen_ptrs_idx(sdf_ext_cols._row_idx, _union_idx.dtype)
+
+
+    inter_col_idx = np.intersect1d(self_col_ptrs_idx["idx"], sdf_col_ptrs_idx["idx"])
+    inter_row_idx = np.intersect1d(self_row_ptrs_idx["idx"], sdf_row_ptrs_idx["idx"])
+
+
+    self_inter_col_ptrs_idx = sort_by_idx(ptrs_idx_projection(self_col_ptrs_idx, inter_col_idx))
+    sdf_inter_col_ptrs_idx = sort_by_idx(ptrs_idx_projection(sdf_col_ptrs_idx, inter_col_idx))
+
+    self_inter_row_ptrs_idx = sort_by_idx(ptrs_idx_projection(self_row_ptrs_idx, inter_row_idx))
+    sdf_inter_row_ptrs_idx = sort_by_idx(ptrs_idx_projection(sdf_row_ptrs_idx, inter_row_idx))
+
+
+    self_only_row_ptrs_idx = np.setdiff1d(self_row_ptrs_idx, self_inter_row_ptrs_idx)
+    sdf_only_row_ptrs_idx = np.setdiff1d(sdf_row_ptrs_idx, sdf_inter_row_ptrs_idx)
+
+
+    self_ext_cols_smatrix = self_ext_cols._smatrix[:, self_inter_col_ptrs_idx["ptr"]]
+    sdf_ext_cols_smatrix = sdf_ext_cols._smatrix[:, sdf_inter_col_ptrs_idx["ptr"]]
+
+    if method in ("keep", "replace", "sum", "mean"):
+        if method == "keep":
+#                print 'self_only_row_ptrs_idx["idx"] = ',self_only_row_ptrs_idx["idx"]
+#                print 'self_inter_row_ptrs_idx["idx"] = ',self_inter_row_ptrs_idx["idx"]
+#                print 'sdf_only_row_ptrs_idx["idx"] = ',sdf_only_row_ptrs_idx["idx"]
+
+            vstack_smatrix = [self_ext_cols_smatrix[self_only_row_ptrs_idx["ptr"], :]]
+            new_row_idx = self_only_row_ptrs_idx["idx"]
+
+
+            if self_inter_row_ptrs_idx["ptr"].size > 0:
+
+                vstack_smatrix.append(self_ext_cols_smatrix[self_inter_row_ptrs_idx["ptr"], :])
+
+                new_row_idx = np.r_[new_row_idx,
+                                    self_inter_row_ptrs_idx["idx"]]
+
+
+            if sdf_only_row_ptrs_idx["ptr"].size > 0:
+
+                vstack_smatrix.append(sdf_ext_cols_smatrix[sdf_only_row_ptrs_idx["ptr"], :])
+
+                new_row_idx = np.r_[new_row_idx,
+                                    sdf_only_row_ptrs_idx["idx"]]
+
+
+            new_smatrix = sparse.vstack(vstack_smatrix).tocsc()
+            new_col_idx = self_inter_col_ptrs_idx["idx"]
+
+
+        elif method == "replace":
+
+            vstack_smatrix = [self_ext_cols_smatrix[self_only_row_ptrs_idx["ptr"], :]]
+            new_row_idx = self_only_row_ptrs_idx["idx"]
+
+
+            if sdf_inter_row_ptrs_idx["ptr"].size > 0:
+
+                vstack_smatrix.append(sdf_ext_cols_smatrix[sdf_inter_row_ptrs_idx["ptr"], :])
+
+                new_row_idx = np.r_[new_row_idx,
+                                    sdf_inter_row_ptrs_idx["idx"]]
+
+
+            if sdf_only_row_ptrs_idx["ptr"].size > 0:
+
+                vstack_smatrix.append(sdf_ext_cols_smatrix[sdf_only_row_ptrs_idx["ptr"], :])
+
+                new_row_idx = np.r_[new_row_idx,
+                                    sdf_only_row_ptrs_idx["idx"]]
+
+
+            new_smatrix = sparse.vstack(vstack_smatrix).tocsc()
+            new_col_idx = self_inter_col_ptrs_idx["idx"]
+
+
+
+        elif method == "sum":
+
+            vstack_smatrix = [self_ext_cols_smatrix[self_only_row_ptrs_idx["ptr"], :]]
+            new_row_idx = self_only_row_ptrs_idx["idx"]
+
+
+            if sdf_inter_row_ptrs_idx["ptr"].size > 0:
+
+                vstack_smatrix.append(sdf_ext_cols_smatrix[sdf_inter_row_ptrs_idx["ptr"], :] + self_ext_cols_smatrix[self_inter_row_ptrs_idx["ptr"], :])
+
+                new_row_idx = np.r_[new_row_idx,
+                                    sdf_inter_row_ptrs_idx["idx"]]
+
+
+            if sdf_only_row_ptrs_idx["ptr"].size > 0:
+
+                vstack_smatrix.append(sdf_ext_cols_smatrix[sdf_only_row_ptrs_idx["ptr"], :])
+
+                new_row_idx = np.r_[new_row_idx,
+                                    sdf_only_row_ptrs_idx["idx"]]
+
+
+            new_smatrix = sparse.vstack(vstack_smatrix).tocsc()
+            new_col_idx = self_inter_col_ptrs_idx["idx"]
+
+
+
+        elif method == "mean":
+
+            vstack_smatrix = [self_ext_cols_smatrix[self_only_row_ptrs_idx["ptr"], :]]
+            new_row_idx = self_only_row_ptrs_idx["idx"]
+
+
+            if sdf_inter_row_ptrs_idx["ptr"].size > 0:
+
+                vstack_smatrix.append((sdf_ext_cols_smatrix[sdf_inter_row_ptrs_idx["ptr"], :] + self_ext_cols_smatrix[self_inter_row_ptrs_idx["ptr"], :]) / 2.0)
+
+                new_row_idx = np.r_[new_row_idx,
+                                    sdf_inter_row_ptrs_idx["idx"]]
+
+
+            if sdf_only_row_ptrs_idx["ptr"].size > 0:
+
+                vstack_smatrix.append(sdf_ext_cols_smatrix[sdf_only_row_ptrs_idx["ptr"], :])
+
+                new_row_idx = np.r_[new_row_idx,
+                                    sdf_only_row_ptrs_idx["idx"]]
+
+
+            new_smatrix = sparse.vstack(vstack_smatrix).tocsc()
+            new_col_idx = self_inter_col_ptrs_idx["idx"]
+
+
+    elif method == "force_append":
+
+        new_smatrix = sparse.vstack([self_ext_cols_smatrix,
+                                     sdf_ext_cols_smatrix]).tocsc()
+
+        new_col_idx = self_inter_col_ptrs_idx["idx"]
+        new_row_idx = np.r_[self_ext_cols._row_idx,
+                            sdf_ext_cols._row_idx]
+
+
+
+    return type(self)(smatrix=new_smatrix,
+                      col_idx=new_col_idx,
+                      row_idx=new_row_idx,
+                      summarizer=self["summarizer"] if self._has_default_summarizer else None)
+
+
+if __name__ == '__main__':
+    pass
@@ -12,6 +12,7 @@ setup(
     author='Chia-Chi Chang & Willy Kuo',
     author_email='c3h3.tw@gmail.com & waitingkuo0527@gmail.com',
     packages=find_packages(),
+    package_data={'PlaYnlp': ['stopword.txt']},
     install_requires=[
         'scikit-learn',
         'numpy',
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from scipy import sparse
+
+from PlaYnlp.sparse import SparseDataFrame, L1_norm_col_summarizer
+from PlaYnlp.analysis.heuristics.text_clustering import weighted_features_methods as wfm
+
+
+def random_sdtm(n_docs=400, n_terms=60, density=0.03, seed=0):
+    random_state = np.random.RandomState(seed)
+
+    smatrix = sparse.random(n_docs, n_terms, density=density, random_state=random_state, format="csr")
+    smatrix.data = np.ceil(smatrix.data * 5)
+
+    return SparseDataFrame(smatrix,
+                           col_idx=np.array(["t%03d" % ptr for ptr in range(n_terms)]),
+                           row_idx=np.array(["d%04d" % ptr for ptr in range(n_docs)]),
+                           summarizer=L1_norm_col_summarizer)
+
+
+def seed_groups(sdtm, n_groups=300, seed=0):
+    random_state = np.random.RandomState(seed)
+    n_docs = sdtm.shape[0]
+
+    # single docs (the docs without terms included) and small groups
+    groups = [[ptr] for ptr in random_state.choice(n_docs, n_groups, replace=False)]
+    groups += [sorted(random_state.choice(n_docs, 3, replace=False).tolist()) for _ in range(20)]
+
+    empty_docs = np.nonzero(np.diff(sdtm.smatrix_as("csr").indptr) == 0)[0]
+    assert len(empty_docs) > 0
+
+    return groups + [[ptr] for ptr in empty_docs[:5]]
+
+
+def test_batch_eps_matches_find_stable_eps_neighborhood():
+    for seed in range(3):
+        sdtm = random_sdtm(seed=seed)
+        groups = seed_groups(sdtm, seed=seed)
+
+        for eps in (0.02, 0.05, 0.1):
+            for query_cache in (None, wfm.NeighborhoodQueryCache()):
+                batch_groups, stats = wfm.batch_find_stable_eps_neighborhood(sdtm, wfm.groups_indicator(groups, sdtm.shape[0]),
+                                                                             eps=eps, max_group_size=40, batch_size=16,
+                                                                             return_stats=True, query_cache=query_cache)
+
+                for group, batch_group, n_iterations, termination in zip(groups, batch_groups, stats["n_iterations"], stats["terminations"]):
+                    group_ptrs, group_stats = wfm.find_stable_eps_neighborhood(sdtm, group, eps=eps, max_group_size=40,
+                                                                               return_stats=True)
+
+                    assert list(np.asarray(batch_group)) == list(np.asarray(group_ptrs))
+                    assert (n_iterations, termination) == (group_stats["n_iterations"], group_stats["termination"])
+
+
+def test_batch_topk_matches_neighborhood_find_stable_topk():
+    sdtm = random_sdtm(seed=3)
+    groups = seed_groups(sdtm, n_groups=150, seed=3)
+
+    for k in (5, 20):
+        batch_groups = wfm.batch_find_stable_topk_neighborhood(sdtm, wfm.groups_indicator(groups, sdtm.shape[0]),
+                                                               k=k, min_eps=0.05, batch_size=7)
+
+        for group, batch_group in zip(groups, batch_groups):
+            group_ptrs = wfm.WieghtedFeaturesNeighborhood(sdtm, group).find_stable_topk_neighborhood(k=k, min_eps=0.05)
+
+            assert list(np.asarray(batch_group)) == list(np.asarray(group_ptrs))
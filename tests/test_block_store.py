@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+from scipy import sparse
+
+from PlaYnlp.block_store import BLOCK_CODECS, RowBlockStore, write_row_block_store
+from PlaYnlp.sparse import SparseDataFrame, L1_norm_col_summarizer
+
+
+N_ROWS, N_COLS = 37, 300
+
+
+def make_sdf():
+    smatrix = sparse.random(N_ROWS, N_COLS, density=0.05, format="lil", random_state=0, dtype=np.float64)
+    # empty rows, a row with one entry and a row with every column
+    smatrix[[0, 5, 6, 36], :] = 0
+    smatrix[7, :] = 0
+    smatrix[7, 299] = 2.5
+    smatrix[11, :] = np.arange(1, N_COLS + 1)
+
+    return SparseDataFrame(smatrix.tocsr(), col_idx=["t%d" % col for col in range(N_COLS)],
+                           row_idx=["d%d" % row for row in range(N_ROWS)], summarizer=L1_norm_col_summarizer)
+
+
+@pytest.mark.parametrize("codec", sorted(BLOCK_CODECS))
+@pytest.mark.parametrize("block_size", [1, 4, N_ROWS, N_ROWS + 10])
+def test_row_block_store_round_trip(tmp_path, codec, block_size):
+    sdf = make_sdf()
+    dense = sdf._smatrix.toarray()
+    path = str(tmp_path / "rows.blk")
+
+    stats = write_row_block_store(sdf, path, block_size=block_size, codec=codec)
+    assert stats["n_blocks"] == -(-N_ROWS // block_size)
+
+    with RowBlockStore(path, cache_size=2) as store:
+        assert store.shape == sdf.shape and store.n_blocks == stats["n_blocks"]
+
+        whole = store.to_sdf()
+        assert (whole._smatrix.toarray() == dense).all()
+        assert list(whole._col_idx) == list(sdf._col_idx) and list(whole._row_idx) == list(sdf._row_idx)
+        assert whole["summarizer"] is L1_norm_col_summarizer
+
+        for row_ptrs in ([36, 0, 11, 7, 11], [-1, 5], [3], []):
+            selected = store.select_rows(row_ptrs)
+            expected_ptrs = [ptr % N_ROWS for ptr in row_ptrs]
+
+            assert selected.shape == (len(row_ptrs), N_COLS)
+            assert (selected._smatrix.toarray() == dense[expected_ptrs]).all()
+            assert list(selected._row_idx) == ["d%d" % ptr for ptr in expected_ptrs]
+
+        mask = np.arange(N_ROWS) % 3 == 0
+        assert (store.select_rows(mask)._smatrix.toarray() == dense[mask]).all()
+        assert (store.select_by_idx(["d11", "d2"])._smatrix.toarray() == dense[[11, 2]]).all()
+
+
+def test_row_block_store_reads_only_the_selected_blocks(tmp_path):
+    path = str(tmp_path / "rows.blk")
+    write_row_block_store(make_sdf(), path, block_size=4)
+
+    with RowBlockStore(path, cache_size=0) as store:
+        store.select_rows([8, 9, 30])
+        assert store.n_decoded_blocks == 2
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from scipy import sparse
+
+from PlaYnlp.sparse import SparseDataFrame, L1_norm_col_summarizer
+from PlaYnlp.analysis.heuristics.text_clustering.corpus_clustering import CorpusClustering
+
+
+def random_sdtm(n_docs=300, n_terms=50, density=0.05, seed=0):
+    random_state = np.random.RandomState(seed)
+
+    smatrix = sparse.random(n_docs, n_terms, density=density, random_state=random_state, format="csr")
+    smatrix.data = np.ceil(smatrix.data * 5)
+
+    return SparseDataFrame(smatrix,
+                           col_idx=np.array(["t%03d" % ptr for ptr in range(n_terms)]),
+                           row_idx=np.array(["d%04d" % ptr for ptr in range(n_docs)]),
+                           summarizer=L1_norm_col_summarizer)
+
+
+def test_deferred_seeds_only_yield_clusters_with_new_docs():
+    sdtm = random_sdtm()
+
+    for method in ("topk", "eps"):
+        for batch_size in (1, 8):
+            clustering = CorpusClustering(sdtm, method=method, k=10, eps=0.05, assigned_weight=0.5, batch_size=batch_size)
+
+            assigned = np.zeros(sdtm.shape[0], dtype=bool)
+            n_deferred_clusters = 0
+
+            for cluster in clustering.iter_clusters():
+                if assigned[cluster["seed_ptr"]]:
+                    # a deferred seed: its cluster has to assign docs
+                    n_deferred_clusters = n_deferred_clusters + 1
+                    assert len(cluster["new_ptrs"]) > 0
+
+                assert not assigned[cluster["new_ptrs"]].any()
+                assigned[cluster["new_ptrs"]] = True
+
+            # the in-between path is run: every doc is a seed once, the deferred ones after the others
+            assert n_deferred_clusters > 0
+            assert clustering.progress.n_seeds == sdtm.shape[0]
+            assert (assigned == (clustering.labels >= 0)).all()
+
+
+def test_assigned_weight_bounds():
+    sdtm = random_sdtm(seed=1)
+
+    skipped = CorpusClustering(sdtm, k=10, assigned_weight=0.0)
+    skipped.run()
+
+    ignored = CorpusClustering(sdtm, k=10, assigned_weight=1.0)
+    ignored.run()
+
+    # 0 never runs an assigned doc as a seed, 1 runs all docs and yields all their clusters
+    assert skipped.progress.n_seeds + skipped.progress.n_skipped_seeds >= sdtm.shape[0]
+    assert ignored.progress.n_clusters == ignored.progress.n_seeds == sdtm.shape[0]
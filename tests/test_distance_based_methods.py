@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+from scipy import sparse
+
+from PlaYnlp.sparse import SparseDataFrame, L1_norm_col_summarizer
+from PlaYnlp.analysis.heuristics.text_clustering import distance_based_methods as dbm
+
+
+def random_sdtm(n_docs=120, n_terms=30, density=0.1, seed=0):
+    random_state = np.random.RandomState(seed)
+
+    smatrix = sparse.random(n_docs, n_terms, density=density, random_state=random_state, format="csr")
+    smatrix.data = np.ceil(smatrix.data * 5) * np.where(random_state.rand(smatrix.nnz) < 0.2, -1, 1)
+
+    return SparseDataFrame(smatrix,
+                           col_idx=np.array(["t%03d" % ptr for ptr in range(n_terms)]),
+                           row_idx=np.array(["d%04d" % ptr for ptr in range(n_docs)]),
+                           summarizer=L1_norm_col_summarizer)
+
+
+def dense_distances(sdtm, group_ptrs, ws):
+    # the baseline: |x - seed| of the densified sdtm, weighted and summed over the terms
+    dense = sdtm._smatrix.toarray()
+    seed = dense[group_ptrs].reshape((-1, dense.shape[1])).mean(axis=0)
+
+    return (ws * np.abs(dense - seed)).sum(axis=1)
+
+
+GROUPS = [[3], [10, 11, 12], [-1, 0], np.arange(120) % 17 == 0, 7]
+
+
+def test_weighted_l1_distances_match_dense():
+    sdtm = random_sdtm()
+    ws = np.random.RandomState(1).rand(sdtm.shape[1])
+
+    distances = dbm.weighted_l1_distances(sdtm, dbm.group_centroids(sdtm, GROUPS), ws)
+
+    for group_ptrs, group_distances in zip(GROUPS, distances):
+        assert np.allclose(group_distances, dense_distances(sdtm, group_ptrs, ws))
+
+    # a (n_groups x n_terms) ws weights each group by its own row
+    ws_2d = np.random.RandomState(2).rand(len(GROUPS), sdtm.shape[1])
+    distances = dbm.weighted_l1_distances(sdtm, dbm.group_centroids(sdtm, GROUPS), ws_2d)
+
+    for group_ptrs, group_ws, group_distances in zip(GROUPS, ws_2d, distances):
+        assert np.allclose(group_distances, dense_distances(sdtm, group_ptrs, group_ws))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 64])
+def test_batch_weighted_features_knn_matches_dense(chunk_size):
+    sdtm = random_sdtm()
+    ws = np.random.RandomState(1).rand(sdtm.shape[1])
+
+    results = dbm.batch_weighted_features_knn(sdtm, GROUPS, ws, top_k=10, chunk_size=chunk_size)
+    assert len(results) == len(GROUPS)
+
+    for group_ptrs, result in zip(GROUPS, results):
+        ws_norm = dense_distances(sdtm, group_ptrs, ws)
+        ws_norm = ws_norm / ws_norm.max()
+
+        assert np.allclose(result["top_k_scores"], np.sort(ws_norm)[:10])
+        assert np.allclose(ws_norm[result["top_k_ptrs"]], result["top_k_scores"])
+        assert (result["top_k_idx"] == sdtm._row_idx[result["top_k_ptrs"]]).all()
+
+    single = dbm.weighted_features_knn(sdtm, [10, 11, 12], ws, top_k=10)
+    assert (single["top_k_ptrs"] == results[1]["top_k_ptrs"]).all()
+
+
+def test_group_centroids_of_a_row_mask():
+    sdtm = random_sdtm()
+    mask = np.zeros(sdtm.shape[0], dtype=bool)
+    mask[[5, 50, 99]] = True
+
+    centroids = dbm.group_centroids(sdtm, [mask, [5, 50, 99]])
+    assert np.allclose(centroids.toarray()[0], sdtm._smatrix.toarray()[[5, 50, 99]].mean(axis=0))
+    assert np.allclose(centroids.toarray()[0], centroids.toarray()[1])
+
+    with pytest.raises(AssertionError):
+        dbm.group_centroids(sdtm, [mask[:-1]])
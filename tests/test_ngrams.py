@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from PlaYnlp.ngrams import NgramFilter, text_codepoints, text_ngram_ids, text_ngrams
+
+
+def sliced_ngrams(text, ns, filter_list=()):
+    # the slicing-based ngram of PlaYnlp.tokenizer
+    return [text[k:k + n] for n in ns for k in range(len(text) - n + 1) if not text[k:k + n] in filter_list]
+
+
+SURROGATE_TEXT = b"ab\xffc\xfe d".decode("utf-8", "surrogateescape")
+
+
+@pytest.mark.parametrize("text", [u"今天天氣很好", u"a\0b\0", SURROGATE_TEXT, u"\ud800", u""])
+def test_text_ngrams_match_slicing(text):
+    assert len(text_codepoints(text)) == len(text)
+
+    for ns in ([1], [2], [1, 2, 3]):
+        assert text_ngrams(text, ns) == sliced_ngrams(text, ns)
+
+    filter_list = [u"b", SURROGATE_TEXT[2:4], u"天氣"]
+    assert text_ngrams(text, [1, 2], ngram_filter=NgramFilter(filter_list)) == sliced_ngrams(text, [1, 2], filter_list)
+
+
+def test_ngram_ids_of_lone_surrogates():
+    ids, starts, ns = text_ngram_ids(SURROGATE_TEXT, 2)
+
+    assert len(ids) == len(SURROGATE_TEXT) - 1
+    assert len(set(ids.tolist())) == len(set(sliced_ngrams(SURROGATE_TEXT, [2])))
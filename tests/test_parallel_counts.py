@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+from collections import Counter
+import re
+
+import numpy as np
+import pytest
+from scipy import sparse
+
+from PlaYnlp.parallel_counts import count_shard, is_jieba_tokenizer, merge_term_counts, parallel_count_texts
+
+
+class WordCounter(object):
+    """
+    a minimal vect_gen with CountVectorizer's behavior on texts without tokens (ValueError: empty vocabulary)
+    """
+
+    def __init__(self, lowercase=True):
+        self.lowercase = lowercase
+
+
+    def fit_transform(self, texts):
+        counts = [Counter(re.findall(r"(?u)\b\w\w+\b", text.lower() if self.lowercase else text)) for text in texts]
+        self.vocabulary = sorted(set(term for text_counts in counts for term in text_counts))
+
+        if len(self.vocabulary) == 0:
+            raise ValueError("empty vocabulary; perhaps the documents only contain stop words")
+
+        cols = dict((term, col) for col, term in enumerate(self.vocabulary))
+        rows = [(row, cols[term], count) for row, text_counts in enumerate(counts) for term, count in text_counts.items()]
+        row_ptrs, col_ptrs, data = zip(*rows)
+
+        return sparse.csr_matrix((data, (row_ptrs, col_ptrs)), shape=(len(texts), len(self.vocabulary)), dtype=np.int64)
+
+
+    def get_feature_names(self):
+        return self.vocabulary
+
+
+TEXTS = [u"", u"the cat sat", u"  ", u"a b c", u"", u"Dog and cat", u"", u"the dog"]
+
+
+@pytest.mark.parametrize("vect_gen", [WordCounter, None])
+def test_blank_shards_match_serial(vect_gen):
+    serial_csr, serial_terms = count_shard(TEXTS, vect_gen=vect_gen)
+
+    for n_jobs, chunk_size in ((2, 1), (3, 2), (2, 10000)):
+        csr, terms = parallel_count_texts(TEXTS, n_jobs=n_jobs, chunk_size=chunk_size, vect_gen=vect_gen)
+
+        assert list(terms) == list(serial_terms)
+        assert csr.shape == serial_csr.shape
+        assert (csr != serial_csr).nnz == 0
+
+
+def test_blank_shard_has_no_terms():
+    csr, terms = count_shard([u"", u" a "], vect_gen=WordCounter)
+
+    assert csr.shape == (2, 0) and len(terms) == 0
+
+    merged_csr, merged_terms = merge_term_counts([(csr, terms), count_shard([u"cat cat"], vect_gen=WordCounter)])
+
+    assert list(merged_terms) == [u"cat"]
+    assert merged_csr.toarray().tolist() == [[0], [0], [2]]
+
+
+def test_all_blank_raises_as_serial():
+    with pytest.raises(ValueError):
+        parallel_count_texts([u"", u"a"], n_jobs=2, chunk_size=1, vect_gen=WordCounter)
+
+
+def test_is_jieba_tokenizer():
+    from PlaYnlp.term_counts import NgramTokenizer
+
+    assert not is_jieba_tokenizer(None)
+    assert not is_jieba_tokenizer(str.split)
+    assert not is_jieba_tokenizer(NgramTokenizer(2))
+    assert not is_jieba_tokenizer(lambda text:re.findall(r"\w+", text))
+
+    def jieba_lcut(text):
+        import jieba
+        return jieba.lcut(text)
+
+    assert is_jieba_tokenizer(jieba_lcut)
+
+    jieba = pytest.importorskip("jieba")
+    wrap = lambda token_fn:lambda text:list(token_fn(text))
+
+    assert is_jieba_tokenizer(jieba.cut)
+    assert is_jieba_tokenizer(wrap(jieba.cut))
+    assert not is_jieba_tokenizer(wrap(str.split))
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import numpy as np
+import pytest
+from scipy import sparse
+
+from PlaYnlp.sparse import SparseDataFrame, L1_norm_col_summarizer
+from PlaYnlp.sdf_disk import SDF_DISK_HEADER, read_sdf_header
+
+
+def random_sdf(n_rows=40, n_cols=25, density=0.1, seed=0, **kwargs):
+    smatrix = sparse.random(n_rows, n_cols, density=density, format="csr", random_state=seed)
+    smatrix.data = np.round(smatrix.data * 10, 2)
+
+    return SparseDataFrame(smatrix, **kwargs)
+
+
+@pytest.mark.parametrize("mmap_mode", ["r", None])
+def test_to_disk_open_round_trip(tmp_path, mmap_mode):
+    sdf = random_sdf(col_idx=["t%d" % col for col in range(25)], row_idx=list(range(100, 140)),
+                     summarizer=L1_norm_col_summarizer)
+    path = str(tmp_path / "sdf")
+
+    assert sdf.to_disk(path)
+    opened = SparseDataFrame.open(path, mmap_mode=mmap_mode)
+
+    assert opened.shape == sdf.shape
+    assert (opened._smatrix != sdf._smatrix).nnz == 0
+    assert list(opened._col_idx) == list(sdf._col_idx)
+    assert list(opened._row_idx) == list(sdf._row_idx)
+    assert opened["summarizer"] is L1_norm_col_summarizer
+
+    # the buffers are read-only maps of the .npy files
+    assert opened._smatrix.data.flags.writeable == (mmap_mode is None)
+
+    # selections and summaries work on the mapped buffers
+    assert (opened.select_rows([-1, 3]).summary._data == sdf.select_rows([-1, 3]).summary._data).all()
+    assert (opened.find_row_ptrs([139, 100]) == [39, 0]).all()
+
+
+def test_to_disk_csc_and_object_labels(tmp_path):
+    sdf = random_sdf(row_idx=[("doc", row) for row in range(40)])
+    sdf["row_idx"] = np.empty(40, dtype=object)
+    sdf["row_idx"][:] = [("doc", row) for row in range(40)]
+    sdf["smatrix"] = sdf["smatrix"].tocsc()
+
+    path = str(tmp_path / "sdf")
+    sdf.to_disk(path)
+
+    header = read_sdf_header(path)
+    assert header["smatrix_format"] == "csc" and not header["arrays"]["row_idx"]["mmap"]
+
+    opened = SparseDataFrame.open(path)
+    assert opened._smatrix.format == "csc"
+    assert (opened._smatrix != sdf._smatrix).nnz == 0
+    assert list(opened._row_idx) == list(sdf._row_idx)
+
+
+def test_to_disk_overwrite(tmp_path):
+    path = str(tmp_path / "sdf")
+    random_sdf(seed=0).to_disk(path)
+
+    with pytest.raises(AssertionError):
+        random_sdf(seed=1).to_disk(path)
+
+    sdf = random_sdf(seed=1)
+    sdf.to_disk(path, overwrite=True)
+
+    assert (SparseDataFrame.open(path)._smatrix != sdf._smatrix).nnz == 0
+    assert sorted(os.listdir(str(tmp_path))) == ["sdf"]
+    assert os.path.exists(os.path.join(path, SDF_DISK_HEADER))
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from scipy import sparse
+
+from PlaYnlp.sparse import SparseDataFrame, L1_norm_col_summarizer
+
+
+def make_sdf():
+    dense = np.array([[1, 0, 2, 0],
+                      [0, 3, 0, 1],
+                      [4, 0, 0, 5],
+                      [0, 6, 7, 0],
+                      [8, 0, 0, 9]], dtype=np.int64)
+
+    return dense, SparseDataFrame(sparse.csr_matrix(dense),
+                                  col_idx=["a", "b", "c", "d"],
+                                  row_idx=["r0", "r1", "r2", "r3", "r4"],
+                                  summarizer=L1_norm_col_summarizer)
+
+
+def test_materialized_view_follows_its_own_smatrix_after_base_replacement():
+    dense, base = make_sdf()
+
+    view = base.select_rows([1, 3])
+    assert (view._smatrix.toarray() == dense[[1, 3]]).all()
+
+    base["smatrix"] = base["smatrix"] * 2
+
+    # the view keeps the smatrix it materialized, its summaries are computed from it
+    assert (view._smatrix.toarray() == dense[[1, 3]]).all()
+    assert (view.summary._data == np.abs(dense[[1, 3]]).sum(axis=0)).all()
+    assert (view.summarize_stats(("max",))._data[:, 0] == dense[[1, 3]].max(axis=0)).all()
+
+    # the base and its new views use the new smatrix
+    assert (base.summary._data == 2 * np.abs(dense).sum(axis=0)).all()
+    assert (base.select_rows([1, 3]).summary._data == 2 * np.abs(dense[[1, 3]]).sum(axis=0)).all()
+
+
+def assert_same_frame(sdf, dense, col_idx, row_idx):
+    assert sdf.shape == dense.shape
+    assert (sdf._smatrix.toarray() == dense).all()
+    assert list(sdf._col_idx) == list(col_idx)
+    assert list(sdf._row_idx) == list(row_idx)
+
+
+def test_views_match_materialized_selections():
+    dense, sdf = make_sdf()
+    col_idx, row_idx = np.array(sdf._col_idx), np.array(sdf._row_idx)
+
+    for row_ptrs in ([4, 0, 2], [-1, -5, 1], np.array([True, False, True, False, True]), slice(1, None, 2)):
+        view = sdf.select_rows(row_ptrs)
+        assert view.is_view and not view.is_materialized
+
+        # the summaries of a lazy view are computed from the base's buffers
+        assert (view.summary._data == np.abs(dense[row_ptrs]).sum(axis=0)).all()
+        assert (view.summarize_stats(("L0", "max"), axis=1)._data
+                == np.column_stack([(dense[row_ptrs] != 0).sum(axis=1), dense[row_ptrs].max(axis=1)])).all()
+
+        materialized = view.materialize()
+        assert not materialized.is_view
+        assert_same_frame(materialized, dense[row_ptrs], col_idx, row_idx[row_ptrs])
+        assert_same_frame(view, dense[row_ptrs], col_idx, row_idx[row_ptrs])
+
+    for col_ptrs in ([3, 1], [-1, 0], np.array([False, True, True, False])):
+        view = sdf.select_columns(col_ptrs)
+
+        assert (view.summarize_stats(("L1",))._data[:, 0] == np.abs(dense[:, col_ptrs]).sum(axis=0)).all()
+        assert_same_frame(view.materialize(), dense[:, col_ptrs], col_idx[col_ptrs], row_idx)
+
+
+def test_views_of_views_and_bool_summaries():
+    dense, sdf = make_sdf()
+    col_idx, row_idx = np.array(sdf._col_idx), np.array(sdf._row_idx)
+
+    # the selections on a view are composed on the same base
+    view = sdf.select_rows([-1, 1, 2, 3]).select_columns([2, 0, -1]).select_rows([-1, 0])
+    assert view["view_base"] is sdf
+    assert_same_frame(view, dense[[3, 4]][:, [2, 0, 3]], col_idx[[2, 0, 3]], row_idx[[3, 4]])
+
+    # a bool summary selects its rows / cols
+    frequent_cols = sdf.summary > 10
+    assert frequent_cols._is_bool
+    assert_same_frame(frequent_cols._sub_sdf, dense[:, [0, 3]], col_idx[[0, 3]], row_idx)
+    assert_same_frame(sdf.select_columns(frequent_cols), dense[:, [0, 3]], col_idx[[0, 3]], row_idx)
+
+    rows_max = sdf.summarize_stats(("max",), axis=1).stat("max")
+    assert_same_frame(sdf.select_rows(rows_max > 4), dense[[2, 3, 4]], col_idx, row_idx[[2, 3, 4]])
+
+    sub_view = sdf.select_rows([0, 2, 4])
+    assert_same_frame(sub_view.select_columns(sub_view.summary > 0), dense[[0, 2, 4]][:, [0, 2, 3]],
+                      col_idx[[0, 2, 3]], row_idx[[0, 2, 4]])
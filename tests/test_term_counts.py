@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+from collections import Counter
+import re
+
+import numpy as np
+import pytest
+
+from PlaYnlp.term_counts import (DEFAULT_TOKEN_PATTERN, HashedColumns, NgramTokenizer, TermColumns, count_texts,
+                                 count_texts_in_columns)
+
+
+TEXTS = [u"The cat sat on the mat", None, u"", u"the THE the", u"今天 天氣 很好 今天", u"a b c",
+         u"dog and cat and dog", float("nan"), u"x" * 5]
+
+
+def reference_counts(texts, tokenize):
+    return [Counter(tokenize(text)) if isinstance(text, str) else Counter() for text in texts]
+
+
+def assert_counts(csr, terms, counts):
+    assert csr.shape == (len(counts), len(terms))
+    assert list(terms) == sorted(set(term for text_counts in counts for term in text_counts))
+
+    rows = [dict((terms[col], count) for col, count in zip(csr.indices[csr.indptr[row]:csr.indptr[row + 1]].tolist(),
+                                                            csr.data[csr.indptr[row]:csr.indptr[row + 1]].tolist()))
+            for row in range(csr.shape[0])]
+
+    assert rows == [dict(text_counts) for text_counts in counts]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 10000])
+def test_count_texts_matches_counter(chunk_size):
+    csr, terms = count_texts(TEXTS, chunk_size=chunk_size)
+    assert_counts(csr, terms, reference_counts(TEXTS, lambda text:re.findall(DEFAULT_TOKEN_PATTERN, text.lower())))
+
+    # a custom tokenizer gets the texts as they are (as CountVectorizer's)
+    texts = [text for text in TEXTS if isinstance(text, str)]
+    csr, terms = count_texts(texts, lowercase=False, tokenizer=str.split, chunk_size=chunk_size)
+    assert_counts(csr, terms, reference_counts(texts, str.split))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 10000])
+def test_count_texts_ngram_keys_match_counter(chunk_size):
+    tokenizer = NgramTokenizer([1, 2], filter_list=[u" ", u"t"])
+
+    csr, terms = count_texts(TEXTS, tokenizer=tokenizer, chunk_size=chunk_size)
+    assert_counts(csr, terms, reference_counts(TEXTS, lambda text:tokenizer(text.lower())))
+
+    bigrams = lambda text:[text[start:start + 2] for start in range(len(text) - 1)]
+    csr, terms = count_texts(TEXTS, tokenizer=NgramTokenizer(2), lowercase=False, chunk_size=chunk_size)
+    assert_counts(csr, terms, reference_counts(TEXTS, bigrams))
+
+
+def test_count_texts_without_texts():
+    csr, terms = count_texts([])
+    assert csr.shape == (0, 0) and len(terms) == 0
+
+
+def test_count_texts_in_columns():
+    counts = reference_counts(TEXTS, lambda text:re.findall(DEFAULT_TOKEN_PATTERN, text.lower()))
+    columns = TermColumns([u"the", u"dog", u"今天", u"missing"])
+
+    csr = count_texts_in_columns(TEXTS, columns)
+    assert (csr.toarray() == [[text_counts[term] for term in columns.terms] for text_counts in counts]).all()
+
+    # ngram keys are matched against the terms' keys
+    tokenizer = NgramTokenizer(2)
+    columns = TermColumns([u"at", u"he", u"天氣", u"zz"])
+
+    csr = count_texts_in_columns(TEXTS, columns, tokenizer=tokenizer)
+    ngram_counts = reference_counts(TEXTS, lambda text:tokenizer(text.lower()))
+    assert (csr.toarray() == [[text_counts[term] for term in columns.terms] for text_counts in ngram_counts]).all()
+
+    # every token is hashed to a column, the total counts are kept
+    csr = count_texts_in_columns(TEXTS, HashedColumns(n_features=16))
+    assert csr.shape == (len(TEXTS), 16)
+    assert (np.asarray(csr.sum(axis=1)).ravel() == [sum(text_counts.values()) for text_counts in counts]).all()
+
+
+def test_hashed_columns_of_lone_surrogates():
+    text = b"ab\xff cd".decode("utf-8", "surrogateescape")
+
+    csr = count_texts_in_columns([text], HashedColumns(n_features=16), tokenizer=str.split)
+    assert csr.sum() == 2
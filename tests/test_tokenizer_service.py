@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+import os
+import stat
+import threading
+
+import pytest
+
+from PlaYnlp import tokenizer_service
+
+
+def test_missing_explicit_stopword_file_raises(tmp_path):
+    with pytest.raises(IOError):
+        tokenizer_service.TokenizerService(socket_path=str(tmp_path / "jieba.sock"), n_workers=1,
+                                           stopword_file=str(tmp_path / "stopwords_typo.txt"))
+
+
+def test_path_which_is_not_a_socket_is_kept(tmp_path):
+    socket_path = tmp_path / "jieba.sock"
+    socket_path.write_text(u"not a socket")
+
+    with pytest.raises(IOError):
+        tokenizer_service.TokenizerService(socket_path=str(socket_path), n_workers=1)
+
+    assert socket_path.read_text() == u"not a socket"
+
+
+def test_failing_worker_initializer_raises(tmp_path):
+    socket_path = str(tmp_path / "jieba.sock")
+
+    # a missing user dictionary (or a missing jieba) stops the startup instead of respawning the workers forever
+    with pytest.raises((IOError, ImportError)):
+        tokenizer_service.TokenizerService(socket_path=socket_path, n_workers=2, startup_timeout=60,
+                                           user_dicts=[str(tmp_path / "nonexistent_dict.txt")])
+
+    assert not os.path.exists(socket_path)
+
+
+def test_service_round_trip(tmp_path):
+    pytest.importorskip("jieba")
+
+    socket_path = str(tmp_path / "jieba.sock")
+    service = tokenizer_service.TokenizerService(socket_path=socket_path, n_workers=1)
+    server = threading.Thread(target=service.serve_forever)
+    server.start()
+
+    try:
+        assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+        assert stat.S_IMODE(os.stat(tokenizer_service.authkey_path(socket_path)).st_mode) == 0o600
+
+        with pytest.raises(Exception):
+            tokenizer_service.TokenizerClient(socket_path, authkey=b"wrong key")
+
+        with tokenizer_service.TokenizerClient(socket_path) as client:
+            token_lists = client.cut([u"今天天氣很好", None])
+
+            assert token_lists[1] == [] and len(token_lists[0]) > 0
+            assert client.last_batch_stats["n_texts"] == 2
+
+    finally:
+        service.close()
+        server.join()
+
+    assert not os.path.exists(socket_path)
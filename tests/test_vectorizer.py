@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("sklearn")
+
+from PlaYnlp.vectorizer import vectorize_text, vectorize_text_stream
+
+
+TEXTS = [u"ab cd ab", u"cd ef", u"", u"ab ab ab gh", u"ef cd"]
+
+
+def test_stream_with_ndarray_vocabulary_matches_vectorize_text():
+    df = pd.DataFrame({"id":list(range(1, len(TEXTS) + 1)), "text":TEXTS})
+    sdtm = vectorize_text(df, text_col="text", idx_col="id", backend="native")
+
+    chunks = [list(zip(df["id"].tolist()[:2], TEXTS[:2])), list(zip(df["id"].tolist()[2:], TEXTS[2:]))]
+    vocabulary = np.asarray(sdtm._col_idx)
+    stream_sdtm = vectorize_text_stream(chunks, vocabulary=vocabulary)
+
+    assert list(stream_sdtm._col_idx) == list(vocabulary)
+    assert list(stream_sdtm._row_idx) == list(sdtm._row_idx)
+    assert (stream_sdtm._smatrix.toarray() == sdtm._smatrix.toarray()).all()